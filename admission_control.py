@@ -0,0 +1,128 @@
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+# Уровни деградации под нагрузкой (каждый включает меры предыдущих)
+LEVEL_NORMAL = 0
+LEVEL_SHORT_HISTORY = 1   # укороченное окно истории
+LEVEL_CHEAP_MODEL = 2     # дешевая модель
+LEVEL_ACK_FIRST = 3       # мгновенное подтверждение "ответ готовится"
+LEVEL_REJECT_NEW = 4      # новые сессии /start не принимаются
+
+LEVEL_NAMES = {
+    LEVEL_NORMAL: "normal",
+    LEVEL_SHORT_HISTORY: "short_history",
+    LEVEL_CHEAP_MODEL: "cheap_model",
+    LEVEL_ACK_FIRST: "ack_first",
+    LEVEL_REJECT_NEW: "reject_new",
+}
+
+
+class AdmissionController:
+    """Следит за очередью LLM запросов и p95 задержки и выбирает уровень деградации"""
+
+    def __init__(self, depth_thresholds: List[int] = None, latency_thresholds: List[float] = None,
+                 short_history_messages: int = 20, cooldown: float = 30.0, window: int = 100,
+                 sample_max_age: float = 120.0):
+        # Пороги для уровней 1..4: число запросов в работе и p95 задержки в секундах
+        self.depth_thresholds = depth_thresholds or [8, 16, 32, 64]
+        self.latency_thresholds = latency_thresholds or [6.0, 10.0, 15.0, 25.0]
+        self.short_history_messages = short_history_messages
+        # Понижение уровня только после того, как нагрузка спала на это время
+        self.cooldown = cooldown
+        # Пары (время завершения, задержка); старые замеры не держат уровень после того, как нагрузка ушла
+        self.latencies = deque(maxlen=window)
+        self.sample_max_age = sample_max_age
+        self.in_flight = 0
+        self._level = LEVEL_NORMAL
+        self._level_since = time.monotonic()
+        self.rejected = 0
+        self.acknowledged = 0
+        self.degraded = 0
+
+    def p95_latency(self) -> Optional[float]:
+        """p95 задержки по замерам не старше sample_max_age"""
+        expired_before = time.monotonic() - self.sample_max_age
+        while self.latencies and self.latencies[0][0] < expired_before:
+            self.latencies.popleft()
+        if not self.latencies:
+            return None
+        ordered = sorted(latency for _, latency in self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def _pressure_level(self) -> int:
+        """Уровень по текущей нагрузке без учета гистерезиса"""
+        level = LEVEL_NORMAL
+        p95 = self.p95_latency()
+        for index, depth in enumerate(self.depth_thresholds, 1):
+            if self.in_flight >= depth:
+                level = max(level, index)
+        if p95 is not None:
+            for index, latency in enumerate(self.latency_thresholds, 1):
+                if p95 >= latency:
+                    level = max(level, index)
+        return level
+
+    @property
+    def level(self) -> int:
+        """Текущий уровень: повышается сразу, понижается после периода остывания"""
+        pressure = self._pressure_level()
+        now = time.monotonic()
+        if pressure > self._level:
+            self._level = pressure
+            self._level_since = now
+        elif pressure < self._level and now - self._level_since >= self.cooldown:
+            self._level = pressure
+            self._level_since = now
+        elif pressure == self._level:
+            self._level_since = now
+        return self._level
+
+    @asynccontextmanager
+    async def track(self):
+        """Учитывает запрос к LLM: глубину очереди и задержку"""
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            finished = time.monotonic()
+            self.latencies.append((finished, finished - started))
+
+    def history_window(self, protected: bool = False) -> Optional[int]:
+        """Сколько последних сообщений истории отправлять модели (None - всю историю)"""
+        if protected or self.level < LEVEL_SHORT_HISTORY:
+            return None
+        self.degraded += 1
+        return self.short_history_messages
+
+    def use_cheap_model(self, protected: bool = False) -> bool:
+        """Нужно ли переключиться на дешевую модель"""
+        return not protected and self.level >= LEVEL_CHEAP_MODEL
+
+    def should_acknowledge(self) -> bool:
+        """Нужно ли сразу ответить "ответ готовится" до обращения к модели"""
+        if self.level >= LEVEL_ACK_FIRST:
+            self.acknowledged += 1
+            return True
+        return False
+
+    def admit_new_session(self) -> bool:
+        """Можно ли начать новую сессию /start (текущие диалоги не отклоняются никогда)"""
+        if self.level >= LEVEL_REJECT_NEW:
+            self.rejected += 1
+            return False
+        return True
+
+    def get_stats(self) -> Dict:
+        p95 = self.p95_latency()
+        return {
+            "level": LEVEL_NAMES[self.level],
+            "in_flight": self.in_flight,
+            "p95_latency": round(p95, 2) if p95 is not None else None,
+            "rejected": self.rejected,
+            "acknowledged": self.acknowledged,
+            "degraded": self.degraded,
+        }
@@ -0,0 +1,241 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Состояния фоновой задачи
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+JOB_STATUS_ICONS = {
+    JOB_QUEUED: "⏳", JOB_RUNNING: "⚙️", JOB_DONE: "✅", JOB_FAILED: "⚠️", JOB_CANCELLED: "🚫",
+}
+
+
+class JobCancelled(Exception):
+    """Задача отменена администратором"""
+
+
+class Job:
+    """Фоновая задача: состояние, прогресс и флаг отмены (прогресс можно обновлять из потока)"""
+
+    def __init__(self, job_id: int, title: str, func: Callable[["Job"], Awaitable], chat_id: Optional[int] = None):
+        self.job_id = job_id
+        self.title = title
+        self.func = func
+        self.chat_id = chat_id
+        self.status = JOB_QUEUED
+        self.done = 0
+        self.total: Optional[int] = None
+        self.stage = ""
+        self.result = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # ID сообщения с прогрессом (заполняет обработчик отчетов)
+        self.message_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def report(self, done: int, total: Optional[int] = None, stage: Optional[str] = None) -> None:
+        """Обновляет прогресс; сообщение администратору редактируется отдельно, с ограничением частоты"""
+        self.done = done
+        if total is not None:
+            self.total = total
+        if stage is not None:
+            self.stage = stage
+
+    def check_cancelled(self) -> None:
+        """Прерывает работу задачи, если запрошена отмена (вызывается между шагами)"""
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def describe(self) -> str:
+        """Строка для сообщения с прогрессом и списка /jobs"""
+        text = f"{JOB_STATUS_ICONS[self.status]} #{self.job_id} {self.title}: {self.status}"
+        if self.total:
+            text += f", {self.done}/{self.total} ({100 * self.done // self.total}%)"
+        elif self.done:
+            text += f", {self.done}"
+        if self.stage:
+            text += f" — {self.stage}"
+        if self.error:
+            text += f"\nОшибка: {self.error}"
+        return text
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "title": self.title,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "stage": self.stage,
+            "error": self.error,
+        }
+
+
+class JobRunner:
+    """Очередь фоновых задач: ограниченное число исполнителей, отчеты о прогрессе и отмена"""
+
+    def __init__(self, reporter: Optional[Callable[[Job], Awaitable]] = None, workers: int = 1,
+                 progress_interval: float = 3.0, history: int = 50):
+        # reporter(job) показывает прогресс (например, редактирует сообщение); вызывается не чаще progress_interval
+        self.reporter = reporter
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.history = history
+        self.jobs: "OrderedDict[int, Job]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._stopping = False
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    async def start(self) -> None:
+        """Запускает исполнителей очереди"""
+        if self._workers:
+            return
+        self._stopping = False
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Отменяет выполняющиеся задачи и останавливает исполнителей"""
+        self._stopping = True
+        for job in self.jobs.values():
+            if not job.finished:
+                job._cancel_event.set()
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+
+    def submit(self, title: str, func: Callable[[Job], Awaitable], chat_id: Optional[int] = None) -> Job:
+        """Ставит задачу в очередь; func(job) - корутина, которая обновляет job.report и проверяет отмену"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        job = Job(next(self._ids), title, func, chat_id)
+        self.jobs[job.job_id] = job
+        self._trim_history()
+        self._queue.put_nowait(job)
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """Запрашивает отмену задачи; возвращает False, если задача не найдена или уже завершена"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel_event.set()
+        if job.status == JOB_QUEUED:
+            # Задача еще не начата: исполнитель пропустит ее
+            job.status = JOB_CANCELLED
+            job.finished_at = time.time()
+            self.cancelled += 1
+        elif job.task is not None:
+            # Прерываем ожидание внутри корутины; работа в потоке остановится на ближайшей check_cancelled
+            job.task.cancel()
+        return True
+
+    def get_job(self, job_id: int) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        """Задачи от новых к старым"""
+        return list(reversed(self.jobs.values()))
+
+    def _trim_history(self) -> None:
+        """Удаляет самые старые завершенные задачи сверх лимита истории"""
+        excess = len(self.jobs) - self.history
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished][:max(excess, 0)]:
+            del self.jobs[job_id]
+
+    async def _run(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, job: Job) -> None:
+        if job.finished:
+            return
+
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        await self._report(job)
+        job.task = asyncio.create_task(job.func(job))
+        progress = asyncio.create_task(self._report_progress(job))
+        try:
+            job.result = await job.task
+            job.status = JOB_DONE
+            self.completed += 1
+        except (JobCancelled, asyncio.CancelledError):
+            job.status = JOB_CANCELLED
+            self.cancelled += 1
+            if self._stopping:
+                # Остановлен сам исполнитель: отмена должна дойти до stop()
+                raise
+        except Exception as e:
+            logger.error(f"Фоновая задача #{job.job_id} {job.title} завершилась с ошибкой: {e}")
+            job.status = JOB_FAILED
+            job.error = str(e)
+            self.failed += 1
+        finally:
+            job.finished_at = time.time()
+            job.task = None
+            progress.cancel()
+        await self._report(job)
+
+    async def _report_progress(self, job: Job) -> None:
+        """Периодически показывает прогресс, если он изменился"""
+        last_text = job.describe()
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            text = job.describe()
+            if text != last_text:
+                last_text = text
+                await self._report(job)
+
+    async def _report(self, job: Job) -> None:
+        if self.reporter is None:
+            return
+        try:
+            await self.reporter(job)
+        except Exception as e:
+            logger.warning(f"Не удалось показать прогресс задачи #{job.job_id}: {e}")
+
+    def get_stats(self) -> Dict:
+        """Возвращает статистику очереди задач"""
+        return {
+            "queued": sum(1 for job in self.jobs.values() if job.status == JOB_QUEUED),
+            "running": sum(1 for job in self.jobs.values() if job.status == JOB_RUNNING),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
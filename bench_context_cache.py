@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк сборки тела запроса к LLM: пересборка messages + JSON против инкрементального кэша
+
+Использование: python bench_context_cache.py [ходы через запятую] [повторы]
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+from context_cache import COMPLETION_PARAMS, ContextCache
+from neuro_salesman_gpt import DEFAULT_PROMPT_PATH
+
+MODEL = "gpt-4.1-mini"
+MAX_TOKENS = 1000
+
+
+def load_system_prompt() -> str:
+    try:
+        with open(DEFAULT_PROMPT_PATH, 'r', encoding='utf-8') as file:
+            return file.read()
+    except FileNotFoundError:
+        return "Суперпромт нейропродажника. " * 3000
+
+
+def make_turn(index: int) -> List[Dict]:
+    """Одна пара сообщений в формате истории NeuroSalesmanGPT"""
+    user = f"Сообщение клиента номер {index}: у нас 40 вакансий, интересует тариф и интеграция с hh.ru"
+    assistant = json.dumps({
+        "agent_communication": {"агент-блока": "Квалификация", "агент-профайла": {"статус_профайла": {}}},
+        "message": f"Ответ нейропродажника номер {index}. " * 8,
+    }, ensure_ascii=False)
+    return [
+        {"role": "user", "content": user, "timestamp": "2025-08-19T14:42:53"},
+        {"role": "assistant", "content": assistant, "timestamp": "2025-08-19T14:42:55"},
+    ]
+
+
+def rebuild_body(system_prompt: str, history: List[Dict], tail: List[Dict]) -> bytes:
+    """Прежний путь: копия каждого сообщения истории и JSON кодирование всего запроса (как в httpx)"""
+    messages = [{"role": "system", "content": system_prompt}]
+    for msg in history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    messages.extend(tail)
+    payload = dict(COMPLETION_PARAMS, model=MODEL, max_tokens=MAX_TOKENS, messages=messages)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def cached_body(cache: ContextCache, history: List[Dict], tail: List[Dict]) -> bytes:
+    """Новый путь: дописываются только новые сообщения, тело собирается из готовых байтов"""
+    cache.update(1, history)
+    return cache.context(1, tail).body(MODEL, MAX_TOKENS)
+
+
+def measure(turns: int, repeats: int, system_prompt: str) -> Dict:
+    """Среднее время и объем выделенной памяти на ход для обоих путей"""
+    results = {"turns": turns}
+    for name in ("rebuild", "cached"):
+        history = [message for index in range(turns) for message in make_turn(index)]
+        cache = ContextCache(system_prompt)
+        cache.update(1, history)
+        new_turns = [make_turn(turns + index) for index in range(repeats)]
+        tail = [{"role": "user", "content": "Сколько стоит тариф на 40 вакансий?"}]
+
+        elapsed = 0.0
+        allocated = 0
+        body = b""
+        for turn in new_turns:
+            history.extend(turn)
+            tracemalloc.start()
+            started = time.perf_counter()
+            if name == "rebuild":
+                body = rebuild_body(system_prompt, history, tail)
+            else:
+                body = cached_body(cache, history, tail)
+            elapsed += time.perf_counter() - started
+            # Пиковая память хода: временные объекты плюс итоговое тело
+            allocated += tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results[name] = {
+            "us_per_turn": elapsed / repeats * 1_000_000,
+            "kb_per_turn": allocated / repeats / 1024,
+            "body_kb": len(body) / 1024,
+        }
+    return results
+
+
+def format_results(results: List[Dict]) -> str:
+    lines = ["ходов | путь    | мкс/ход | пик КБ/ход | тело КБ", "------+---------+---------+------------+--------"]
+    for item in results:
+        for name in ("rebuild", "cached"):
+            stats = item[name]
+            lines.append(f"{item['turns']:5} | {name:7} | {stats['us_per_turn']:7.0f} | "
+                         f"{stats['kb_per_turn']:10.0f} | {stats['body_kb']:6.0f}")
+        speedup = item["rebuild"]["us_per_turn"] / max(item["cached"]["us_per_turn"], 1e-9)
+        lines.append(f"      | ускорение: x{speedup:.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    turn_counts = [int(value) for value in sys.argv[1].split(",")] if len(sys.argv) > 1 else [50, 200]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    prompt = load_system_prompt()
+    print(format_results([measure(turns, repeats, prompt) for turns in turn_counts]))
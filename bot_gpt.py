@@ -1,99 +1,437 @@
+from __future__ import annotations
+
 import asyncio
 import logging
 import os
 from datetime import datetime
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.enums import ParseMode
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from config import (
+    BOT_TOKEN, DIALOGS_FOLDER, OPENAI_API_KEY,
+    LLM_PRIMARY_MODEL, LLM_FAST_MODEL, LLM_FALLBACK_MODEL, LLM_TIMEOUT_SECONDS, LLM_ROUTES_FILE,
+    SPECULATIVE_ENABLED, SPECULATIVE_PREWARM, ADMIN_IDS, LOOP_LAG_THRESHOLD_MS,
+    RETRIEVAL_ENABLED, RETRIEVAL_TOP_K, RETRIEVAL_INDEX_FOLDER,
+    TOKEN_BUDGET_USER_DAILY, TOKEN_BUDGET_DAILY, TOKEN_BUDGET_ACTION, EXPORTS_FOLDER,
+    SESSION_SNAPSHOT_SECONDS, SESSION_LOG_FSYNC
+)
+from send_pipeline import LANE_NOTICE
+from dialog_fsm import EVENT_FEEDBACK, EVENT_FINISH, EVENT_FINISHED, EVENT_RESET, EVENT_START, STATE_ACTIVE
 
-from config import BOT_TOKEN, DIALOGS_FOLDER, OPENAI_API_KEY
-from neuro_salesman_gpt import NeuroSalesmanGPT
-from dialog_logger import DialogLogger
+if TYPE_CHECKING:
+    from aiogram.types import CallbackQuery, Message
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
-
-# Инициализация нейропродажника с GPT и логгера
-neuro_salesman = NeuroSalesmanGPT(api_key=OPENAI_API_KEY)
-dialog_logger = DialogLogger(DIALOGS_FOLDER)
-
-# Словарь для отслеживания активных диалогов
-active_dialogs = {}
-
-# Словарь для отслеживания пользователей, ожидающих отзыв
-waiting_for_feedback = {}
-
 # Настройки таймаута
 TIMEOUT_MINUTES = 10
 CLEANUP_INTERVAL_SECONDS = 60  # Проверяем каждую минуту
 
+
+class BotApplication:
+    """Компоненты бота: создаются при первом обращении, а не при импорте модуля"""
+    
+    def __init__(self, token: str = None, openai_api_key: str = None, dialogs_folder: str = None,
+                 docx_folder: str = None, prompt_path: str = None, retrieval_index_folder: str = None,
+                 router=None, admin_ids=None, name: str = None, shared=None):
+        self.token = token or BOT_TOKEN
+        self.openai_api_key = openai_api_key or OPENAI_API_KEY
+        self.dialogs_folder = dialogs_folder or DIALOGS_FOLDER
+        self.docx_folder = docx_folder or "dialogs_docx"
+        self.prompt_path = prompt_path
+        self.retrieval_index_folder = retrieval_index_folder or RETRIEVAL_INDEX_FOLDER
+        self.admin_ids = ADMIN_IDS if admin_ids is None else set(admin_ids)
+        self.name = name
+        # Общие ресурсы процесса в мультибот-режиме (multi_bot.SharedResources): клиент LLM, лимитер, пул потоков
+        self.shared = shared
+        
+        # Ссылки на фоновые задачи (чтобы их не собрал сборщик мусора)
+        self.background_tasks = set()
+        
+        self._bot = None
+        self._dispatcher = None
+        self._send_pipeline = None
+        self._docx_delivery = None
+        self._model_router = router
+        self._neuro_salesman = None
+        self._admission = None
+        self._retrieval_index = None
+        self._token_budget = None
+        self._dialog_logger = None
+        self._speculative = None
+        self._profiler = None
+        self._loop_monitor = None
+        self._handler_timings = None
+        self._deduplicator = None
+        self._dialog_fsm = None
+        self._job_runner = None
+        self._session_store = None
+    
+    @property
+    def bot(self):
+        """Telegram бот (aiogram загружается при первом обращении)"""
+        if self._bot is None:
+            from aiogram import Bot
+            if self.shared is not None:
+                self._bot = Bot(token=self.token, session=self.shared.bot_session)
+            else:
+                self._bot = Bot(token=self.token)
+        return self._bot
+    
+    @property
+    def dispatcher(self):
+        """Диспетчер с зарегистрированными обработчиками"""
+        if self._dispatcher is None:
+            self._dispatcher = build_dispatcher(self)
+        return self._dispatcher
+    
+    @property
+    def send_pipeline(self):
+        """Единая очередь исходящих сообщений (живые ответы впереди уведомлений и файлов)"""
+        if self._send_pipeline is None:
+            from send_pipeline import SendPipeline
+            self._send_pipeline = SendPipeline(self.bot)
+        return self._send_pipeline
+    
+    @property
+    def docx_delivery(self):
+        """Отправка DOCX файлов с диска с повторным использованием file_id"""
+        if self._docx_delivery is None:
+            from docx_delivery import DocxDelivery
+            self._docx_delivery = DocxDelivery(self.send_pipeline, os.path.join(self.docx_folder, ".file_ids.json"))
+        return self._docx_delivery
+    
+    @property
+    def model_router(self):
+        """Маршрутизатор моделей: дешевая модель для простых ходов, основная для переговоров"""
+        if self._model_router is None:
+            from model_router import ModelRouter
+            if LLM_ROUTES_FILE:
+                self._model_router = ModelRouter.from_file(LLM_ROUTES_FILE)
+            else:
+                self._model_router = ModelRouter.default(
+                    LLM_PRIMARY_MODEL, LLM_FAST_MODEL, LLM_FALLBACK_MODEL, LLM_TIMEOUT_SECONDS
+                )
+        return self._model_router
+    
+    @property
+    def neuro_salesman(self):
+        """Нейропродажник с GPT (клиент OpenAI создается при первом запросе)"""
+        if self._neuro_salesman is None:
+            from neuro_salesman_gpt import NeuroSalesmanGPT
+            self._neuro_salesman = NeuroSalesmanGPT(
+                api_key=self.openai_api_key, router=self.model_router, admission=self.admission,
+                retriever=self.retrieval_index, retrieval_top_k=RETRIEVAL_TOP_K, budget=self.token_budget,
+                prompt_path=self.prompt_path, client=self.shared.llm_client if self.shared is not None else None
+            )
+        return self._neuro_salesman
+    
+    @property
+    def token_budget(self):
+        """Дневные бюджеты токенов и стоимость завершенных диалогов"""
+        if self._token_budget is None:
+            from token_budget import TokenBudget
+            self._token_budget = TokenBudget(
+                user_daily_tokens=TOKEN_BUDGET_USER_DAILY, daily_tokens=TOKEN_BUDGET_DAILY, action=TOKEN_BUDGET_ACTION,
+                state_path=os.path.join(self.dialogs_folder, ".token_usage.json")
+            )
+        return self._token_budget
+    
+    @property
+    def retrieval_index(self):
+        """Индекс успешных диалогов (None, если отключен)"""
+        if self._retrieval_index is None and RETRIEVAL_ENABLED:
+            from retrieval import DialogIndex
+            self._retrieval_index = DialogIndex(self.retrieval_index_folder)
+        return self._retrieval_index
+    
+    @property
+    def admission(self):
+        """Контроль нагрузки: деградация ответов и прием новых сессий (общий для всех ботов процесса)"""
+        if self._admission is None:
+            if self.shared is not None:
+                self._admission = self.shared.admission
+            else:
+                from admission_control import AdmissionController
+                self._admission = AdmissionController()
+        return self._admission
+    
+    @property
+    def dialog_logger(self):
+        """Логгер диалогов (DOCX стек загружается при первом экспорте)"""
+        if self._dialog_logger is None:
+            from dialog_logger import DialogLogger
+            self._dialog_logger = DialogLogger(
+                self.dialogs_folder, retrieval_index=self.retrieval_index, docx_folder=self.docx_folder
+            )
+        return self._dialog_logger
+    
+    @property
+    def speculative(self):
+        """Подготовка следующего хода, пока пользователь печатает"""
+        if self._speculative is None:
+            from speculative import SpeculativeEngine
+            self._speculative = SpeculativeEngine(
+                self.neuro_salesman, enabled=SPECULATIVE_ENABLED, prewarm=SPECULATIVE_PREWARM
+            )
+        return self._speculative
+    
+    @property
+    def profiler(self):
+        """Профилирование по запросу администратора (профилируется весь процесс)"""
+        if self._profiler is None:
+            if self.shared is not None:
+                self._profiler = self.shared.profiler
+            else:
+                from profiling import SamplingProfiler
+                self._profiler = SamplingProfiler()
+        return self._profiler
+    
+    @property
+    def loop_monitor(self):
+        """Монитор задержки цикла событий (один на цикл событий)"""
+        if self._loop_monitor is None:
+            if self.shared is not None:
+                self._loop_monitor = self.shared.loop_monitor
+            else:
+                from profiling import LoopLagMonitor
+                self._loop_monitor = LoopLagMonitor(threshold_ms=LOOP_LAG_THRESHOLD_MS)
+        return self._loop_monitor
+    
+    @property
+    def handler_timings(self):
+        """Время выполнения обработчиков"""
+        if self._handler_timings is None:
+            from profiling import HandlerTimings
+            self._handler_timings = HandlerTimings()
+        return self._handler_timings
+    
+    @property
+    def dialog_fsm(self):
+        """Состояния диалогов пользователей (сохраняются между перезапусками)"""
+        if self._dialog_fsm is None:
+            from dialog_fsm import DialogStateMachine
+            self._dialog_fsm = DialogStateMachine(os.path.join(self.dialogs_folder, ".dialog_states.json"))
+        return self._dialog_fsm
+    
+    @property
+    def deduplicator(self):
+        """Защита от повторной доставки обновлений Telegram"""
+        if self._deduplicator is None:
+            from idempotency import UpdateDeduplicator
+            self._deduplicator = UpdateDeduplicator(
+                os.path.join(self.dialogs_folder, ".update_state.json"),
+                sender=lambda chat_id, text, **kwargs: self.send_pipeline.send_message(chat_id, text, **kwargs)
+            )
+        return self._deduplicator
+    
+    @property
+    def session_store(self):
+        """Снимок и журнал живых диалогов для восстановления после сбоя"""
+        if self._session_store is None:
+            from session_store import SessionStore
+            self._session_store = SessionStore(self.dialogs_folder, fsync=SESSION_LOG_FSYNC)
+        return self._session_store
+    
+    @property
+    def job_runner(self):
+        """Очередь фоновых задач администратора (выгрузки)"""
+        if self._job_runner is None:
+            from background_jobs import JobRunner
+            self._job_runner = JobRunner(reporter=lambda job: report_job_progress(self, job))
+        return self._job_runner
+    
+    def is_admin(self, user_id: int) -> bool:
+        """Проверяет, входит ли пользователь в администраторы бота (по умолчанию ADMIN_IDS)"""
+        return user_id in self.admin_ids
+    
+    async def startup(self):
+        """Запускает фоновые компоненты бота (без опроса Telegram)"""
+        logger.info(f"Запуск бота с GPT{f' {self.name}' if self.name else ''}...")
+        logger.info(f"Таймаут неактивности: {TIMEOUT_MINUTES} минут")
+        
+        # Диалоги, прерванные перезапуском во время завершения, ждут отзыва
+        interrupted = self.dialog_fsm.restore_interrupted()
+        
+        # Запускаем очередь исходящих сообщений и монитор задержки цикла событий
+        await self.send_pipeline.start()
+        await self.job_runner.start()
+        self.loop_monitor.start()
+        
+        # Восстанавливаем живые диалоги и завершаем те, чей таймаут истек, пока бот не работал
+        recover_sessions(self, interrupted)
+        self.background_tasks.add(asyncio.create_task(snapshot_sessions(self)))
+        
+        # Запускаем фоновую задачу очистки неактивных диалогов
+        self.background_tasks.add(asyncio.create_task(cleanup_inactive_dialogs(self)))
+        
+        # Дописываем в индекс успешные диалоги из архива, не блокируя цикл событий
+        if self.retrieval_index is not None:
+            self.background_tasks.add(asyncio.create_task(
+                asyncio.to_thread(self.retrieval_index.sync, self.dialogs_folder)
+            ))
+        
+        # Словарь tiktoken (если он есть в локальном кэше) загружается вне цикла событий
+        self.background_tasks.add(asyncio.create_task(
+            asyncio.to_thread(getattr, self.neuro_salesman.token_counter, "encoding")
+        ))
+        
+        # Заранее генерируем приветствие для /start
+        self.background_tasks.add(asyncio.create_task(self.speculative.refill_openers()))
+    
+    async def shutdown(self):
+        """Сохраняет состояние и останавливает фоновые задачи"""
+        # Фоновые задачи останавливаются до закрытия общих ресурсов (HTTP сессии и пула потоков)
+        tasks = list(self.background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.background_tasks.clear()
+        if self._speculative is not None:
+            await self._speculative.stop()
+        await self.job_runner.stop()
+        # Досылаем очередь исходящих (уведомления о таймауте, DOCX); неотправленное завершается ошибкой
+        await self.send_pipeline.stop()
+        
+        self.deduplicator.save()
+        self.token_budget.save()
+        self.session_store.snapshot()
+        self.session_store.close()
+    
+    async def run(self):
+        """Запускает бота"""
+        await self.startup()
+        try:
+            await self.dispatcher.start_polling(self.bot)
+        finally:
+            await self.shutdown()
+
 # Создаем клавиатуру с кнопкой остановки диалога
 def get_stop_keyboard():
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🛑 Остановить диалог", callback_data="stop_dialog")]
     ])
     return keyboard
 
-@dp.callback_query(lambda c: c.data == "stop_dialog")
-async def process_stop_dialog_callback(callback_query: types.CallbackQuery):
+def finish_user_dialog(app: BotApplication, user_id: int, reason: str) -> Optional[Tuple[str, str]]:
+    """Завершает активный диалог и переводит пользователя к ожиданию отзыва; None, если диалог не активен"""
+    # Повторное завершение (двойное нажатие, гонка с таймаутом) отсекается переходом состояния
+    if not app.dialog_fsm.transition(user_id, EVENT_FINISH):
+        return None
+    json_filepath = docx_filepath = None
+    try:
+        json_filepath, docx_filepath = app.dialog_logger.finish_dialog(user_id, reason=reason)
+        app.session_store.record_end(user_id)
+        if json_filepath:
+            logger.info(f"Диалог пользователя {user_id} завершен ({reason}) и сохранен в {json_filepath}")
+        if docx_filepath:
+            logger.info(f"DOCX файл пользователя {user_id} создан: {docx_filepath}")
+    finally:
+        app.dialog_fsm.transition(user_id, EVENT_FINISHED)
+    usage = app.token_budget.finish_dialog(user_id, reason)
+    if usage:
+        logger.info(f"Расход диалога пользователя {user_id}: {usage['tokens']} токенов, ${usage['cost']:.4f}")
+    return json_filepath, docx_filepath
+
+def finish_detached_dialog(app: BotApplication, user_id: int, reason: str) -> Optional[Tuple[str, str]]:
+    """Сохраняет диалог логгера, который уже не активен в FSM (например, после /reset); None, если его нет"""
+    if user_id not in app.dialog_logger.current_dialogs:
+        return None
+    json_filepath, docx_filepath = app.dialog_logger.finish_dialog(user_id, reason=reason)
+    app.session_store.record_end(user_id)
+    logger.info(f"Неактивный диалог пользователя {user_id} без активного состояния сохранен ({reason})")
+    return json_filepath, docx_filepath
+
+def reset_user_conversation(app: BotApplication, user_id: int) -> None:
+    """Сбрасывает историю модели и записывает сброс в журнал живых сессий"""
+    app.neuro_salesman.reset_conversation(user_id)
+    app.session_store.record_reset(user_id)
+
+def log_turn(app: BotApplication, user_id: int, user_message: str, response: str, agent_communication) -> None:
+    """Логирует ход диалога и записывает его в журнал сессий"""
+    message_data = app.dialog_logger.add_message(user_id, user_message, response, agent_communication)
+    try:
+        app.session_store.record_turn(user_id, message_data, app.neuro_salesman.get_conversation_history(user_id))
+    except Exception as e:
+        logger.error(f"Не удалось записать ход пользователя {user_id} в журнал сессий: {e}")
+
+def recover_sessions(app: BotApplication, interrupted=()) -> None:
+    """Восстанавливает диалоги из снимка и журнала и пакетно завершает истекшие за время простоя"""
+    sessions = app.session_store.recover()
+    for user_id, session in sessions.items():
+        dialog = session["dialog"]
+        app.dialog_logger.restore_dialog(user_id, dialog)
+        last_communication = dialog["messages"][-1].get("agent_communication") if dialog["messages"] else None
+        app.neuro_salesman.restore_conversation(
+            user_id, session["history"], last_communication if isinstance(last_communication, dict) else None
+        )
+    
+    # Завершение, прерванное перезапуском: пользователь уже ждет отзыва, сохраняем диалог
+    for user_id in interrupted:
+        if user_id in sessions:
+            app.dialog_logger.finish_dialog(user_id, reason="interrupted")
+            app.session_store.record_end(user_id)
+    
+    # Таймауты, истекшие за время простоя
+    expired = [user_id for user_id in app.dialog_logger.get_inactive_dialogs(TIMEOUT_MINUTES) if user_id in sessions]
+    for user_id in expired:
+        if finish_user_dialog(app, user_id, reason="timeout"):
+            app.send_pipeline.enqueue(
+                user_id,
+                "send_message",
+                LANE_NOTICE,
+                text=f"Диалог автоматически завершен из-за неактивности ({TIMEOUT_MINUTES} минут). Пожалуйста, напишите ваш отзыв о работе бота:"
+            )
+    
+    stats = app.session_store.get_stats()
+    logger.info(f"Восстановлено диалогов: {stats['recovered']} (записей журнала {stats['replayed']}) "
+                f"за {stats['recovery_seconds']:.3f}с, завершено по таймауту: {len(expired)}")
+
+async def snapshot_sessions(app: BotApplication):
+    """Фоновая задача: периодический снимок живых диалогов (сериализация вне цикла событий)"""
+    while True:
+        await asyncio.sleep(SESSION_SNAPSHOT_SECONDS)
+        try:
+            seq, sessions = app.session_store.begin_snapshot()
+            await asyncio.to_thread(app.session_store.write_snapshot, seq, sessions)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении снимка диалогов: {e}")
+
+async def process_stop_dialog_callback(callback_query: CallbackQuery, app: BotApplication):
     """Обработчик нажатия кнопки остановки диалога"""
     user_id = callback_query.from_user.id
     
-    # Завершаем диалог
-    json_filepath, docx_filepath = dialog_logger.finish_dialog(user_id, reason="button_stop")
-    if json_filepath:
-        logger.info(f"Диалог пользователя {user_id} завершен через кнопку и сохранен в {json_filepath}")
-    if docx_filepath:
-        logger.info(f"DOCX файл пользователя {user_id} создан: {docx_filepath}")
-    
-    # Удаляем из активных диалогов
-    if user_id in active_dialogs:
-        del active_dialogs[user_id]
-    
-    # Отправляем запрос на отзыв
-    await callback_query.message.answer("🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
-    waiting_for_feedback[user_id] = True
+    # Завершаем диалог и отправляем запрос на отзыв
+    if finish_user_dialog(app, user_id, reason="button_stop"):
+        await app.send_pipeline.send_message(callback_query.message.chat.id, "🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
     
     # Отвечаем на callback
     await callback_query.answer("Диалог остановлен")
 
 
-async def cleanup_inactive_dialogs():
+async def cleanup_inactive_dialogs(app: BotApplication):
     """Фоновая задача для очистки неактивных диалогов"""
     while True:
         try:
             # Получаем список неактивных диалогов
-            inactive_users = dialog_logger.get_inactive_dialogs(TIMEOUT_MINUTES)
+            inactive_users = app.dialog_logger.get_inactive_dialogs(TIMEOUT_MINUTES)
             
             for user_id in inactive_users:
-                if user_id in active_dialogs:
-                    logger.info(f"Завершение неактивного диалога пользователя {user_id} (таймаут {TIMEOUT_MINUTES} минут)")
-                    
-                    # Завершаем диалог
-                    json_filepath, docx_filepath = dialog_logger.finish_dialog(user_id, reason="timeout")
-                    if json_filepath:
-                        logger.info(f"Диалог пользователя {user_id} сохранен в {json_filepath}")
-                    if docx_filepath:
-                        logger.info(f"DOCX файл пользователя {user_id} создан: {docx_filepath}")
+                if finish_user_dialog(app, user_id, reason="timeout"):
+                    logger.info(f"Неактивный диалог пользователя {user_id} завершен (таймаут {TIMEOUT_MINUTES} минут)")
                     
-                    # Удаляем из активных диалогов
-                    del active_dialogs[user_id]
-                    
-                    # Отправляем уведомление пользователю и запрос на отзыв
-                    try:
-                        await bot.send_message(
-                            user_id, 
-                            f"Диалог автоматически завершен из-за неактивности ({TIMEOUT_MINUTES} минут). Пожалуйста, напишите ваш отзыв о работе бота:"
-                        )
-                        waiting_for_feedback[user_id] = True
-                    except Exception as e:
-                        logger.warning(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+                    # Ставим уведомление в очередь (без всплеска при массовом таймауте) и ждем отзыв
+                    app.send_pipeline.enqueue(
+                        user_id,
+                        "send_message",
+                        LANE_NOTICE,
+                        text=f"Диалог автоматически завершен из-за неактивности ({TIMEOUT_MINUTES} минут). Пожалуйста, напишите ваш отзыв о работе бота:"
+                    )
+                else:
+                    # Диалог уже не активен (/reset): сохраняем без запроса отзыва, чтобы не копился в памяти
+                    finish_detached_dialog(app, user_id, reason="timeout")
             
             # Ждем до следующей проверки
             await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
@@ -102,21 +440,28 @@ async def cleanup_inactive_dialogs():
             logger.error(f"Ошибка в фоновой задаче очистки: {e}")
             await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
 
-@dp.message(Command("start"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, app: BotApplication):
     """Обработчик команды /start"""
     user_id = message.from_user.id
     
+    # При перегрузке не начинаем новые сессии (текущие диалоги продолжаются)
+    if not app.dialog_fsm.is_active(user_id) and not app.admission.admit_new_session():
+        await app.send_pipeline.send_message(
+            message.chat.id, "⏳ Сейчас бот перегружен. Пожалуйста, попробуйте начать диалог через пару минут."
+        )
+        return
+    
     # Приветственное сообщение
     welcome_text = """Этот бот предназначен для тестирования промта нейропродажника, проведите с ботом ролевой диалог в котором вы выступаете в качестве HR специалиста или работника кадров. Для завершения диалога напишите СТОП или нажмите кнопку 'Остановить диалог'. После завершения диалога вы можете оставить отзыв и комментарии о работе бота, что понравилось или какие бот допустил ошибки. Начнем диалог через пару секунд!"""
     
-    await message.answer(welcome_text, reply_markup=get_stop_keyboard())
+    await app.send_pipeline.send_message(message.chat.id, welcome_text, reply_markup=get_stop_keyboard())
+    app.deduplicator.remember_reply(message.chat.id, message.message_id, welcome_text, reply_markup=get_stop_keyboard())
     
     # Отмечаем начало диалога
-    active_dialogs[user_id] = True
+    app.dialog_fsm.transition(user_id, EVENT_START)
     
     # Сбрасываем предыдущую историю для этого пользователя
-    neuro_salesman.reset_conversation(user_id)
+    reset_user_conversation(app, user_id)
     
     # Генерируем первое сообщение от нейропродажника
     first_message = """Привет! 👋
@@ -127,145 +472,122 @@ async def cmd_start(message: Message):
 
 Как прошел ваш пробный период, все ли функции удалось протестировать?"""
     
-    # Обрабатываем первое сообщение через нейропродажника
-    response, agent_communication = neuro_salesman.process_message(user_id, "начало диалога")
+    # Обрабатываем первое сообщение через нейропродажника (используем заготовку, если есть)
+    from aiogram.utils.chat_action import ChatActionSender
+    async with ChatActionSender.typing(bot=app.bot, chat_id=message.chat.id):
+        response, agent_communication = await app.speculative.start_dialog(user_id)
     
     # Логируем первое сообщение (response уже содержит только текст для пользователя)
-    dialog_logger.add_message(user_id, "начало диалога", response, agent_communication)
+    log_turn(app, user_id, "начало диалога", response, agent_communication)
+    
+    await app.send_pipeline.send_message(message.chat.id, response, reply_markup=get_stop_keyboard())
+    app.deduplicator.remember_reply(message.chat.id, message.message_id, response, reply_markup=get_stop_keyboard())
+    app.speculative.schedule_next_turn(user_id)
+
+async def send_dialog_docx(app: BotApplication, user_id: int, chat_id: int):
+    """Отправляет DOCX файл с историей диалога и предлагает пройти переписку еще раз"""
+    try:
+        docx_filepath = app.dialog_logger.get_latest_docx_path(user_id)
+        if docx_filepath and os.path.exists(docx_filepath):
+            await app.docx_delivery.send_file(
+                chat_id,
+                docx_filepath,
+                caption="📄 История вашего диалога с нейропродажником (включая ваш отзыв)"
+            )
+        else:
+            await app.send_pipeline.send_message(chat_id, "📄 DOCX файл с историей диалога будет доступен позже.")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке DOCX файла: {e}")
+        await app.send_pipeline.send_message(chat_id, "📄 История диалога сохранена, но возникла проблема с отправкой файла.")
     
-    await message.answer(response, reply_markup=get_stop_keyboard())
+    # Предлагаем пройти переписку еще раз
+    await app.send_pipeline.send_message(chat_id, "🎯 Хотите пройти переписку еще раз? Нажмите /start для начала нового диалога.")
 
-@dp.message()
-async def handle_message(message: Message):
+async def handle_message(message: Message, app: BotApplication):
     """Обработчик всех остальных сообщений"""
     user_id = message.from_user.id
     user_message = message.text
     
     # Проверяем, ожидается ли отзыв от пользователя
-    if user_id in waiting_for_feedback:
+    if app.dialog_fsm.is_awaiting_feedback(user_id):
         # Сохраняем отзыв в DOCX файл
         try:
-            feedback_saved = dialog_logger.add_feedback_to_docx(user_id, user_message)
+            feedback_saved = app.dialog_logger.add_feedback_to_docx(user_id, user_message)
             if feedback_saved:
-                await message.answer("✅ Спасибо за ваш отзыв! Он сохранен в истории диалога.")
+                await app.send_pipeline.send_message(message.chat.id, "✅ Спасибо за ваш отзыв! Он сохранен в истории диалога.")
             else:
-                await message.answer("⚠️ Не удалось сохранить отзыв, но спасибо за обратную связь!")
+                await app.send_pipeline.send_message(message.chat.id, "⚠️ Не удалось сохранить отзыв, но спасибо за обратную связь!")
         except Exception as e:
             logger.error(f"Ошибка при сохранении отзыва: {e}")
-            await message.answer("⚠️ Произошла ошибка при сохранении отзыва, но спасибо за обратную связь!")
+            await app.send_pipeline.send_message(message.chat.id, "⚠️ Произошла ошибка при сохранении отзыва, но спасибо за обратную связь!")
         
-        # Удаляем из ожидающих отзыв
-        del waiting_for_feedback[user_id]
+        # Отзыв получен, диалог закрыт
+        app.dialog_fsm.transition(user_id, EVENT_FEEDBACK)
         
-        # Отправляем DOCX файл пользователю
-        try:
-            docx_filepath = dialog_logger.get_latest_docx_path(user_id)
-            if docx_filepath and os.path.exists(docx_filepath):
-                with open(docx_filepath, 'rb') as docx_file:
-                    await message.answer_document(
-                        types.BufferedInputFile(
-                            docx_file.read(),
-                            filename=f"dialog_{user_id}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.docx"
-                        ),
-                        caption="📄 История вашего диалога с нейропродажником (включая ваш отзыв)"
-                    )
-            else:
-                await message.answer("📄 DOCX файл с историей диалога будет доступен позже.")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке DOCX файла: {e}")
-            await message.answer("📄 История диалога сохранена, но возникла проблема с отправкой файла.")
-        
-        # Предлагаем пройти переписку еще раз
-        await message.answer("🎯 Хотите пройти переписку еще раз? Нажмите /start для начала нового диалога.")
+        # Отправляем DOCX файл пользователю в фоне, не задерживая обработчик
+        task = asyncio.create_task(send_dialog_docx(app, user_id, message.chat.id))
+        app.background_tasks.add(task)
+        task.add_done_callback(app.background_tasks.discard)
         return
     
     # Проверяем, активен ли диалог
-    if user_id not in active_dialogs:
-        await message.answer("Пожалуйста, начните диалог с команды /start")
+    if not app.dialog_fsm.is_active(user_id):
+        await app.send_pipeline.send_message(message.chat.id, "Пожалуйста, начните диалог с команды /start")
         return
     
     try:
         # Проверяем, не написал ли пользователь "стоп"
         if user_message.lower().strip() == "стоп":
-            # Завершаем диалог
-            json_filepath, docx_filepath = dialog_logger.finish_dialog(user_id, reason="user_stop")
-            if json_filepath:
-                logger.info(f"Диалог пользователя {user_id} завершен по команде 'стоп' и сохранен в {json_filepath}")
-            if docx_filepath:
-                logger.info(f"DOCX файл пользователя {user_id} создан: {docx_filepath}")
-            
-            # Удаляем из активных диалогов
-            if user_id in active_dialogs:
-                del active_dialogs[user_id]
-            
-            # Отправляем запрос на отзыв
-            await message.answer("🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
-            waiting_for_feedback[user_id] = True
+            # Завершаем диалог и отправляем запрос на отзыв
+            if finish_user_dialog(app, user_id, reason="user_stop"):
+                await app.send_pipeline.send_message(message.chat.id, "🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
             return
         
-        # Обрабатываем сообщение через нейропродажника с GPT
-        response, agent_communication = neuro_salesman.process_message(user_id, user_message)
+        # Под высокой нагрузкой сразу подтверждаем получение, чтобы клиент не ждал молча
+        if app.admission.should_acknowledge():
+            await app.send_pipeline.send_message(message.chat.id, "⏳ Сообщение получено, ответ готовится...")
+        
+        # Обрабатываем сообщение через нейропродажника с GPT, показывая "печатает..."
+        from aiogram.utils.chat_action import ChatActionSender
+        async with ChatActionSender.typing(bot=app.bot, chat_id=message.chat.id):
+            response, agent_communication = await app.neuro_salesman.process_message(user_id, user_message)
         
         # Логируем сообщение (response уже содержит только текст для пользователя)
-        dialog_logger.add_message(user_id, user_message, response, agent_communication)
+        log_turn(app, user_id, user_message, response, agent_communication)
         
         # Отправляем ответ пользователю с кнопкой остановки
-        await message.answer(response, reply_markup=get_stop_keyboard())
+        await app.send_pipeline.send_message(message.chat.id, response, reply_markup=get_stop_keyboard())
+        app.deduplicator.remember_reply(message.chat.id, message.message_id, response, reply_markup=get_stop_keyboard())
+        app.speculative.schedule_next_turn(user_id)
         
-        # Проверяем, не завершился ли диалог (например, пользователь согласился на покупку)
-        # Используем только слово "стоп" для завершения диалога
-        if "стоп" in response.lower():
-            # Завершаем диалог
-            json_filepath, docx_filepath = dialog_logger.finish_dialog(user_id, reason="success")
-            if json_filepath:
-                logger.info(f"Диалог пользователя {user_id} сохранен в {json_filepath}")
-            if docx_filepath:
-                logger.info(f"DOCX файл пользователя {user_id} создан: {docx_filepath}")
-            
-            # Удаляем из активных диалогов
-            if user_id in active_dialogs:
-                del active_dialogs[user_id]
-            
-            # Отправляем запрос на отзыв
-            await message.answer("🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
-            waiting_for_feedback[user_id] = True
+        # Модель сама отмечает завершение диалога флагом dialog_finished и итогом dialog_outcome в JSON ответа:
+        # покупка сохраняется как success (и попадает в индекс примеров), отказ - как refusal
+        finish_reason = app.neuro_salesman.take_dialog_finished(user_id)
+        if finish_reason:
+            if finish_user_dialog(app, user_id, reason=finish_reason):
+                await app.send_pipeline.send_message(message.chat.id, "🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
                 
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения: {e}")
-        await message.answer("Извините, произошла ошибка. Попробуйте еще раз.")
+        await app.send_pipeline.send_message(message.chat.id, "Извините, произошла ошибка. Попробуйте еще раз.")
 
-@dp.message(Command("stop"))
-async def cmd_stop(message: Message):
+async def cmd_stop(message: Message, app: BotApplication):
     """Обработчик команды /stop для завершения диалога"""
     user_id = message.from_user.id
     
-    # Всегда пытаемся завершить диалог, даже если его нет в active_dialogs
-    json_filepath, docx_filepath = dialog_logger.finish_dialog(user_id, reason="manual")
-    if json_filepath:
-        logger.info(f"Диалог пользователя {user_id} сохранен в {json_filepath}")
-    if docx_filepath:
-        logger.info(f"DOCX файл пользователя {user_id} создан: {docx_filepath}")
-    else:
-        # Проверяем, есть ли диалог в логгере
-        summary = dialog_logger.get_dialog_summary(user_id)
-        if summary:
-            logger.error(f"Не удалось сохранить диалог пользователя {user_id}")
-    
-    # Удаляем из активных диалогов
-    if user_id in active_dialogs:
-        del active_dialogs[user_id]
+    if not finish_user_dialog(app, user_id, reason="manual"):
+        await app.send_pipeline.send_message(message.chat.id, "Активный диалог не найден")
+        return
     
     # Отправляем запрос на отзыв
-    await message.answer("🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
-    waiting_for_feedback[user_id] = True
+    await app.send_pipeline.send_message(message.chat.id, "🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
 
-@dp.message(Command("status"))
-async def cmd_status(message: Message):
+async def cmd_status(message: Message, app: BotApplication):
     """Обработчик команды /status для проверки статуса диалога"""
     user_id = message.from_user.id
     
-    if user_id in active_dialogs:
-        summary = dialog_logger.get_dialog_summary(user_id)
+    if app.dialog_fsm.is_active(user_id):
+        summary = app.dialog_logger.get_dialog_summary(user_id)
         if summary:
             # Вычисляем время до автоматического завершения
             if summary.get('last_activity'):
@@ -288,105 +610,93 @@ ID пользователя: {summary['user_id']}
 Время начала: {summary['start_time']}
 Количество сообщений: {summary['message_count']}
 {timeout_info}"""
-            await message.answer(status_text)
+            await app.send_pipeline.send_message(message.chat.id, status_text)
         else:
-            await message.answer("Диалог активен, но информация недоступна")
-    elif user_id in waiting_for_feedback:
-        await message.answer("⏳ Ожидается ваш отзыв о работе бота. Пожалуйста, напишите ваш отзыв.")
+            await app.send_pipeline.send_message(message.chat.id, "Диалог активен, но информация недоступна")
+    elif app.dialog_fsm.is_awaiting_feedback(user_id):
+        await app.send_pipeline.send_message(message.chat.id, "⏳ Ожидается ваш отзыв о работе бота. Пожалуйста, напишите ваш отзыв.")
     else:
-        await message.answer("Активный диалог не найден")
+        await app.send_pipeline.send_message(message.chat.id, "Активный диалог не найден")
 
-@dp.message(Command("profile"))
-async def cmd_profile(message: Message):
+async def cmd_profile(message: Message, app: BotApplication):
     """Обработчик команды /profile для показа профиля пользователя"""
     user_id = message.from_user.id
     
-    profile = neuro_salesman.get_user_profile(user_id)
+    profile = app.neuro_salesman.get_user_profile(user_id)
     if profile:
         profile_text = "📊 Ваш профиль:\n"
         for key, value in profile.items():
             profile_text += f"• {key}: {value}\n"
-        await message.answer(profile_text)
+        await app.send_pipeline.send_message(message.chat.id, profile_text)
     else:
-        await message.answer("Профиль пока не заполнен")
+        await app.send_pipeline.send_message(message.chat.id, "Профиль пока не заполнен")
 
-@dp.message(Command("history"))
-async def cmd_history(message: Message):
+async def cmd_history(message: Message, app: BotApplication):
     """Обработчик команды /history для показа истории диалога"""
     user_id = message.from_user.id
     
-    history = neuro_salesman.get_conversation_history(user_id)
+    history = app.neuro_salesman.get_conversation_history(user_id)
     if history:
         history_text = "📝 История диалога:\n"
         for i, msg in enumerate(history[-5:], 1):  # Показываем последние 5 сообщений
             role = "👤" if msg["role"] == "user" else "🤖"
             history_text += f"{i}. {role} {msg['content'][:50]}...\n"
-        await message.answer(history_text)
+        await app.send_pipeline.send_message(message.chat.id, history_text)
     else:
-        await message.answer("История диалога пуста")
+        await app.send_pipeline.send_message(message.chat.id, "История диалога пуста")
 
-@dp.message(Command("reset"))
-async def cmd_reset(message: Message):
+async def cmd_reset(message: Message, app: BotApplication):
     """Обработчик команды /reset для сброса диалога"""
     user_id = message.from_user.id
     
     # Сбрасываем диалог
-    neuro_salesman.reset_conversation(user_id)
+    reset_user_conversation(app, user_id)
+    app.speculative.forget(user_id)
     
-    # Удаляем из активных диалогов и ожидающих отзыв
-    if user_id in active_dialogs:
-        del active_dialogs[user_id]
-    if user_id in waiting_for_feedback:
-        del waiting_for_feedback[user_id]
+    # Диалог больше не активен и отзыв не ожидается
+    app.dialog_fsm.transition(user_id, EVENT_RESET)
     
-    await message.answer("Диалог сброшен. Используйте /start для начала нового диалога.")
+    await app.send_pipeline.send_message(message.chat.id, "Диалог сброшен. Используйте /start для начала нового диалога.")
 
-@dp.message(Command("timeout"))
-async def cmd_timeout(message: Message):
+async def cmd_timeout(message: Message, app: BotApplication):
     """Обработчик команды /timeout для проверки неактивных диалогов (админская команда)"""
     # Завершаем все неактивные диалоги
-    saved_files = dialog_logger.cleanup_inactive_dialogs(TIMEOUT_MINUTES)
+    saved_files = []
+    for user_id in app.dialog_logger.get_inactive_dialogs(TIMEOUT_MINUTES):
+        finished = finish_user_dialog(app, user_id, reason="timeout") or finish_detached_dialog(app, user_id, reason="timeout")
+        if finished:
+            saved_files.extend(filepath for filepath in finished if filepath)
     
     if saved_files:
         files_text = "\n".join([f"• {os.path.basename(f)}" for f in saved_files])
-        await message.answer(f"⏰ Завершены неактивные диалоги:\n{files_text}")
+        await app.send_pipeline.send_message(message.chat.id, f"⏰ Завершены неактивные диалоги:\n{files_text}")
     else:
-        await message.answer("⏰ Неактивных диалогов не найдено")
+        await app.send_pipeline.send_message(message.chat.id, "⏰ Неактивных диалогов не найдено")
 
-@dp.message(Command("finish"))
-async def cmd_finish(message: Message):
+async def cmd_finish(message: Message, app: BotApplication):
     """Обработчик команды /finish для принудительного завершения всех диалогов"""
     user_id = message.from_user.id
     
     # Завершаем диалог пользователя
-    json_filepath, docx_filepath = dialog_logger.finish_dialog(user_id, reason="force_finish")
-    if json_filepath:
-        logger.info(f"Диалог пользователя {user_id} принудительно завершен и сохранен в {json_filepath}")
-    if docx_filepath:
-        logger.info(f"DOCX файл пользователя {user_id} создан: {docx_filepath}")
-    else:
+    if not finish_user_dialog(app, user_id, reason="force_finish"):
         logger.info(f"Диалог для завершения не найден для пользователя {user_id}")
-    
-    # Удаляем из активных диалогов
-    if user_id in active_dialogs:
-        del active_dialogs[user_id]
+        await app.send_pipeline.send_message(message.chat.id, "Активный диалог не найден")
+        return
     
     # Отправляем запрос на отзыв
-    await message.answer("🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
-    waiting_for_feedback[user_id] = True
+    await app.send_pipeline.send_message(message.chat.id, "🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:")
 
-@dp.message(Command("debug"))
-async def cmd_debug(message: Message):
+async def cmd_debug(message: Message, app: BotApplication):
     """Обработчик команды /debug для отладочной информации"""
     user_id = message.from_user.id
     
-    debug_info = f"""🔍 Отладочная информация:
+    debug_info = f"""🔍 Отладочная информация{f' ({app.name})' if app.name else ''}:
 ID пользователя: {user_id}
-В active_dialogs: {user_id in active_dialogs}
+Состояние диалога: {app.dialog_fsm.get_state(user_id)}
 """
     
     # Проверяем состояние диалога в логгере
-    summary = dialog_logger.get_dialog_summary(user_id)
+    summary = app.dialog_logger.get_dialog_summary(user_id)
     if summary:
         debug_info += f"""В dialog_logger: ✅
 Количество сообщений: {summary['message_count']}
@@ -396,40 +706,283 @@ ID пользователя: {user_id}
         debug_info += "В dialog_logger: ❌\n"
     
     # Проверяем папку dialogs
-    dialogs_count = len([f for f in os.listdir("dialogs") if f.endswith('.json')]) if os.path.exists("dialogs") else 0
+    dialogs_count = len([f for f in os.listdir(app.dialogs_folder) if f.endswith('.json')]) if os.path.exists(app.dialogs_folder) else 0
     debug_info += f"Файлов диалогов в папке: {dialogs_count}"
     
-    await message.answer(debug_info)
+    # Статистика маршрутов моделей
+    for route_name, stats in app.model_router.get_stats().items():
+        avg_latency = f"{stats['avg_latency']:.2f}с" if stats['avg_latency'] is not None else "—"
+        debug_info += (f"\nМаршрут {route_name}: {stats['requests']} запросов, "
+                       f"ошибок {stats['errors']}, fallback {stats['fallbacks']}, "
+                       f"задержка {avg_latency}, ${stats['cost_usd']:.4f}")
+    speculative_stats = app.speculative.get_stats()
+    debug_info += (f"\nЗаготовки приветствия: {speculative_stats['opener_hits']}/{speculative_stats['opener_misses']}, "
+                   f"подготовленный контекст: {speculative_stats['context_hits']}/{speculative_stats['context_misses']}")
+    for lane_name, lane_stats in app.send_pipeline.get_stats().items():
+        if isinstance(lane_stats, dict) and lane_stats['sent']:
+            debug_info += (f"\nДоставка {lane_name}: {lane_stats['sent']} отправлено, "
+                           f"средняя задержка {lane_stats['avg_latency']:.2f}с, RetryAfter {lane_stats['retry_after']}")
+    hedge_stats = app.neuro_salesman.hedger.get_stats()
+    debug_info += (f"\nLLM запросов: {hedge_stats['requests']}, дублей: {hedge_stats['hedges']} "
+                   f"(выиграли {hedge_stats['hedge_wins']}), повторов: {hedge_stats['retries']}, "
+                   f"таймаутов: {hedge_stats['timeouts']}")
+    admission_stats = app.admission.get_stats()
+    debug_info += (f"\nНагрузка: {admission_stats['level']}, в работе {admission_stats['in_flight']}, "
+                   f"p95 {admission_stats['p95_latency']}с, отклонено /start: {admission_stats['rejected']}, "
+                   f"деградаций: {admission_stats['degraded']}")
+    budget_stats = app.token_budget.get_stats()
+    expected_cost = budget_stats['expected_dialog_cost']
+    expected_cost_text = f"${expected_cost:.4f}" if expected_cost is not None else "—"
+    debug_info += (f"\nТокенов сегодня: {budget_stats['total_tokens_today']} "
+                   f"(режим {budget_stats['action']}, предупреждений {budget_stats['warnings']}, "
+                   f"урезано {budget_stats['truncated']}, заблокировано {budget_stats['blocked']}), "
+                   f"ожидаемая стоимость диалога: {expected_cost_text} "
+                   f"по {budget_stats['finished_dialogs']} завершенным")
+    for model, latency_stats in app.neuro_salesman.latency_model.get_stats().items():
+        debug_info += f"\nМодель задержки {model}: {latency_stats['samples']} замеров, коэффициенты {latency_stats['coefficients']}"
+    if app.retrieval_index is not None:
+        index_stats = app.retrieval_index.get_stats()
+        debug_info += (f"\nИндекс успешных диалогов: {index_stats['dialogs']} диалогов, "
+                       f"{index_stats['pairs']} пар, пропущено файлов {index_stats['skipped']}, "
+                       f"поисков {index_stats['searches']}")
+    job_stats = app.job_runner.get_stats()
+    debug_info += (f"\nФоновые задачи: в очереди {job_stats['queued']}, выполняется {job_stats['running']}, "
+                   f"завершено {job_stats['completed']}, ошибок {job_stats['failed']}, отменено {job_stats['cancelled']}")
+    session_stats = app.session_store.get_stats()
+    debug_info += (f"\nЖивых сессий в журнале: {session_stats['sessions']}, записей после снимка: "
+                   f"{session_stats['log_records']}, восстановлено при запуске: {session_stats['recovered']}")
+    dedup_stats = app.deduplicator.get_stats()
+    debug_info += (f"\nПовторных доставок: {dedup_stats['duplicates']}, "
+                   f"ответов повторено из кэша: {dedup_stats['replayed']}")
+    
+    await app.send_pipeline.send_message(message.chat.id, debug_info)
     user_id = message.from_user.id
     
     # Проверяем, есть ли активные диалоги
-    if active_dialogs:
-        inactive_users = dialog_logger.get_inactive_dialogs(TIMEOUT_MINUTES)
+    if app.dialog_fsm.users_in(STATE_ACTIVE):
+        inactive_users = app.dialog_logger.get_inactive_dialogs(TIMEOUT_MINUTES)
         if inactive_users:
             timeout_text = f"⏰ Неактивные диалоги (более {TIMEOUT_MINUTES} минут):\n"
             for uid in inactive_users:
-                summary = dialog_logger.get_dialog_summary(uid)
+                summary = app.dialog_logger.get_dialog_summary(uid)
                 if summary and summary.get('last_activity'):
                     from datetime import datetime
                     last_activity = datetime.fromisoformat(summary['last_activity'])
                     time_since = datetime.now() - last_activity
                     minutes = int(time_since.total_seconds() // 60)
                     timeout_text += f"• Пользователь {uid}: {minutes} минут назад\n"
-            await message.answer(timeout_text)
+            await app.send_pipeline.send_message(message.chat.id, timeout_text)
         else:
-            await message.answer("Нет неактивных диалогов")
+            await app.send_pipeline.send_message(message.chat.id, "Нет неактивных диалогов")
     else:
-        await message.answer("Нет активных диалогов")
+        await app.send_pipeline.send_message(message.chat.id, "Нет активных диалогов")
 
-async def main():
-    """Главная функция"""
-    logger.info("Запуск бота с GPT...")
-    logger.info(f"Таймаут неактивности: {TIMEOUT_MINUTES} минут")
+async def run_profiling(app: BotApplication, chat_id: int, seconds: float):
+    """Профилирует бота и отправляет pstats и flamegraph (свернутые стеки) администратору"""
+    from aiogram.types import FSInputFile
+    
+    try:
+        pstats_path, folded_path = await app.profiler.profile(seconds)
+        await app.send_pipeline.send_document(
+            chat_id, FSInputFile(pstats_path),
+            caption="📈 cProfile (python -m pstats или snakeviz)"
+        )
+        await app.send_pipeline.send_document(
+            chat_id, FSInputFile(folded_path),
+            caption="🔥 Свернутые стеки для flamegraph.pl или speedscope"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка профилирования: {e}")
+        await app.send_pipeline.send_message(chat_id, f"⚠️ Профилирование не удалось: {e}")
+
+async def cmd_prof(message: Message, app: BotApplication):
+    """Обработчик команды /prof [секунды] для профилирования (админская команда)"""
+    if not app.is_admin(message.from_user.id):
+        await app.send_pipeline.send_message(message.chat.id, "Команда доступна только администраторам")
+        return
+    
+    parts = (message.text or "").split()
+    seconds = float(parts[1]) if len(parts) > 1 and parts[1].replace('.', '', 1).isdigit() else 30.0
+    seconds = min(max(seconds, 1.0), 300.0)
+    
+    if app.profiler.running:
+        await app.send_pipeline.send_message(message.chat.id, "⏳ Профилирование уже запущено")
+        return
+    
+    await app.send_pipeline.send_message(message.chat.id, f"📈 Профилирование запущено на {seconds:.0f} с")
+    task = asyncio.create_task(run_profiling(app, message.chat.id, seconds))
+    app.background_tasks.add(task)
+    task.add_done_callback(app.background_tasks.discard)
+
+async def cmd_lag(message: Message, app: BotApplication):
+    """Обработчик команды /lag [мс] для задержки цикла событий (админская команда)"""
+    if not app.is_admin(message.from_user.id):
+        await app.send_pipeline.send_message(message.chat.id, "Команда доступна только администраторам")
+        return
+    
+    parts = (message.text or "").split()
+    if len(parts) > 1 and parts[1].isdigit():
+        app.loop_monitor.threshold_ms = float(parts[1])
+    
+    stats = app.loop_monitor.get_stats()
+    await app.send_pipeline.send_message(message.chat.id, f"""⏱ Задержка цикла событий:
+Порог логирования: {stats['threshold_ms']:.0f} мс
+Максимальная задержка: {stats['max_lag_ms']} мс
+p99 задержки: {stats['p99_lag_ms']} мс
+Блокировок выше порога: {stats['stalls']}""")
+
+async def cmd_timings(message: Message, app: BotApplication):
+    """Обработчик команды /timings для времени выполнения обработчиков (админская команда)"""
+    if not app.is_admin(message.from_user.id):
+        await app.send_pipeline.send_message(message.chat.id, "Команда доступна только администраторам")
+        return
+    
+    stats = app.handler_timings.get_stats()
+    if not stats:
+        await app.send_pipeline.send_message(message.chat.id, "Статистика обработчиков пока пуста")
+        return
+    
+    timings_text = "⏱ Время обработчиков (avg / p95 / max, мс):\n"
+    for item in stats:
+        timings_text += (f"• {item['handler']}: {item['count']} вызовов, "
+                         f"{item['avg_ms']:.0f} / {item['p95_ms']:.0f} / {item['max_ms']:.0f}, "
+                         f"ошибок {item['errors']}\n")
+    await app.send_pipeline.send_message(message.chat.id, timings_text)
+
+async def report_job_progress(app: BotApplication, job):
+    """Показывает прогресс фоновой задачи: первое сообщение отправляется, дальше редактируется"""
+    if job.chat_id is None:
+        return
+    if job.message_id is None:
+        sent = await app.send_pipeline.send_message(job.chat_id, job.describe(), lane=LANE_NOTICE)
+        job.message_id = sent.message_id
+    else:
+        await app.send_pipeline.edit_message_text(job.chat_id, job.message_id, job.describe())
+
+async def run_export(app: BotApplication, job, date_from, date_to, reason):
+    """Фоновая выгрузка: архив собирается в потоке, затем отправляется администратору"""
+    from aiogram.types import FSInputFile
+    from dialog_export import export_dialogs
+    
+    prefix = f"dialogs_export_{app.name}_" if app.name else "dialogs_export_"
+    archive_path = os.path.join(EXPORTS_FOLDER, f"{prefix}{job.job_id}_{datetime.now():%Y-%m-%d_%H-%M-%S}.zip")
+    try:
+        stats = await asyncio.to_thread(
+            export_dialogs, app.dialogs_folder, app.docx_folder, archive_path,
+            date_from=date_from, date_to=date_to, finish_reason=reason, job=job
+        )
+        summary = f"{stats['dialogs']} диалогов, {stats['size'] / 1024 / 1024:.1f} МБ"
+        if stats["by_reason"]:
+            summary += " (" + ", ".join(f"{name or '—'}: {count}" for name, count in sorted(stats["by_reason"].items())) + ")"
+        if stats["dialogs"]:
+            job.stage = "отправка архива"
+            # Одноразовый файл: загружается потоково с диска, file_id не кэшируется
+            await app.send_pipeline.send_document(
+                job.chat_id, FSInputFile(archive_path), caption=f"📦 Выгрузка #{job.job_id}: {summary}"
+            )
+        job.stage = summary
+        return stats
+    finally:
+        # Архив нужен только для отправки: Telegram хранит его копию
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+
+async def cmd_export(message: Message, app: BotApplication):
+    """Обработчик команды /export [дата [дата]] [причина] для выгрузки диалогов (админская команда)"""
+    from dialog_export import parse_export_args
+    
+    if not app.is_admin(message.from_user.id):
+        await app.send_pipeline.send_message(message.chat.id, "Команда доступна только администраторам")
+        return
+    
+    try:
+        date_from, date_to, reason = parse_export_args((message.text or "").split()[1:])
+    except ValueError as e:
+        await app.send_pipeline.send_message(
+            message.chat.id, f"⚠️ {e}\nФормат: /export [YYYY-MM-DD [YYYY-MM-DD]] [причина завершения]"
+        )
+        return
     
-    # Запускаем фоновую задачу очистки неактивных диалогов
-    asyncio.create_task(cleanup_inactive_dialogs())
+    title = "выгрузка"
+    if date_from:
+        title += f" {date_from}" + (f"..{date_to}" if date_to != date_from else "")
+    if reason:
+        title += f" {reason}"
+    app.job_runner.submit(title, lambda job: run_export(app, job, date_from, date_to, reason), chat_id=message.chat.id)
+
+async def cmd_jobs(message: Message, app: BotApplication):
+    """Обработчик команды /jobs со списком фоновых задач (админская команда)"""
+    if not app.is_admin(message.from_user.id):
+        await app.send_pipeline.send_message(message.chat.id, "Команда доступна только администраторам")
+        return
+    
+    jobs = app.job_runner.list_jobs()[:10]
+    if not jobs:
+        await app.send_pipeline.send_message(message.chat.id, "Фоновых задач нет")
+        return
+    await app.send_pipeline.send_message(message.chat.id, "\n".join(job.describe() for job in jobs))
+
+async def cmd_cancel_job(message: Message, app: BotApplication):
+    """Обработчик команды /cancel_job <номер> для отмены фоновой задачи (админская команда)"""
+    if not app.is_admin(message.from_user.id):
+        await app.send_pipeline.send_message(message.chat.id, "Команда доступна только администраторам")
+        return
+    
+    parts = (message.text or "").split()
+    if len(parts) < 2 or not parts[1].lstrip("#").isdigit():
+        await app.send_pipeline.send_message(message.chat.id, "Формат: /cancel_job <номер задачи>")
+        return
     
-    # Запускаем бота
-    await dp.start_polling(bot)
+    job_id = int(parts[1].lstrip("#"))
+    if app.job_runner.cancel(job_id):
+        await app.send_pipeline.send_message(message.chat.id, f"🚫 Задача #{job_id} отменяется")
+    else:
+        await app.send_pipeline.send_message(message.chat.id, f"Задача #{job_id} не найдена или уже завершена")
+
+def build_dispatcher(app: BotApplication):
+    """Создает диспетчер и регистрирует обработчики; app передается в них как аргумент"""
+    from aiogram import Dispatcher, F
+    from aiogram.filters import Command
+    
+    dp = Dispatcher()
+    dp["app"] = app
+    
+    # Повторно доставленные обновления отсекаются до обработчиков
+    dp.update.outer_middleware(app.deduplicator)
+    
+    # Время выполнения каждого обработчика
+    dp.message.middleware(app.handler_timings)
+    dp.callback_query.middleware(app.handler_timings)
+    
+    dp.callback_query.register(process_stop_dialog_callback, F.data == "stop_dialog")
+    
+    dp.message.register(cmd_start, Command("start"))
+    dp.message.register(cmd_stop, Command("stop"))
+    dp.message.register(cmd_status, Command("status"))
+    dp.message.register(cmd_profile, Command("profile"))
+    dp.message.register(cmd_history, Command("history"))
+    dp.message.register(cmd_reset, Command("reset"))
+    dp.message.register(cmd_timeout, Command("timeout"))
+    dp.message.register(cmd_finish, Command("finish"))
+    dp.message.register(cmd_debug, Command("debug"))
+    dp.message.register(cmd_prof, Command("prof"))
+    dp.message.register(cmd_lag, Command("lag"))
+    dp.message.register(cmd_timings, Command("timings"))
+    dp.message.register(cmd_export, Command("export"))
+    dp.message.register(cmd_jobs, Command("jobs"))
+    dp.message.register(cmd_cancel_job, Command("cancel_job"))
+    
+    # Обработчик всех остальных сообщений регистрируется последним
+    dp.message.register(handle_message)
+    return dp
+
+def create_app(token: str = None, openai_api_key: str = None, dialogs_folder: str = None, **options) -> BotApplication:
+    """Фабрика приложения: компоненты создаются лениво при первом использовании"""
+    return BotApplication(token=token, openai_api_key=openai_api_key, dialogs_folder=dialogs_folder, **options)
+
+async def main():
+    """Главная функция"""
+    await create_app().run()
 
-    asyncio.run(main()) 
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main())
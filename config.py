@@ -9,9 +9,45 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 # OpenAI API Key (если понадобится для дополнительных функций)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Папка для сохранения диалогов
-DIALOGS_FOLDER = "dialogs"
+# Модели GPT для маршрутизации запросов
+LLM_PRIMARY_MODEL = os.getenv('LLM_PRIMARY_MODEL', 'gpt-4.1-mini')
+LLM_FAST_MODEL = os.getenv('LLM_FAST_MODEL', 'gpt-4.1-nano')
+LLM_FALLBACK_MODEL = os.getenv('LLM_FALLBACK_MODEL', 'gpt-4o-mini')
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '30'))
+
+# JSON файл с собственными правилами маршрутизации (необязательно)
+LLM_ROUTES_FILE = os.getenv('LLM_ROUTES_FILE')
+
+# Спекулятивная подготовка следующего хода и прогрев кэша промта (прогрев платный)
+SPECULATIVE_ENABLED = os.getenv('SPECULATIVE_ENABLED', '1') == '1'
+SPECULATIVE_PREWARM = os.getenv('SPECULATIVE_PREWARM', '0') == '1'
+
+# Примеры ответов из успешных диалогов (локальный индекс, без внешних API)
+RETRIEVAL_ENABLED = os.getenv('RETRIEVAL_ENABLED', '1') == '1'
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+RETRIEVAL_INDEX_FOLDER = os.getenv('RETRIEVAL_INDEX_FOLDER', 'dialogs_index')
+
+# Дневные бюджеты токенов (0 - без ограничения) и действие при превышении: warn, truncate или block
+TOKEN_BUDGET_USER_DAILY = int(os.getenv('TOKEN_BUDGET_USER_DAILY', '0'))
+TOKEN_BUDGET_DAILY = int(os.getenv('TOKEN_BUDGET_DAILY', '0'))
+TOKEN_BUDGET_ACTION = os.getenv('TOKEN_BUDGET_ACTION', 'warn')
+
+# Администраторы бота (ID через запятую): профилирование и служебные команды
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
 
-# Создаем папку если её нет
-if not os.path.exists(DIALOGS_FOLDER):
-    os.makedirs(DIALOGS_FOLDER) 
\ No newline at end of file
+# Порог задержки цикла событий, после которого логируется блокирующий стек
+LOOP_LAG_THRESHOLD_MS = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '200'))
+
+# Мультибот-режим (multi_bot.py): JSON с настройками ботов и размер общего пула потоков для работы с диском
+MULTI_BOT_CONFIG = os.getenv('MULTI_BOT_CONFIG', 'tenants.json')
+PERSISTENCE_WORKERS = int(os.getenv('PERSISTENCE_WORKERS', '4'))
+
+# Снимок живых диалогов (журнал ходов между снимками восстанавливается после сбоя) и fsync каждой записи журнала
+SESSION_SNAPSHOT_SECONDS = float(os.getenv('SESSION_SNAPSHOT_SECONDS', '60'))
+SESSION_LOG_FSYNC = os.getenv('SESSION_LOG_FSYNC', '0') == '1'
+
+# Папка для архивов админской выгрузки /export
+EXPORTS_FOLDER = os.getenv('EXPORTS_FOLDER', 'exports')
+
+# Папка для сохранения диалогов (создается DialogLogger при запуске, а не при импорте)
+DIALOGS_FOLDER = "dialogs"
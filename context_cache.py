@@ -0,0 +1,102 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+# Параметры генерации ответа нейропродажника (общие для SDK и готового тела запроса)
+COMPLETION_PARAMS = {
+    "temperature": 0.25,  # Немного увеличиваем для более живого общения
+    "top_p": 1.0,  # Контролируем разнообразие ответов
+    "frequency_penalty": 0.2,  # Снижаем повторения
+    "presence_penalty": 0.1,  # Поощряем новые темы
+    "response_format": {"type": "json_object"},  # Заставляем GPT возвращать JSON
+}
+
+
+def encode_message(role: str, content: str) -> bytes:
+    """JSON одного сообщения чата в том же виде, в каком его кодирует httpx"""
+    return json.dumps({"role": role, "content": content}, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class EncodedSession:
+    """Закодированная история пользователя: ",{сообщение},{сообщение}..." """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.count = 0
+        # Последнее закодированное сообщение: по нему проверяется, что история не подменялась
+        self.last_message: Optional[Dict] = None
+
+
+class EncodedContext:
+    """Готовый контекст одного запроса: суперпромт, история и хвост хода"""
+
+    def __init__(self, cache: "ContextCache", buffer: bytearray, length: int, tail: bytes):
+        self.cache = cache
+        self.buffer = buffer
+        self.length = length
+        self.tail = tail
+
+    def body(self, model: str, max_tokens: int) -> bytes:
+        """Тело запроса /chat/completions одним копированием готовых байтов"""
+        # Если история успела вырасти (параллельный ход), берем только свою часть
+        history = self.buffer if len(self.buffer) == self.length else self.buffer[:self.length]
+        return b"".join((self.cache.request_prefix(model, max_tokens), b"[", self.cache.system_bytes,
+                         history, self.tail, b"]}"))
+
+
+class ContextCache:
+    """Инкрементально закодированные тела запросов: на каждом ходу кодируются только новые сообщения"""
+
+    def __init__(self, system_prompt: str):
+        # Суперпромт (~80 КБ) кодируется один раз
+        self.system_bytes = encode_message("system", system_prompt)
+        self.sessions: Dict[int, EncodedSession] = {}
+        self._prefixes: Dict[Tuple[str, int], bytes] = {}
+        self.rebuilds = 0
+
+    def request_prefix(self, model: str, max_tokens: int) -> bytes:
+        """Начало тела запроса до массива messages"""
+        key = (model, max_tokens)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            params = dict(COMPLETION_PARAMS, model=model, max_tokens=max_tokens)
+            encoded = json.dumps(params, ensure_ascii=False, separators=(",", ":"))
+            prefix = (encoded[:-1] + ',"messages":').encode("utf-8")
+            self._prefixes[key] = prefix
+        return prefix
+
+    def update(self, user_id: int, history: List[Dict], upto: Optional[int] = None) -> int:
+        """Дописывает в сессию сообщения history[:upto], которых в ней еще нет; возвращает их число"""
+        upto = len(history) if upto is None else upto
+        session = self.sessions.get(user_id)
+        if session is None or session.count > upto or (
+                session.count and history[session.count - 1] is not session.last_message):
+            # История сброшена или изменена: кодируем заново
+            if session is not None:
+                self.rebuilds += 1
+            session = EncodedSession()
+            self.sessions[user_id] = session
+        added = upto - session.count
+        for message in history[session.count:upto]:
+            session.buffer += b","
+            session.buffer += encode_message(message["role"], message["content"])
+        if added:
+            session.count = upto
+            session.last_message = history[upto - 1]
+        return added
+
+    def context(self, user_id: int, tail_messages: List[Dict]) -> EncodedContext:
+        """Контекст запроса из сессии и сообщений текущего хода (после update)"""
+        session = self.sessions[user_id]
+        tail = b"".join(b"," + encode_message(message["role"], message["content"]) for message in tail_messages)
+        return EncodedContext(self, session.buffer, len(session.buffer), tail)
+
+    def forget(self, user_id: int) -> None:
+        self.sessions.pop(user_id, None)
+
+    def get_stats(self) -> Dict:
+        return {
+            "sessions": len(self.sessions),
+            "encoded_bytes": sum(len(session.buffer) for session in self.sessions.values()),
+            "rebuilds": self.rebuilds,
+        }
@@ -0,0 +1,150 @@
+import csv
+import json
+import os
+import re
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# Имена файлов диалогов: <user_id>_YYYY-MM-DD_HH-MM-SS.json и dialog_<user_id>_YYYY-MM-DD_HH-MM-SS.docx
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+JSON_NAME_RE = re.compile(r"^(\d+)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.json$")
+DOCX_NAME_RE = re.compile(r"^dialog_(\d+)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.docx$")
+
+# DOCX сохраняется сразу после JSON: допустимое расхождение меток времени в именах файлов
+DOCX_MATCH_WINDOW = timedelta(seconds=60)
+
+SUMMARY_COLUMNS = ["file", "user_id", "start_time", "end_time", "finish_reason", "messages", "docx"]
+
+
+def parse_export_args(args: List[str]) -> Tuple[Optional[date], Optional[date], Optional[str]]:
+    """Аргументы /export: [YYYY-MM-DD [YYYY-MM-DD]] [причина завершения]"""
+    dates = []
+    reason = None
+    for arg in args:
+        try:
+            dates.append(datetime.strptime(arg, "%Y-%m-%d").date())
+        except ValueError:
+            if reason is not None:
+                raise ValueError(f"Лишний аргумент: {arg}")
+            reason = arg
+    if len(dates) > 2:
+        raise ValueError("Укажите не больше двух дат")
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else date_from
+    if date_from and date_to < date_from:
+        raise ValueError("Дата окончания раньше даты начала")
+    return date_from, date_to, reason
+
+
+def _docx_index(docx_folder: str) -> Dict[int, List[Tuple[datetime, str]]]:
+    """DOCX файлы по пользователям, отсортированные по времени"""
+    index: Dict[int, List[Tuple[datetime, str]]] = {}
+    if not os.path.isdir(docx_folder):
+        return index
+    for filename in os.listdir(docx_folder):
+        match = DOCX_NAME_RE.match(filename)
+        if match:
+            created = datetime.strptime(match.group(2), TIMESTAMP_FORMAT)
+            index.setdefault(int(match.group(1)), []).append((created, os.path.join(docx_folder, filename)))
+    for files in index.values():
+        files.sort()
+    return index
+
+
+def _find_docx(index: Dict[int, List[Tuple[datetime, str]]], user_id: int, saved_at: datetime) -> Optional[str]:
+    """DOCX того же диалога: первый файл пользователя, созданный не раньше JSON"""
+    for created, filepath in index.get(user_id, []):
+        if saved_at <= created <= saved_at + DOCX_MATCH_WINDOW:
+            return filepath
+    return None
+
+
+def _dialog_date(dialog: Dict, saved_at: datetime) -> date:
+    """Дата начала диалога (или дата сохранения, если начало не записано)"""
+    try:
+        return datetime.fromisoformat(dialog["start_time"]).date()
+    except (KeyError, TypeError, ValueError):
+        return saved_at.date()
+
+
+def export_dialogs(dialogs_folder: str, docx_folder: str, archive_path: str,
+                   date_from: Optional[date] = None, date_to: Optional[date] = None,
+                   finish_reason: Optional[str] = None, job=None) -> Dict:
+    """Пишет подходящие диалоги (JSON, DOCX и сводку CSV) в zip архив потоково, файл за файлом"""
+    # job (background_jobs.Job) получает прогресс и может прервать выгрузку между файлами
+    candidates = []
+    for filename in sorted(os.listdir(dialogs_folder)) if os.path.isdir(dialogs_folder) else []:
+        match = JSON_NAME_RE.match(filename)
+        if not match:
+            continue
+        saved_at = datetime.strptime(match.group(2), TIMESTAMP_FORMAT)
+        # JSON сохраняется при завершении диалога, то есть не раньше его начала: такие файлы не читаем
+        if date_from and saved_at.date() < date_from:
+            continue
+        candidates.append((filename, int(match.group(1)), saved_at))
+
+    docx_index = _docx_index(docx_folder)
+    stats = {"dialogs": 0, "docx": 0, "by_reason": {}, "archive_path": archive_path}
+    partial_path = archive_path + ".part"
+    folder = os.path.dirname(archive_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    # Сводка пишется во временный файл: в zip одновременно открыта только одна запись
+    with tempfile.TemporaryFile("w+", encoding="utf-8", newline="") as summary_file:
+        writer = csv.writer(summary_file)
+        writer.writerow(SUMMARY_COLUMNS)
+        try:
+            with zipfile.ZipFile(partial_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                for position, (filename, user_id, saved_at) in enumerate(candidates):
+                    if job is not None:
+                        job.check_cancelled()
+                        job.report(position, len(candidates), f"найдено {stats['dialogs']}")
+
+                    filepath = os.path.join(dialogs_folder, filename)
+                    try:
+                        with open(filepath, "r", encoding="utf-8") as f:
+                            dialog = json.load(f)
+                    except (OSError, json.JSONDecodeError):
+                        continue
+                    dialog_date = _dialog_date(dialog, saved_at)
+                    if date_from and dialog_date < date_from or date_to and dialog_date > date_to:
+                        continue
+                    reason = dialog.get("finish_reason") or ""
+                    if finish_reason and reason != finish_reason:
+                        continue
+
+                    # Файлы копируются в архив блоками с диска; DOCX уже сжат, поэтому хранится как есть
+                    archive.write(filepath, arcname=f"json/{filename}")
+                    docx_path = _find_docx(docx_index, user_id, saved_at)
+                    if docx_path:
+                        archive.write(docx_path, arcname=f"docx/{os.path.basename(docx_path)}",
+                                      compress_type=zipfile.ZIP_STORED)
+                        stats["docx"] += 1
+
+                    writer.writerow([
+                        filename, user_id, dialog.get("start_time", ""), dialog.get("end_time", ""), reason,
+                        len(dialog.get("messages", [])), os.path.basename(docx_path) if docx_path else "",
+                    ])
+                    stats["dialogs"] += 1
+                    stats["by_reason"][reason] = stats["by_reason"].get(reason, 0) + 1
+
+                if job is not None:
+                    job.check_cancelled()
+                    job.report(len(candidates), len(candidates), "сводка")
+                summary_file.seek(0)
+                with archive.open("summary.csv", "w") as entry:
+                    # BOM, чтобы Excel открывал кириллицу без настройки кодировки
+                    entry.write("\ufeff".encode("utf-8"))
+                    for line in summary_file:
+                        entry.write(line.encode("utf-8"))
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+    os.replace(partial_path, archive_path)
+    stats["size"] = os.path.getsize(archive_path)
+    return stats
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Состояния диалога пользователя
+STATE_IDLE = "idle"
+STATE_ACTIVE = "active"
+STATE_FINISHING = "finishing"
+STATE_AWAITING_FEEDBACK = "awaiting_feedback"
+STATE_CLOSED = "closed"
+
+# События
+EVENT_START = "start"
+EVENT_FINISH = "finish"
+EVENT_FINISHED = "finished"
+EVENT_FEEDBACK = "feedback"
+EVENT_RESET = "reset"
+
+# Таблица переходов: (состояние, событие) -> новое состояние
+TRANSITIONS = {
+    (STATE_IDLE, EVENT_START): STATE_ACTIVE,
+    (STATE_ACTIVE, EVENT_START): STATE_ACTIVE,
+    (STATE_AWAITING_FEEDBACK, EVENT_START): STATE_ACTIVE,
+    (STATE_CLOSED, EVENT_START): STATE_ACTIVE,
+    (STATE_ACTIVE, EVENT_FINISH): STATE_FINISHING,
+    (STATE_FINISHING, EVENT_FINISHED): STATE_AWAITING_FEEDBACK,
+    (STATE_AWAITING_FEEDBACK, EVENT_FEEDBACK): STATE_CLOSED,
+}
+# Сброс допустим из любого состояния
+for _state in (STATE_IDLE, STATE_ACTIVE, STATE_FINISHING, STATE_AWAITING_FEEDBACK, STATE_CLOSED):
+    TRANSITIONS[(_state, EVENT_RESET)] = STATE_IDLE
+
+
+class DialogStateMachine:
+    """Жизненный цикл диалогов: idle -> active -> finishing -> awaiting_feedback -> closed"""
+
+    def __init__(self, state_path: str = "dialogs/.dialog_states.json", compact_every: int = 1000):
+        self.state_path = state_path
+        # Журнал переходов: каждая запись - одна строка, снимок пересобирается при compact()
+        self.journal_path = os.path.splitext(state_path)[0] + ".log"
+        self.compact_every = compact_every
+        self.states: Dict[int, str] = {}
+        self._journal_lines = 0
+        self._load()
+
+    def _load(self) -> None:
+        """Восстанавливает состояния из снимка и журнала переходов"""
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    self.states = {int(user_id): state for user_id, state in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось прочитать состояния диалогов {self.state_path}: {e}")
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Недописанная последняя строка
+                    self.states[int(entry["user_id"])] = entry["state"]
+            self.compact()
+
+    def _append_journal(self, user_id: int, state: str) -> None:
+        folder = os.path.dirname(self.journal_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"user_id": user_id, "state": state, "at": datetime.now().isoformat()}) + "\n")
+        self._journal_lines += 1
+        if self._journal_lines >= self.compact_every:
+            self.compact()
+
+    def compact(self) -> None:
+        """Атомарно записывает снимок состояний и очищает журнал"""
+        folder = os.path.dirname(self.state_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # Закрытые и сброшенные диалоги не храним: отсутствие записи означает idle
+        snapshot = {str(user_id): state for user_id, state in self.states.items()
+                    if state not in (STATE_IDLE, STATE_CLOSED)}
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.state_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_lines = 0
+
+    def get_state(self, user_id: int) -> str:
+        return self.states.get(user_id, STATE_IDLE)
+
+    def is_active(self, user_id: int) -> bool:
+        return self.get_state(user_id) == STATE_ACTIVE
+
+    def is_awaiting_feedback(self, user_id: int) -> bool:
+        return self.get_state(user_id) == STATE_AWAITING_FEEDBACK
+
+    def can(self, user_id: int, event: str) -> bool:
+        return (self.get_state(user_id), event) in TRANSITIONS
+
+    def transition(self, user_id: int, event: str) -> bool:
+        """Выполняет переход; False, если событие недопустимо в текущем состоянии"""
+        new_state = TRANSITIONS.get((self.get_state(user_id), event))
+        if new_state is None:
+            return False
+        if new_state in (STATE_IDLE, STATE_CLOSED):
+            self.states.pop(user_id, None)
+        else:
+            self.states[user_id] = new_state
+        self._append_journal(user_id, new_state)
+        return True
+
+    def users_in(self, state: str) -> List[int]:
+        return [user_id for user_id, user_state in self.states.items() if user_state == state]
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = {}
+        for state in self.states.values():
+            stats[state] = stats.get(state, 0) + 1
+        return stats
+
+    def restore_interrupted(self) -> List[int]:
+        """Диалоги, прерванные перезапуском во время завершения, переводятся к ожиданию отзыва"""
+        interrupted = self.users_in(STATE_FINISHING)
+        for user_id in interrupted:
+            self.transition(user_id, EVENT_FINISHED)
+        return interrupted
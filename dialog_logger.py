@@ -2,14 +2,27 @@ import json
 import os
 from datetime import datetime, timedelta
 from typing import Dict, List
-from docx_generator import DocxGenerator
+from docx_incremental import IncrementalDocxRenderer
 
 class DialogLogger:
-    def __init__(self, dialogs_folder: str = "dialogs"):
+    def __init__(self, dialogs_folder: str = "dialogs", retrieval_index=None, docx_folder: str = "dialogs_docx"):
         self.dialogs_folder = dialogs_folder
+        self.docx_folder = docx_folder
         if not os.path.exists(dialogs_folder):
             os.makedirs(dialogs_folder)
-        self.docx_generator = DocxGenerator()
+        self._docx_generator = None
+        # Инкрементальный рендеринг DOCX: каждый ход дописывается сразу при add_message
+        self.docx_renderer = IncrementalDocxRenderer(docx_folder)
+        # Индекс успешных диалогов (retrieval.DialogIndex) пополняется при завершении
+        self.retrieval_index = retrieval_index
+    
+    @property
+    def docx_generator(self):
+        """Генератор DOCX (python-docx и lxml загружаются при первом экспорте)"""
+        if self._docx_generator is None:
+            from docx_generator import DocxGenerator
+            self._docx_generator = DocxGenerator(self.docx_folder)
+        return self._docx_generator
     
     def save_dialog(self, user_id: int, dialog_data: Dict) -> str:
         """Сохраняет диалог в файл"""
@@ -38,8 +51,8 @@ class DialogLogger:
         else:
             return data
     
-    def add_message(self, user_id: int, message: str, response: str, agent_communication: Dict) -> None:
-        """Добавляет сообщение в текущий диалог пользователя"""
+    def add_message(self, user_id: int, message: str, response: str, agent_communication: Dict) -> Dict:
+        """Добавляет сообщение в текущий диалог пользователя и возвращает запись хода"""
         timestamp = datetime.now().isoformat()
         
         # Извлекаем только текст сообщения для логирования
@@ -71,9 +84,26 @@ class DialogLogger:
                 "messages": [],
                 "last_activity": datetime.now()  # Добавляем отслеживание активности
             }
+            self.docx_renderer.start(user_id)
         
         self.current_dialogs[user_id]["messages"].append(message_data)
+        self.docx_renderer.append_turn(user_id, message_data)
         self.current_dialogs[user_id]["last_activity"] = datetime.now()  # Обновляем время активности
+        return message_data
+    
+    def restore_dialog(self, user_id: int, dialog: Dict) -> None:
+        """Возвращает в текущие диалоги сессию, восстановленную после перезапуска"""
+        if not hasattr(self, 'current_dialogs'):
+            self.current_dialogs = {}
+        # Собственный список сообщений: журнал сессий ведет свою копию и дописывает в нее сам
+        restored = dict(dialog, messages=list(dialog.get("messages", [])))
+        # Таймер неактивности продолжает отсчет от последнего хода до перезапуска
+        last_activity = dialog.get("last_activity") or dialog.get("start_time")
+        restored["last_activity"] = datetime.fromisoformat(last_activity) if last_activity else datetime.now()
+        self.current_dialogs[user_id] = restored
+        # Без файла сессии DOCX содержал бы только ходы после перезапуска
+        if not self.docx_renderer.has_session(user_id):
+            self.docx_renderer.rebuild(user_id, restored["messages"])
     
     def finish_dialog(self, user_id: int, reason: str = "manual") -> tuple:
         """Завершает диалог и сохраняет его в файл"""
@@ -87,8 +117,17 @@ class DialogLogger:
         # Сохраняем JSON
         json_filepath = self.save_dialog(user_id, dialog)
         
-        # Создаем DOCX
-        docx_filepath = self.docx_generator.create_dialog_docx(user_id, dialog)
+        # Успешный диалог сразу становится примером для следующих ответов
+        if self.retrieval_index is not None:
+            try:
+                self.retrieval_index.add_dialog(self._prepare_for_json(dialog), json_filepath)
+            except Exception as e:
+                print(f"Ошибка при добавлении диалога в индекс: {e}")
+        
+        # Собираем DOCX из уже отрендеренных ходов (полный рендеринг - только если их нет)
+        docx_filepath = self.docx_renderer.finish(user_id, dialog)
+        if not docx_filepath:
+            docx_filepath = self.docx_generator.create_dialog_docx(user_id, dialog)
         
         # Удаляем из текущих диалогов
         del self.current_dialogs[user_id]
@@ -157,8 +196,8 @@ class DialogLogger:
     def get_latest_docx_path(self, user_id: int) -> str:
         """Возвращает путь к последнему DOCX файлу пользователя"""
         try:
-            # Ищем в папке dialogs_docx файлы для данного пользователя
-            docx_folder = "dialogs_docx"
+            # Ищем в папке DOCX файлы для данного пользователя
+            docx_folder = self.docx_folder
             if not os.path.exists(docx_folder):
                 return None
             
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from send_pipeline import LANE_BULK
+
+logger = logging.getLogger(__name__)
+
+
+class DocxDelivery:
+    """Отправка DOCX файлов: потоково с диска, с повторным использованием file_id Telegram"""
+
+    def __init__(self, send_pipeline, cache_path: str = os.path.join("dialogs_docx", ".file_ids.json"),
+                 max_entries: int = 1000):
+        self.send_pipeline = send_pipeline
+        self.cache_path = cache_path
+        # Ограниченный LRU: файлы отправляются повторно в основном вскоре после создания
+        self.max_entries = max_entries
+        self.file_ids: OrderedDict = self._load_cache()
+        self.uploads = 0
+        self.reused = 0
+
+    def _load_cache(self) -> OrderedDict:
+        """Загружает кэш file_id с диска"""
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                file_ids = OrderedDict(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return OrderedDict()
+        while len(file_ids) > self.max_entries:
+            file_ids.popitem(last=False)
+        return file_ids
+
+    def _save_cache(self) -> None:
+        """Сохраняет кэш file_id на диск"""
+        folder = os.path.dirname(self.cache_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.file_ids, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def _cache_key(filepath: str) -> str:
+        """Ключ кэша - хэш содержимого: не зависит от mtime и пути, меняется только вместе с документом"""
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _remember(self, key: str, file_id: str) -> None:
+        """Запоминает file_id: самые старые записи удаляются"""
+        self.file_ids[key] = file_id
+        self.file_ids.move_to_end(key)
+        while len(self.file_ids) > self.max_entries:
+            self.file_ids.popitem(last=False)
+        self._save_cache()
+
+    async def send_file(self, chat_id: int, filepath: str, caption: Optional[str] = None,
+                        filename: Optional[str] = None, lane: int = LANE_BULK):
+        """Отправляет файл: по file_id, если он уже загружался, иначе потоково с диска"""
+        from aiogram.exceptions import TelegramBadRequest
+        from aiogram.types import FSInputFile
+        
+        key = self._cache_key(filepath)
+        file_id = self.file_ids.get(key)
+        if file_id:
+            try:
+                result = await self.send_pipeline.send_document(chat_id, file_id, lane=lane, caption=caption)
+                self.file_ids.move_to_end(key)
+                self.reused += 1
+                return result
+            except TelegramBadRequest as e:
+                logger.warning(f"file_id для {filepath} больше недействителен, загружаем заново: {e}")
+                self.file_ids.pop(key, None)
+
+        document = FSInputFile(filepath, filename=filename or os.path.basename(filepath))
+        result = await self.send_pipeline.send_document(chat_id, document, lane=lane, caption=caption)
+        self.uploads += 1
+
+        if result is not None and getattr(result, "document", None):
+            self._remember(key, result.document.file_id)
+        return result
+
+    def get_stats(self) -> Dict:
+        """Возвращает статистику загрузок и повторного использования file_id"""
+        return {"uploads": self.uploads, "reused": self.reused, "cached": len(self.file_ids)}
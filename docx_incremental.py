@@ -0,0 +1,206 @@
+import os
+import re
+import shutil
+import zipfile
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+# Символы, недопустимые в XML 1.0
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+W_NAMESPACE = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+DOCUMENT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Стили повторяют оформление DocxGenerator: Times New Roman 12pt, заголовки Title и Heading 1
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:styles xmlns:w="{W_NAMESPACE}">'
+    '<w:docDefaults><w:rPrDefault><w:rPr>'
+    '<w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" w:cs="Times New Roman" '
+    'w:eastAsia="Times New Roman"/><w:sz w:val="24"/><w:szCs w:val="24"/><w:lang w:val="ru-RU"/>'
+    '</w:rPr></w:rPrDefault><w:pPrDefault><w:pPr><w:spacing w:after="200" w:line="276" w:lineRule="auto"/>'
+    '</w:pPr></w:pPrDefault></w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/>'
+    '<w:next w:val="Normal"/><w:qFormat/><w:pPr><w:spacing w:after="300"/></w:pPr>'
+    '<w:rPr><w:color w:val="17365D"/><w:kern w:val="28"/><w:sz w:val="52"/><w:szCs w:val="52"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/>'
+    '<w:next w:val="Normal"/><w:qFormat/><w:pPr><w:keepNext/><w:spacing w:before="480" w:after="0"/>'
+    '<w:outlineLvl w:val="0"/></w:pPr><w:rPr><w:b/><w:bCs/><w:color w:val="365F91"/>'
+    '<w:sz w:val="28"/><w:szCs w:val="28"/></w:rPr></w:style>'
+    '</w:styles>'
+)
+
+DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:document xmlns:w="{W_NAMESPACE}"><w:body>'
+)
+
+DOCUMENT_END = (
+    '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+    '<w:pgMar w:top="1440" w:right="1800" w:bottom="1440" w:left="1800" '
+    'w:header="720" w:footer="720" w:gutter="0"/></w:sectPr>'
+    '</w:body></w:document>'
+)
+
+# Размер блока при копировании накопленного фрагмента в архив
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def _run(text: str, bold: bool = False, italic: bool = False) -> str:
+    """WordprocessingML для фрагмента текста (переносы строк как w:br, как в python-docx)"""
+    properties = ""
+    if bold or italic:
+        properties = "<w:rPr>" + ("<w:b/>" if bold else "") + ("<w:i/>" if italic else "") + "</w:rPr>"
+    parts = []
+    for index, line in enumerate(INVALID_XML_CHARS.sub("", str(text)).split("\n")):
+        if index:
+            parts.append("<w:br/>")
+        if line:
+            parts.append(f'<w:t xml:space="preserve">{escape(line)}</w:t>')
+    return f"<w:r>{properties}{''.join(parts)}</w:r>"
+
+
+def _paragraph(runs: List[Tuple[str, bool, bool]], style: Optional[str] = None, center: bool = False) -> str:
+    """WordprocessingML для абзаца из списка (текст, жирный, курсив)"""
+    properties = ""
+    if style or center:
+        properties = ("<w:pPr>" + (f'<w:pStyle w:val="{style}"/>' if style else "")
+                      + ('<w:jc w:val="center"/>' if center else "") + "</w:pPr>")
+    return f"<w:p>{properties}{''.join(_run(*run) for run in runs)}</w:p>"
+
+
+class IncrementalDocxRenderer:
+    """Рендерит DOCX по мере диалога: каждый ход дописывается во временный файл сессии"""
+
+    def __init__(self, dialogs_docx_folder: str = "dialogs_docx", spool_folder: str = None):
+        self.dialogs_docx_folder = dialogs_docx_folder
+        self.spool_folder = spool_folder or os.path.join(dialogs_docx_folder, ".spool")
+        if not os.path.exists(self.spool_folder):
+            os.makedirs(self.spool_folder)
+
+    def _spool_path(self, user_id: int) -> str:
+        return os.path.join(self.spool_folder, f"{user_id}.xml")
+
+    def has_session(self, user_id: int) -> bool:
+        """Проверяет, есть ли накопленный фрагмент для пользователя"""
+        return os.path.exists(self._spool_path(user_id))
+
+    def start(self, user_id: int) -> None:
+        """Начинает новый фрагмент для диалога пользователя"""
+        open(self._spool_path(user_id), 'wb').close()
+
+    def render_turn(self, message_data: Dict) -> str:
+        """WordprocessingML одного хода в том же виде, что и DocxGenerator"""
+        fragments = []
+
+        # Время сообщения
+        timestamp = message_data.get('timestamp', '')
+        if timestamp:
+            fragments.append(_paragraph([(f'[{timestamp}]', False, True)], center=True))
+
+        # Сообщение клиента
+        client_msg = message_data.get('client_message', '')
+        if client_msg:
+            fragments.append(_paragraph([('Клиент: ', True, False), (client_msg, False, False)]))
+
+        # Ответ нейропродажника
+        neuro_response = message_data.get('neuro_salesman_response', '')
+        if neuro_response:
+            fragments.append(_paragraph([('Нейропродажник: ', True, False), (neuro_response, False, False)]))
+
+        # JSON коммуникация агентов (если есть)
+        agent_comm = message_data.get('agent_communication', {})
+        if agent_comm:
+            fragments.append(_paragraph([('JSON коммуникация агентов: ', True, False),
+                                         (str(agent_comm), False, True)]))
+
+        fragments.append(_paragraph([]))  # Пустая строка между сообщениями
+        return "".join(fragments)
+
+    def append_turn(self, user_id: int, message_data: Dict) -> None:
+        """Дописывает ход в файл сессии"""
+        with open(self._spool_path(user_id), 'ab') as spool:
+            spool.write(self.render_turn(message_data).encode('utf-8'))
+
+    def rebuild(self, user_id: int, messages: List[Dict]) -> None:
+        """Заново рендерит фрагмент из всех ходов (диалог восстановлен после перезапуска без файла сессии)"""
+        with open(self._spool_path(user_id), 'wb') as spool:
+            for message_data in messages:
+                spool.write(self.render_turn(message_data).encode('utf-8'))
+
+    def _render_header(self, user_id: int, dialog_data: Dict) -> str:
+        """Заголовок и сведения о диалоге (известны только при завершении)"""
+        info_runs = [
+            ('ID пользователя: ', True, False), (str(user_id), False, False),
+            ('\nДата начала: ', True, False), (dialog_data.get('start_time', 'Не указано'), False, False),
+            ('\nДата окончания: ', True, False), (dialog_data.get('end_time', 'Не указано'), False, False),
+            ('\nПричина завершения: ', True, False), (dialog_data.get('finish_reason', 'Не указано'), False, False),
+            ('\nКоличество сообщений: ', True, False), (str(len(dialog_data.get('messages', []))), False, False),
+        ]
+        return "".join([
+            _paragraph([('История диалога с нейропродажником', False, False)], style="Title", center=True),
+            _paragraph(info_runs),
+            _paragraph([]),  # Пустая строка
+            _paragraph([('Диалог', False, False)], style="Heading1"),
+        ])
+
+    def finish(self, user_id: int, dialog_data: Dict) -> Optional[str]:
+        """Собирает DOCX из накопленного фрагмента без повторного рендеринга переписки"""
+        spool_path = self._spool_path(user_id)
+        if not os.path.exists(spool_path):
+            return None
+
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        filename = f"dialog_{user_id}_{timestamp}.docx"
+        filepath = os.path.join(self.dialogs_docx_folder, filename)
+
+        with zipfile.ZipFile(filepath, 'w', compression=zipfile.ZIP_DEFLATED) as package:
+            package.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+            package.writestr('_rels/.rels', ROOT_RELS_XML)
+            package.writestr('word/_rels/document.xml.rels', DOCUMENT_RELS_XML)
+            package.writestr('word/styles.xml', STYLES_XML)
+            with package.open('word/document.xml', 'w') as document, open(spool_path, 'rb') as spool:
+                document.write(DOCUMENT_START.encode('utf-8'))
+                document.write(self._render_header(user_id, dialog_data).encode('utf-8'))
+                shutil.copyfileobj(spool, document, COPY_CHUNK_SIZE)
+                document.write(DOCUMENT_END.encode('utf-8'))
+
+        os.remove(spool_path)
+        return filepath
+
+    def discard(self, user_id: int) -> None:
+        """Удаляет накопленный фрагмент без сборки документа"""
+        spool_path = self._spool_path(user_id)
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
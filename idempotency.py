@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Telegram хранит недоставленные обновления не дольше суток, а после недели без обновлений
+# начинает update_id со случайного значения: более старая отметка бесполезна и опасна
+MARK_MAX_AGE_SECONDS = 24 * 3600
+
+
+class TurnRecord:
+    """Обработка одного входящего сообщения и отправленные на него ответы"""
+
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+        self.done = False
+        self.replies: List[Tuple[str, Dict]] = []
+
+
+class UpdateDeduplicator:
+    """Outer middleware aiogram: повторно доставленные обновления не обрабатываются второй раз"""
+
+    def __init__(self, state_path: str = "dialogs/.update_state.json", capacity: int = 10000,
+                 flush_interval: float = 1.0, sender=None, mark_max_age: float = MARK_MAX_AGE_SECONDS):
+        self.state_path = state_path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        # Корутина (chat_id, text, **kwargs) для повторной отправки сохраненного ответа
+        self.sender = sender
+        self.mark_max_age = mark_max_age
+        # Все обновления с update_id не больше этой отметки уже обработаны (переживает перезапуск);
+        # mark_updated_at - время (time.time) последнего обработанного обновления
+        self.high_water_mark, self.mark_updated_at = self._load_high_water_mark()
+        self._saved_mark = (self.high_water_mark, self.mark_updated_at)
+        self._saved_at = 0.0
+        self._max_completed = self.high_water_mark
+        self.in_flight = set()
+        # Ограниченный LRU: update_id и (chat_id, message_id) -> TurnRecord
+        self.updates: OrderedDict = OrderedDict()
+        self.turns: OrderedDict = OrderedDict()
+        self.duplicates = 0
+        self.replayed = 0
+
+    def _load_high_water_mark(self) -> Tuple[int, float]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # В старом формате времени нет: берем время изменения файла
+            updated_at = data.get("updated_at") or os.path.getmtime(self.state_path)
+            return int(data.get("high_water_mark", 0)), float(updated_at)
+        except FileNotFoundError:
+            return 0, 0.0
+        except (ValueError, OSError) as e:
+            logger.error(f"Не удалось прочитать отметку обновлений {self.state_path}: {e}")
+            return 0, 0.0
+
+    def _expire_stale_mark(self) -> None:
+        """Сбрасывает отметку, если обновлений не было дольше mark_max_age"""
+        if self.high_water_mark and time.time() - self.mark_updated_at > self.mark_max_age:
+            logger.info(f"Отметка обновлений {self.high_water_mark} устарела и сброшена")
+            self.high_water_mark = 0
+            self._max_completed = 0
+
+    def save(self) -> None:
+        """Атомарно сохраняет отметку обработанных обновлений"""
+        if (self.high_water_mark, self.mark_updated_at) == self._saved_mark:
+            return
+        folder = os.path.dirname(self.state_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"high_water_mark": self.high_water_mark, "updated_at": self.mark_updated_at}, f)
+        os.replace(tmp_path, self.state_path)
+        self._saved_mark = (self.high_water_mark, self.mark_updated_at)
+        self._saved_at = time.monotonic()
+
+    @staticmethod
+    def _remember(cache: OrderedDict, key, value, capacity: int) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > capacity:
+            cache.popitem(last=False)
+
+    @staticmethod
+    def _message_key(update) -> Optional[Tuple[int, int]]:
+        message = getattr(update, "message", None)
+        if message is None:
+            return None
+        return message.chat.id, message.message_id
+
+    def _find_duplicate(self, update) -> Tuple[bool, Optional[TurnRecord]]:
+        """Проверяет, обрабатывалось ли обновление (или то же сообщение) раньше"""
+        record = self.updates.get(update.update_id)
+        if record is None:
+            key = self._message_key(update)
+            record = self.turns.get(key) if key is not None else None
+        if record is not None:
+            return True, record
+        self._expire_stale_mark()
+        # Обновления ниже отметки обработаны до перезапуска, ответы на них уже отправлены
+        return update.update_id <= self.high_water_mark, None
+
+    def _complete(self, update_id: int) -> None:
+        """Сдвигает отметку: она не обгоняет обновления, которые еще обрабатываются"""
+        self.in_flight.discard(update_id)
+        self._max_completed = max(self._max_completed, update_id)
+        safe_mark = min(self.in_flight) - 1 if self.in_flight else self._max_completed
+        self.high_water_mark = max(self.high_water_mark, safe_mark)
+        self.mark_updated_at = time.time()
+        if time.monotonic() - self._saved_at >= self.flush_interval:
+            try:
+                self.save()
+            except OSError as e:
+                logger.error(f"Не удалось сохранить отметку обновлений: {e}")
+
+    async def _replay(self, update, record: Optional[TurnRecord]) -> None:
+        """Повторно отправляет сохраненные ответы вместо нового запроса к модели"""
+        if record is None or not record.done or not record.replies or self.sender is None:
+            return
+        chat_id = update.message.chat.id
+        for text, kwargs in record.replies:
+            await self.sender(chat_id, text, **kwargs)
+        self.replayed += 1
+
+    async def __call__(self, handler, event, data):
+        duplicate, record = self._find_duplicate(event)
+        if duplicate:
+            self.duplicates += 1
+            logger.info(f"Повторная доставка обновления {event.update_id} пропущена")
+            await self._replay(event, record)
+            return None
+
+        record = TurnRecord(event.update_id)
+        self._remember(self.updates, event.update_id, record, self.capacity)
+        key = self._message_key(event)
+        if key is not None:
+            self._remember(self.turns, key, record, self.capacity)
+
+        self.in_flight.add(event.update_id)
+        try:
+            return await handler(event, data)
+        finally:
+            record.done = True
+            self._complete(event.update_id)
+
+    def remember_reply(self, chat_id: int, message_id: int, text: str, **kwargs) -> None:
+        """Сохраняет ответ на сообщение, чтобы повторить его при повторной доставке"""
+        record = self.turns.get((chat_id, message_id))
+        if record is not None:
+            record.replies.append((text, kwargs))
+
+    def get_stats(self) -> Dict:
+        return {
+            "high_water_mark": self.high_water_mark,
+            "cached_turns": len(self.turns),
+            "duplicates": self.duplicates,
+            "replayed": self.replayed,
+        }
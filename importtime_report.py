@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Отчет о времени импорта модуля по выводу `python -X importtime`
+
+Использование: python importtime_report.py [модуль] [количество строк]
+"""
+
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List
+
+# Строка вывода: "import time:       123 |       4567 |   package.module"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def parse_importtime(output: str) -> List[Dict]:
+    """Разбирает вывод -X importtime в список записей (время в микросекундах)"""
+    entries = []
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        entries.append({
+            "module": module,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            # Уровень вложенности: каждый уровень добавляет два пробела
+            "depth": (len(indent) - 1) // 2,
+        })
+    return entries
+
+
+def measure_import(module: str, python: str = sys.executable) -> List[Dict]:
+    """Импортирует модуль в отдельном процессе и возвращает разобранный -X importtime"""
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}: {result.stderr[-500:]}")
+    return parse_importtime(result.stderr)
+
+
+def build_report(entries: List[Dict], top: int = 15) -> Dict:
+    """Сводка: общее время, число модулей и самые тяжелые импорты верхнего уровня"""
+    top_level = [entry for entry in entries if entry["depth"] == 0]
+    heaviest = sorted(top_level, key=lambda entry: entry["cumulative_us"], reverse=True)[:top]
+    return {
+        "total_ms": sum(entry["cumulative_us"] for entry in top_level) / 1000,
+        "modules": len(entries),
+        "loaded": {entry["module"] for entry in entries},
+        "heaviest": heaviest,
+    }
+
+
+def format_report(module: str, report: Dict) -> str:
+    lines = [
+        f"Импорт {module}: {report['total_ms']:.1f} мс, модулей: {report['modules']}",
+        "Самые тяжелые импорты верхнего уровня:",
+    ]
+    for entry in report["heaviest"]:
+        lines.append(f"  {entry['cumulative_us'] / 1000:8.1f} мс  {entry['module']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "bot_gpt"
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    print(format_report(target, build_report(measure_import(target), top)))
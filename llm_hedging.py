@@ -0,0 +1,133 @@
+import asyncio
+import random
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type
+
+
+class HedgedRequester:
+    """Ограничивает время запросов к LLM, дублирует медленные запросы и повторяет временные ошибки"""
+
+    def __init__(self, hedge_percentile: float = 95, default_hedge_delay: float = 4.0,
+                 min_hedge_delay: float = 0.5, max_hedge_ratio: float = 0.1,
+                 max_retries: int = 1, base_backoff: float = 0.5, max_backoff: float = 8.0,
+                 transient_exceptions: Tuple[Type[BaseException], ...] = (asyncio.TimeoutError,),
+                 window: int = 200):
+        self.hedge_percentile = hedge_percentile
+        # Задержка дублирования, пока не накопилась статистика
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        # Доля запросов, которые разрешено дублировать (ограничивает рост стоимости)
+        self.max_hedge_ratio = max_hedge_ratio
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.transient_exceptions = tuple(transient_exceptions) + (asyncio.TimeoutError,)
+        self.window = window
+        self.latencies: Dict[str, deque] = {}
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.timeouts = 0
+        # Запросы, результат которых выброшен (проигравшие дубликаты, прерванные по дедлайну) - они тоже оплачиваются
+        self.abandoned = 0
+
+    def hedge_delay(self, key: str) -> float:
+        """Задержка перед дублирующим запросом: перцентиль наблюдаемых задержек"""
+        latencies = self.latencies.get(key)
+        if not latencies or len(latencies) < 20:
+            return self.default_hedge_delay
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(self.hedge_percentile / 100 * len(ordered)))
+        return max(self.min_hedge_delay, ordered[index])
+
+    def _can_hedge(self) -> bool:
+        """Проверяет, не превышен ли бюджет дублирующих запросов"""
+        return self.hedges < self.max_hedge_ratio * self.requests + 1
+
+    def _record_latency(self, key: str, latency: float) -> None:
+        self.latencies.setdefault(key, deque(maxlen=self.window)).append(latency)
+
+    async def _attempt(self, factory: Callable[[], Awaitable], key: str, deadline: float,
+                       on_abandoned: Optional[Callable[[int], None]] = None):
+        """Одна попытка: основной запрос и, при необходимости, дублирующий"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        primary = asyncio.create_task(factory())
+        tasks = {primary}
+        last_error: Optional[BaseException] = None
+
+        try:
+            hedge_at = min(self.hedge_delay(key), deadline)
+            while tasks:
+                remaining = deadline - (loop.time() - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise asyncio.TimeoutError(f"LLM запрос не уложился в {deadline:.1f}с")
+
+                wait_for = remaining
+                hedge_pending = len(tasks) == 1 and primary in tasks and hedge_at is not None
+                if hedge_pending:
+                    wait_for = max(0.0, min(remaining, hedge_at - (loop.time() - started)))
+
+                done, tasks = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        self._record_latency(key, loop.time() - started)
+                        return task.result()
+                    last_error = task.exception()
+
+                if not done and hedge_pending:
+                    # Основной запрос медленнее перцентиля - запускаем дубликат
+                    hedge_at = None
+                    if self._can_hedge():
+                        self.hedges += 1
+                        tasks.add(asyncio.create_task(factory()))
+
+            raise last_error
+        finally:
+            # Отменяем проигравший запрос; завершившиеся в той же пачке уже получили ответ и не считаются брошенными
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self.abandoned += len(tasks)
+                if on_abandoned is not None:
+                    on_abandoned(len(tasks))
+
+    async def run(self, factory: Callable[[], Awaitable], key: str = "default", deadline: float = 30.0,
+                  on_abandoned: Optional[Callable[[int], None]] = None):
+        """Выполняет запрос с общим дедлайном на все попытки, дублированием и повторами с джиттером
+
+        on_abandoned(число) вызывается для запросов, отправленных модели, но отмененных без результата
+        """
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + deadline
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(factory, key, deadline_at - loop.time(), on_abandoned)
+            except self.transient_exceptions:
+                remaining = deadline_at - loop.time()
+                if attempt >= self.max_retries or remaining <= 0:
+                    raise
+                attempt += 1
+                self.retries += 1
+                # Экспоненциальная задержка с полным джиттером (не дольше остатка дедлайна)
+                backoff = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+                await asyncio.sleep(min(remaining, random.uniform(0, backoff)))
+
+    def get_stats(self) -> Dict:
+        """Возвращает статистику дублирования и повторов"""
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "abandoned": self.abandoned,
+            "hedge_delays": {key: round(self.hedge_delay(key), 3) for key in self.latencies},
+        }
@@ -0,0 +1,212 @@
+import json
+from collections import deque
+from typing import Dict, List, Optional
+
+# Цены моделей в долларах за 1M токенов: (вход, выход)
+MODEL_PRICES = {
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Заглушки вместо значения ("Нет информации" и т.п.) означают незаполненное поле или неизвестный блок
+PLACEHOLDER_VALUES = {"", "-", "нет информации", "нет данных", "не указано", "неизвестно", "none", "null"}
+
+
+def normalize_agent_key(key: str) -> str:
+    """Ключ агента без учета регистра и языка префикса: "Agent-блока" и "агент-блока" совпадают"""
+    key = str(key).strip().lower()
+    if key.startswith("agent-"):
+        key = "агент-" + key[len("agent-"):]
+    return key
+
+
+def is_placeholder(value) -> bool:
+    """Значение не заполнено моделью"""
+    return value is None or str(value).strip().lower() in PLACEHOLDER_VALUES
+
+
+class RoutePolicy:
+    """Правило выбора модели и лимита токенов для хода диалога"""
+
+    def __init__(self, name: str, model: str, max_tokens: int = 1000,
+                 blocks: Optional[List[str]] = None,
+                 messages: Optional[List[str]] = None,
+                 max_message_length: Optional[int] = None,
+                 max_profile_completeness: Optional[float] = None,
+                 fallback_model: Optional[str] = None,
+                 timeout: float = 30.0):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        # Подстроки названия блока (значение агент-блока), при которых правило срабатывает
+        self.blocks = [block.lower() for block in (blocks or [])]
+        # Точные тексты сообщений (например, "начало диалога")
+        self.messages = [text.lower() for text in (messages or [])]
+        self.max_message_length = max_message_length
+        self.max_profile_completeness = max_profile_completeness
+        self.fallback_model = fallback_model
+        self.timeout = timeout
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RoutePolicy":
+        """Создает правило из словаря конфигурации"""
+        return cls(**data)
+
+    def matches(self, block: str, message: str, profile_completeness: float) -> bool:
+        """Проверяет, подходит ли правило для текущего хода"""
+        message = (message or "").strip().lower()
+        if self.messages and message not in self.messages:
+            return False
+        if self.blocks and not any(part in block for part in self.blocks):
+            return False
+        if self.max_message_length is not None and len(message) > self.max_message_length:
+            return False
+        if (self.max_profile_completeness is not None
+                and profile_completeness > self.max_profile_completeness):
+            return False
+        return True
+
+
+class RouteStats:
+    """Статистика задержек и стоимости по маршруту"""
+
+    def __init__(self, window: int = 200):
+        self.requests = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self.total_latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Возвращает перцентиль задержки по последним запросам"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_dict(self) -> Dict:
+        successful = self.requests - self.errors
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+            "avg_latency": self.total_latency / successful if successful > 0 else None,
+            "p95_latency": self.percentile(95),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class ModelRouter:
+    """Выбирает модель и max_tokens для каждого хода по блоку, длине сообщения и профайлу"""
+
+    def __init__(self, policies: List[RoutePolicy], default_policy: RoutePolicy,
+                 degraded_policy: Optional[RoutePolicy] = None):
+        self.policies = policies
+        self.default_policy = default_policy
+        # Дешевый маршрут для режима перегрузки
+        self.degraded_policy = degraded_policy
+        self.stats: Dict[str, RouteStats] = {}
+
+    @classmethod
+    def default(cls, primary_model: str = "gpt-4.1-mini", fast_model: str = "gpt-4.1-nano",
+                fallback_model: str = "gpt-4o-mini", timeout: float = 30.0) -> "ModelRouter":
+        """Маршрутизатор по умолчанию: дешевая модель для простых ходов, основная для переговоров"""
+        policies = [
+            # Открывающая реплика полностью предсказуема
+            RoutePolicy("opener", fast_model, max_tokens=900,
+                        messages=["начало диалога"],
+                        fallback_model=primary_model, timeout=timeout),
+            # Короткие ответы в квалификации, пока профайл не близок к заполнению
+            RoutePolicy("qualification_short", fast_model, max_tokens=900,
+                        blocks=["квалификац"], max_message_length=80,
+                        max_profile_completeness=0.75,
+                        fallback_model=primary_model, timeout=timeout),
+        ]
+        default_policy = RoutePolicy("negotiation", primary_model, max_tokens=1000,
+                                     fallback_model=fallback_model, timeout=timeout)
+        degraded_policy = RoutePolicy("degraded", fast_model, max_tokens=900,
+                                      fallback_model=fallback_model, timeout=timeout)
+        return cls(policies, default_policy, degraded_policy)
+
+    @classmethod
+    def from_file(cls, filepath: str) -> "ModelRouter":
+        """Загружает правила из JSON файла: {"policies": [...], "default": {...}, "degraded": {...}}"""
+        with open(filepath, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        policies = [RoutePolicy.from_dict(item) for item in data.get("policies", [])]
+        degraded = RoutePolicy.from_dict(data["degraded"]) if data.get("degraded") else None
+        return cls(policies, RoutePolicy.from_dict(data["default"]), degraded)
+
+    @staticmethod
+    def extract_block(agent_communication: Dict) -> str:
+        """Извлекает значение агент-блока (или agent-блока) из коммуникации агентов"""
+        for key, value in (agent_communication or {}).items():
+            if normalize_agent_key(key) == "агент-блока" and not is_placeholder(value):
+                return str(value).lower()
+        return ""
+
+    @staticmethod
+    def extract_profile(agent_communication: Dict) -> Dict:
+        """Статус профайла из агент-профайла (или agent-профайла); пустой словарь, если его нет"""
+        for key, value in (agent_communication or {}).items():
+            if normalize_agent_key(key) == "агент-профайла" and isinstance(value, dict):
+                profile = value.get("статус_профайла", value)
+                return profile if isinstance(profile, dict) else {}
+        return {}
+
+    @staticmethod
+    def profile_completeness(agent_communication: Dict) -> float:
+        """Доля заполненных полей в статусе профайла (0.0 - 1.0)"""
+        profile = ModelRouter.extract_profile(agent_communication)
+        if not profile:
+            return 0.0
+        filled = sum(1 for value in profile.values() if not is_placeholder(value))
+        return filled / len(profile)
+
+    def select_route(self, block: str, message: str, profile_completeness: float = 0.0) -> RoutePolicy:
+        """Возвращает первое подходящее правило или правило по умолчанию"""
+        for policy in self.policies:
+            if policy.matches(block, message, profile_completeness):
+                return policy
+        return self.default_policy
+
+    def degrade(self, route: RoutePolicy) -> RoutePolicy:
+        """Возвращает дешевый маршрут вместо выбранного (если он задан)"""
+        return self.degraded_policy or route
+
+    def record(self, route_name: str, model: str, latency: float, usage=None,
+               error: bool = False, fallback: bool = False) -> None:
+        """Учитывает результат запроса в статистике маршрута"""
+        stats = self.stats.setdefault(route_name, RouteStats())
+        stats.requests += 1
+        if fallback:
+            stats.fallbacks += 1
+        if error:
+            stats.errors += 1
+            return
+        stats.total_latency += latency
+        stats.latencies.append(latency)
+        if usage is not None:
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cost += estimate_cost(model, prompt_tokens, completion_tokens)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Возвращает статистику по всем маршрутам"""
+        return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Оценивает стоимость запроса в долларах"""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
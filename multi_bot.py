@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Несколько ботов (токен, суперпромт, модели, папки диалогов) в одном процессе и одном цикле событий
+
+Использование: python multi_bot.py [tenants.json]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from typing import Dict, List, Optional
+
+from bot_gpt import BotApplication, create_app
+from config import (
+    OPENAI_API_KEY, LLM_PRIMARY_MODEL, LLM_FAST_MODEL, LLM_FALLBACK_MODEL, LLM_TIMEOUT_SECONDS,
+    LOOP_LAG_THRESHOLD_MS, MULTI_BOT_CONFIG, PERSISTENCE_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+TENANT_NAME_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class TenantConfig:
+    """Настройки одного бота: токен, суперпромт, модели и папки диалогов"""
+
+    def __init__(self, name: str, token: str, prompt_path: Optional[str] = None,
+                 dialogs_folder: Optional[str] = None, docx_folder: Optional[str] = None,
+                 retrieval_index_folder: Optional[str] = None, models: Optional[Dict] = None,
+                 admin_ids: Optional[List[int]] = None, base_folder: str = "tenants"):
+        self.name = name
+        self.token = token
+        self.prompt_path = prompt_path
+        # Диалоги, DOCX и индекс каждого бота хранятся отдельно
+        self.dialogs_folder = dialogs_folder or os.path.join(base_folder, name, "dialogs")
+        self.docx_folder = docx_folder or os.path.join(base_folder, name, "dialogs_docx")
+        self.retrieval_index_folder = retrieval_index_folder or os.path.join(base_folder, name, "dialogs_index")
+        # primary, fast, fallback, timeout или routes_file (правила ModelRouter в JSON)
+        self.models = models or {}
+        self.admin_ids = admin_ids
+
+    @classmethod
+    def from_dict(cls, data: Dict, base_folder: str = "tenants") -> "TenantConfig":
+        """Создает настройки из JSON; токен можно задать переменной окружения (bot_token_env)"""
+        name = data.get("name", "")
+        if not TENANT_NAME_RE.match(name):
+            raise ValueError(f"Некорректное имя бота: {name!r}")
+        token = data.get("bot_token") or (os.getenv(data["bot_token_env"]) if data.get("bot_token_env") else None)
+        if not token:
+            raise ValueError(f"Не задан токен бота {name}")
+        prompt_path = data.get("prompt_path")
+        if prompt_path and not os.path.exists(prompt_path):
+            raise ValueError(f"Файл суперпромта бота {name} не найден: {prompt_path}")
+        return cls(
+            name, token, prompt_path=prompt_path,
+            dialogs_folder=data.get("dialogs_folder"), docx_folder=data.get("docx_folder"),
+            retrieval_index_folder=data.get("retrieval_index_folder"), models=data.get("models"),
+            admin_ids=data.get("admin_ids"), base_folder=base_folder,
+        )
+
+    def build_router(self):
+        """Маршрутизатор моделей бота"""
+        from model_router import ModelRouter
+        if self.models.get("routes_file"):
+            return ModelRouter.from_file(self.models["routes_file"])
+        return ModelRouter.default(
+            self.models.get("primary", LLM_PRIMARY_MODEL), self.models.get("fast", LLM_FAST_MODEL),
+            self.models.get("fallback", LLM_FALLBACK_MODEL), float(self.models.get("timeout", LLM_TIMEOUT_SECONDS))
+        )
+
+
+def load_tenants(filepath: str) -> List[TenantConfig]:
+    """Загружает настройки ботов: {"base_folder": "tenants", "tenants": [...]} или просто список"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"tenants": data}
+    tenants = [TenantConfig.from_dict(item, data.get("base_folder", "tenants")) for item in data.get("tenants", [])]
+    if not tenants:
+        raise ValueError(f"В {filepath} нет ни одного бота")
+
+    # Общие имена, токены или папки смешали бы диалоги разных ботов
+    for attribute in ("name", "token", "dialogs_folder", "docx_folder", "retrieval_index_folder"):
+        values = [getattr(tenant, attribute) for tenant in tenants]
+        if len(set(values)) != len(values):
+            raise ValueError(f"Значение {attribute} повторяется у нескольких ботов")
+    return tenants
+
+
+class SharedResources:
+    """Ресурсы процесса, общие для всех ботов: клиент LLM, лимитер нагрузки, HTTP сессия и пул потоков"""
+
+    def __init__(self, openai_api_key: str = None, persistence_workers: int = PERSISTENCE_WORKERS):
+        self.openai_api_key = openai_api_key or OPENAI_API_KEY
+        # Блокирующие операции с диском (asyncio.to_thread: индекс, выгрузки) всех ботов выполняются в одном пуле
+        self.executor = ThreadPoolExecutor(max_workers=persistence_workers, thread_name_prefix="persistence")
+        self._llm_client = None
+        self._admission = None
+        self._bot_session = None
+        self._loop_monitor = None
+        self._profiler = None
+
+    @property
+    def llm_client(self):
+        """Один AsyncOpenAI (и пул соединений) на все боты; None в тестовом режиме"""
+        if self._llm_client is None and self.openai_api_key and self.openai_api_key != "your_openai_api_key_here":
+            from openai import AsyncOpenAI
+            self._llm_client = AsyncOpenAI(api_key=self.openai_api_key)
+        return self._llm_client
+
+    @property
+    def admission(self):
+        """Общий контроль нагрузки: лимит считается по всем запросам процесса"""
+        if self._admission is None:
+            from admission_control import AdmissionController
+            self._admission = AdmissionController()
+        return self._admission
+
+    @property
+    def bot_session(self):
+        """HTTP сессия aiogram, общая для всех токенов"""
+        if self._bot_session is None:
+            from aiogram.client.session.aiohttp import AiohttpSession
+            self._bot_session = AiohttpSession()
+        return self._bot_session
+
+    @property
+    def loop_monitor(self):
+        if self._loop_monitor is None:
+            from profiling import LoopLagMonitor
+            self._loop_monitor = LoopLagMonitor(threshold_ms=LOOP_LAG_THRESHOLD_MS)
+        return self._loop_monitor
+
+    @property
+    def profiler(self):
+        if self._profiler is None:
+            from profiling import SamplingProfiler
+            self._profiler = SamplingProfiler()
+        return self._profiler
+
+    async def close(self) -> None:
+        """Закрывает общие соединения и пул потоков"""
+        if self._bot_session is not None:
+            await self._bot_session.close()
+        if self._llm_client is not None:
+            await self._llm_client.close()
+        if self._loop_monitor is not None:
+            self._loop_monitor.stop()
+        self.executor.shutdown(wait=False)
+
+
+class MultiBotRuntime:
+    """Запускает ботов в одном цикле событий; ошибка одного бота не останавливает остальных"""
+
+    def __init__(self, tenants: List[TenantConfig], shared: SharedResources = None, stats_interval: float = 600.0):
+        self.shared = shared or SharedResources()
+        self.stats_interval = stats_interval
+        self.apps: Dict[str, BotApplication] = {
+            tenant.name: create_app(
+                token=tenant.token, openai_api_key=self.shared.openai_api_key,
+                dialogs_folder=tenant.dialogs_folder, docx_folder=tenant.docx_folder,
+                prompt_path=tenant.prompt_path, retrieval_index_folder=tenant.retrieval_index_folder,
+                router=tenant.build_router(), admin_ids=tenant.admin_ids, name=tenant.name, shared=self.shared,
+            )
+            for tenant in tenants
+        }
+
+    async def run(self) -> None:
+        """Запускает всех ботов и ждет остановки опроса"""
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.shared.executor)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, lambda: asyncio.ensure_future(self.stop()))
+
+        started = []
+        try:
+            for app in self.apps.values():
+                await app.startup()
+                started.append(app)
+            stats_task = asyncio.create_task(self._log_stats())
+            results = await asyncio.gather(*(
+                app.dispatcher.start_polling(app.bot, handle_signals=False, close_bot_session=False)
+                for app in self.apps.values()
+            ), return_exceptions=True)
+            stats_task.cancel()
+            for name, result in zip(self.apps, results):
+                if isinstance(result, BaseException):
+                    logger.error(f"Бот {name} остановлен с ошибкой: {result!r}")
+        finally:
+            for app in started:
+                await app.shutdown()
+            await self.shared.close()
+
+    async def stop(self) -> None:
+        """Останавливает опрос всех ботов"""
+        for app in self.apps.values():
+            with suppress(RuntimeError):  # опрос этого бота уже остановлен
+                await app.dispatcher.stop_polling()
+
+    async def _log_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            for name, stats in self.get_stats().items():
+                logger.info(f"Бот {name}: {stats}")
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Метрики по каждому боту"""
+        stats = {}
+        for name, app in self.apps.items():
+            routes = app.model_router.get_stats()
+            budget = app.token_budget.get_stats()
+            stats[name] = {
+                "dialogs": app.dialog_fsm.get_stats(),
+                "llm_requests": sum(route["requests"] for route in routes.values()),
+                "llm_errors": sum(route["errors"] for route in routes.values()),
+                "llm_cost_usd": round(sum(route["cost_usd"] for route in routes.values()), 4),
+                "tokens_today": budget["total_tokens_today"],
+                "delivery": {lane: lane_stats["sent"] for lane, lane_stats in app.send_pipeline.get_stats().items()
+                             if isinstance(lane_stats, dict)},
+            }
+        return stats
+
+
+async def main(config_path: str):
+    await MultiBotRuntime(load_tenants(config_path)).run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else MULTI_BOT_CONFIG))
@@ -1,35 +1,110 @@
+import asyncio
 import json
 import re
 import os
 import time
 from datetime import datetime
+from itertools import chain, islice
 from typing import Dict, List, Optional, Tuple
-from openai import OpenAI
+from model_router import ModelRouter, RoutePolicy, is_placeholder
+from llm_hedging import HedgedRequester
+from admission_control import AdmissionController
+from token_budget import ACTION_TRUNCATE, LatencyModel, TokenBudget, TokenCounter, truncate_messages
+from context_cache import COMPLETION_PARAMS, ContextCache, EncodedContext
+
+# Суперпромт по умолчанию (в мультибот-режиме у каждого бота свой файл)
+DEFAULT_PROMPT_PATH = "Промт нейро-продажника для API верс 3_1.txt"
+
+# Итог диалога из поля dialog_outcome ответа модели -> причина завершения в архиве
+DIALOG_OUTCOME_REASONS = {"purchase": "success", "refusal": "refusal"}
+# Модель завершила диалог, но итог не указала: такой диалог не считается успешным
+UNKNOWN_OUTCOME_REASON = "model_finished"
+
+# Доля дедлайна хода, которую может занять основная модель: остаток достается запасной
+PRIMARY_DEADLINE_SHARE = 0.7
+
+# Ответ пользователю, если запрос не укладывается в бюджет токенов
+BUDGET_EXCEEDED_MESSAGE = "Извините, лимит на сегодня исчерпан. Пожалуйста, продолжите диалог завтра."
 
 class NeuroSalesmanGPT:
-    def __init__(self, api_key: str = None):
-        # Инициализация OpenAI
-        self.client = None
+    def __init__(self, api_key: str = None, router: ModelRouter = None, hedger: HedgedRequester = None,
+                 admission: AdmissionController = None, retriever=None, retrieval_top_k: int = 3,
+                 budget: TokenBudget = None, prompt_path: str = None, client=None):
+        # Инициализация OpenAI: клиент создается при первом запросе, чтобы не загружать SDK при импорте
+        # (в мультибот-режиме передается общий клиент с одним пулом соединений)
+        self._client = client
+        self.api_key = None
         if api_key:
-            self.client = OpenAI(api_key=api_key)
+            self.api_key = api_key
         else:
             # Пытаемся получить API ключ из переменных окружения
             env_api_key = os.getenv('OPENAI_API_KEY')
             if env_api_key and env_api_key != "your_openai_api_key_here":
-                self.client = OpenAI(api_key=env_api_key)
+                self.api_key = env_api_key
             else:
                 print("⚠️  OpenAI API ключ не настроен. Бот будет работать в тестовом режиме.")
         
         # Загружаем суперпромт
+        self.prompt_path = prompt_path or DEFAULT_PROMPT_PATH
         self.system_prompt = self._load_super_prompt()
         
         # История диалогов для каждого пользователя
         self.conversation_history = {}
         
+        # Маршрутизатор моделей и последняя коммуникация агентов для выбора маршрута
+        self.router = router or ModelRouter.default()
+        self.last_agent_communication = {}
+        
+        # Флаг dialog_finished из JSON ответа модели: пользователь -> причина завершения по dialog_outcome
+        self.finished_dialogs: Dict[int, str] = {}
+        
+        # Заранее закодированный контекст (тело запроса) каждой сессии: ход дописывает только новые байты
+        self.system_message = {"role": "system", "content": self.system_prompt}
+        self.context_cache = ContextCache(self.system_prompt)
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+        
+        # Дедлайны, дублирование медленных запросов и повторы временных ошибок
+        self._hedger = hedger
+        
+        # Контроль нагрузки: укороченная история и дешевая модель при перегрузке
+        self.admission = admission or AdmissionController()
+        
+        # Индекс успешных диалогов (retrieval.DialogIndex): примеры ответов вместо длинного промта
+        self.retriever = retriever
+        self.retrieval_top_k = retrieval_top_k
+        
+        # Подсчет токенов до запроса, бюджеты и прогноз задержки по числу токенов
+        self.token_counter = TokenCounter()
+        self.budget = budget or TokenBudget()
+        self.latency_model = LatencyModel()
+    
+    @property
+    def client(self):
+        """Асинхронный клиент OpenAI (None в тестовом режиме)"""
+        if self._client is None and self.api_key:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=self.api_key)
+        return self._client
+    
+    @client.setter
+    def client(self, value):
+        self._client = value
+    
+    @property
+    def hedger(self) -> HedgedRequester:
+        """Обертка запросов с дедлайнами, дублированием и повторами временных ошибок OpenAI"""
+        if self._hedger is None:
+            from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+            self._hedger = HedgedRequester(
+                transient_exceptions=(APITimeoutError, APIConnectionError, RateLimitError, InternalServerError)
+            )
+        return self._hedger
+        
     def _load_super_prompt(self) -> str:
         """Загружает суперпромт из файла"""
         try:
-            with open('Промт нейро-продажника для API верс 3_1.txt', 'r', encoding='utf-8') as file:
+            with open(self.prompt_path, 'r', encoding='utf-8') as file:
                 return file.read()
         except FileNotFoundError:
             return "Промт не найден"
@@ -49,76 +124,249 @@ class NeuroSalesmanGPT:
             "timestamp": datetime.now().isoformat()
         })
     
-    def _generate_response_with_gpt(self, user_id: int, user_message: str) -> Tuple[str, Dict]:
-        """Генерирует ответ используя GPT и суперпромт"""
-        
-        # Добавляем сообщение пользователя в историю
-        self._add_to_history(user_id, "user", user_message)
-        
-        # Если клиент не инициализирован, возвращаем тестовый ответ
-        if not self.client:
-            test_response = f"Тестовый режим: Получено сообщение '{user_message}'. Для полноценной работы настройте OPENAI_API_KEY."
-            self._add_to_history(user_id, "assistant", test_response)
-            return test_response, {}
-        
-        # Формируем сообщения для GPT
+    def _build_messages(self, history: List[Dict]) -> List[Dict]:
+        """Формирует сообщения для GPT: суперпромт и история диалога"""
         messages = [
             {
                 "role": "system",
                 "content": self.system_prompt
             }
         ]
-        
-        # Добавляем историю диалога
-        history = self._get_conversation_history(user_id)
-        for msg in history[:-1]:  # Исключаем последнее сообщение пользователя
+        for msg in history:
             messages.append({
                 "role": msg["role"],
                 "content": msg["content"]
             })
+        return messages
+    
+    def prepare_next_turn(self, user_id: int) -> None:
+        """Заранее кодирует контекст для следующего хода, пока пользователь печатает"""
+        self.context_cache.update(user_id, self._get_conversation_history(user_id))
+    
+    def _take_encoded_context(self, user_id: int, history: List[Dict], upto: int,
+                              tail: List[Dict]) -> EncodedContext:
+        """Контекст из кэша: если он подготовлен заранее, на горячем пути кодируется только хвост хода"""
+        if self.context_cache.update(user_id, history, upto):
+            self.prepared_misses += 1
+        else:
+            self.prepared_hits += 1
+        return self.context_cache.context(user_id, tail)
+    
+    def _retrieve_exemplars(self, user_message: str) -> Optional[str]:
+        """Ответы из успешных диалогов на похожие сообщения клиентов"""
+        if self.retriever is None:
+            return None
+        try:
+            hits = self.retriever.search(user_message, k=self.retrieval_top_k)
+        except Exception as e:
+            print(f"Ошибка поиска по индексу диалогов: {e}")
+            return None
+        return self.retriever.format_exemplars(hits) if hits else None
+    
+    def is_mid_sale(self, user_id: int) -> bool:
+        """Диалог уже вышел из квалификации (презентация, дожим, оплата)"""
+        block = ModelRouter.extract_block(self.last_agent_communication.get(user_id, {}))
+        return bool(block) and "квалификац" not in block
+    
+    def get_user_profile(self, user_id: int) -> Dict:
+        """Заполненные поля профайла клиента из последнего ответа агента-профайла"""
+        profile = ModelRouter.extract_profile(self.last_agent_communication.get(user_id, {}))
+        return {key: value for key, value in profile.items() if not is_placeholder(value)}
+    
+    def select_route(self, user_id: int, user_message: str) -> RoutePolicy:
+        """Выбирает модель и лимит токенов по текущему блоку, сообщению и профайлу"""
+        last_communication = self.last_agent_communication.get(user_id, {})
+        return self.router.select_route(
+            ModelRouter.extract_block(last_communication),
+            user_message,
+            ModelRouter.profile_completeness(last_communication)
+        )
+    
+    def _accept_response(self, user_id: int, assistant_response: str) -> Tuple[str, Dict]:
+        """Сохраняет ответ ассистента в историю и разбирает JSON"""
+        # Добавляем ответ ассистента в историю
+        self._add_to_history(user_id, "assistant", assistant_response)
         
-        # Добавляем текущее сообщение пользователя
-        messages.append({
+        # Парсим JSON ответ
+        try:
+            response_data = json.loads(assistant_response)
+            agent_communication = response_data.get('agent_communication', {})
+            message_text = response_data.get('message', assistant_response)
+            if isinstance(agent_communication, dict):
+                self.last_agent_communication[user_id] = agent_communication
+            if response_data.get('dialog_finished') is True:
+                outcome = str(response_data.get('dialog_outcome') or '').strip().lower()
+                self.finished_dialogs[user_id] = DIALOG_OUTCOME_REASONS.get(outcome, UNKNOWN_OUTCOME_REASON)
+            return message_text, agent_communication
+        except json.JSONDecodeError:
+            # Если JSON не парсится, возвращаем как есть
+            return assistant_response, {}
+    
+    async def _generate_response_with_gpt(self, user_id: int, user_message: str) -> Tuple[str, Dict]:
+        """Генерирует ответ используя GPT и суперпромт"""
+        
+        # Берем историю до нового сообщения (для подготовленного контекста)
+        history = self._get_conversation_history(user_id)
+        previous_length = len(history)
+        
+        # Добавляем сообщение пользователя в историю
+        self._add_to_history(user_id, "user", user_message)
+        
+        # Если клиент не инициализирован, возвращаем тестовый ответ
+        if not self.client:
+            test_response = f"Тестовый режим: Получено сообщение '{user_message}'. Для полноценной работы настройте OPENAI_API_KEY."
+            self._add_to_history(user_id, "assistant", test_response)
+            return test_response, {}
+        
+        # Хвост хода: примеры из успешных диалогов и новое сообщение
+        tail = []
+        exemplars = self._retrieve_exemplars(user_message)
+        if exemplars:
+            tail.append({"role": "system", "content": exemplars})
+        tail.append({
             "role": "user",
             "content": user_message
         })
         
+        # Формируем контекст для GPT: закодированная заранее история плюс хвост хода
+        # Диалоги в середине продажи не деградируют: полная история и основная модель
+        protected = self.is_mid_sale(user_id)
+        history_limit = self.admission.history_window(protected)
+        if history_limit is not None and previous_length > history_limit:
+            # Под нагрузкой отправляем только последние сообщения истории
+            messages = self._build_messages(history[previous_length - history_limit:previous_length]) + tail
+            encoded = None
+        else:
+            messages = None
+            encoded = self._take_encoded_context(user_id, history, previous_length, tail)
+        
+        route = self.select_route(user_id, user_message)
+        if self.admission.use_cheap_model(protected):
+            route = self.router.degrade(route)
+        
+        # Считаем токены до запроса и проверяем бюджет
+        prompt_tokens = self.token_counter.count_messages(
+            messages if messages is not None
+            else chain([self.system_message], islice(history, previous_length), tail)
+        )
+        decision = self.budget.check(user_id, prompt_tokens, route.max_tokens)
+        if decision.action == ACTION_TRUNCATE:
+            if messages is None:
+                messages = self._build_messages(history[:previous_length]) + tail
+                encoded = None
+            messages, prompt_tokens = truncate_messages(messages, self.token_counter, decision.max_prompt_tokens)
+        if decision.blocked or (decision.action == ACTION_TRUNCATE and prompt_tokens > decision.max_prompt_tokens):
+            # Сообщение не обработано: убираем его из истории, чтобы его можно было повторить
+            history.pop()
+            return BUDGET_EXCEEDED_MESSAGE, {}
+        expected_latency = self.latency_model.predict(route.model, prompt_tokens, decision.max_completion_tokens)
+        if expected_latency is not None and expected_latency > route.timeout:
+            print(f"⚠️  Ожидаемая задержка {expected_latency:.1f}с превышает таймаут маршрута {route.name}")
+        
         try:
-            # Добавляем небольшую задержку для избежания превышения лимитов
-            time.sleep(1)
-            
             # Вызываем GPT с форматированием JSON
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-mini",  # Используем gpt-4.1-mini
-                messages=messages,
-                temperature=0.25,  # Немного увеличиваем для более живого общения
-                top_p=1.0,  # Контролируем разнообразие ответов
-                frequency_penalty=0.2,  # Снижаем повторения
-                presence_penalty=0.1,  # Поощряем новые темы
-                max_tokens=1000,
-                response_format={'type': 'json_object'}  # Заставляем GPT возвращать JSON
-            )
+            async with self.admission.track():
+                response = await self._create_completion(route, messages, decision.max_completion_tokens, user_id, encoded,
+                                                         prompt_tokens)
             
             # Получаем ответ
             assistant_response = response.choices[0].message.content
-            
-            # Добавляем ответ ассистента в историю
-            self._add_to_history(user_id, "assistant", assistant_response)
-            
-            # Парсим JSON ответ
-            try:
-                response_data = json.loads(assistant_response)
-                agent_communication = response_data.get('agent_communication', {})
-                message_text = response_data.get('message', assistant_response)
-                return message_text, agent_communication
-            except json.JSONDecodeError:
-                # Если JSON не парсится, возвращаем как есть
-                return assistant_response, {}
+            return self._accept_response(user_id, assistant_response)
             
         except Exception as e:
             error_response = f"Извините, произошла ошибка при обработке вашего сообщения: {str(e)}"
             return error_response, {}
     
+    async def generate_detached(self, user_message: str) -> str:
+        """Генерирует ответ на первое сообщение без привязки к пользователю (для заготовок)"""
+        messages = self._build_messages([])
+        messages.append({
+            "role": "user",
+            "content": user_message
+        })
+        route = self.router.select_route("", user_message, 0.0)
+        response = await self._create_completion(route, messages)
+        return response.choices[0].message.content
+    
+    def apply_precomputed(self, user_id: int, user_message: str, assistant_response: str) -> Tuple[str, Dict]:
+        """Использует заранее сгенерированный ответ как ответ на сообщение пользователя"""
+        self._add_to_history(user_id, "user", user_message)
+        return self._accept_response(user_id, assistant_response)
+    
+    async def prewarm(self, user_id: int) -> None:
+        """Прогревает кэш префикса промта для ожидаемого следующего хода"""
+        if not self.client:
+            return
+        history = self._get_conversation_history(user_id)
+        route = self.select_route(user_id, "")
+        response = await self.client.with_options(timeout=route.timeout, max_retries=0).chat.completions.create(
+            model=route.model,
+            messages=self._build_messages(history),
+            max_tokens=1
+        )
+        # Прогрев оплачивается как обычный запрос: учитываем его в бюджете диалога
+        if response.usage is not None:
+            self.budget.charge(user_id, route.model, response.usage.prompt_tokens or 0,
+                               response.usage.completion_tokens or 0)
+    
+    async def _create_completion(self, route: RoutePolicy, messages: Optional[List[Dict]], max_tokens: Optional[int] = None,
+                                 user_id: Optional[int] = None, encoded: Optional[EncodedContext] = None,
+                                 estimated_prompt_tokens: Optional[int] = None):
+        """Вызывает модель маршрута, при таймауте или ошибке переключается на запасную"""
+        max_tokens = max_tokens or route.max_tokens
+        if estimated_prompt_tokens is None and messages is not None:
+            estimated_prompt_tokens = self.token_counter.count_messages(messages)
+        models = [route.model]
+        if route.fallback_model and route.fallback_model != route.model:
+            models.append(route.fallback_model)
+        
+        # Один дедлайн на ход: дубликаты, повторы и запасная модель укладываются в таймаут маршрута
+        deadline_at = time.monotonic() + route.timeout
+        last_error = None
+        for attempt, model in enumerate(models):
+            started = time.monotonic()
+            remaining = deadline_at - started
+            if remaining <= 0:
+                break
+            if attempt < len(models) - 1:
+                remaining *= PRIMARY_DEADLINE_SHARE
+            
+            def request(model=model, timeout=remaining):
+                client = self.client.with_options(timeout=timeout, max_retries=0)
+                if encoded is not None:
+                    # Готовое тело запроса: SDK передает байты как есть, без повторного JSON кодирования
+                    from openai.types.chat import ChatCompletion
+                    return client.post("/chat/completions", body=encoded.body(model, max_tokens), cast_to=ChatCompletion)
+                return client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    **COMPLETION_PARAMS
+                )
+            
+            def charge_abandoned(count: int, model=model):
+                # Отмененные дубликаты и запросы, прерванные по дедлайну, оплачиваются как минимум за запрос
+                self.budget.charge(user_id, model, (estimated_prompt_tokens or 0) * count, 0)
+            
+            try:
+                response = await self.hedger.run(request, key=model, deadline=remaining,
+                                                 on_abandoned=charge_abandoned)
+            except Exception as e:
+                self.router.record(route.name, model, time.monotonic() - started, error=True, fallback=attempt > 0)
+                last_error = e
+                continue
+            
+            latency = time.monotonic() - started
+            self.router.record(route.name, model, latency, usage=response.usage, fallback=attempt > 0)
+            if response.usage is not None:
+                prompt_tokens = response.usage.prompt_tokens or 0
+                completion_tokens = response.usage.completion_tokens or 0
+                self.latency_model.observe(model, prompt_tokens, completion_tokens, latency)
+                self.budget.charge(user_id, model, prompt_tokens, completion_tokens)
+            return response
+        
+        raise last_error or asyncio.TimeoutError(f"LLM запрос не уложился в {route.timeout:.1f}с")
+    
     def _extract_agent_communication(self, response: str) -> Dict:
         """Извлекает информацию о коммуникации агентов из ответа"""
         # Пытаемся найти JSON в ответе
@@ -143,19 +391,34 @@ class NeuroSalesmanGPT:
     
 
     
-    def process_message(self, user_id: int, message: str) -> Tuple[str, Dict]:
+    async def process_message(self, user_id: int, message: str) -> Tuple[str, Dict]:
         """Основной метод обработки сообщения пользователя"""
         
         # Генерируем ответ с помощью GPT и суперпромта
-        response, agent_communication = self._generate_response_with_gpt(user_id, message)
+        response, agent_communication = await self._generate_response_with_gpt(user_id, message)
         
         return response, agent_communication
     
+    def take_dialog_finished(self, user_id: int) -> Optional[str]:
+        """Проверяет и сбрасывает флаг завершения диалога; возвращает причину завершения (None - диалог идет)"""
+        return self.finished_dialogs.pop(user_id, None)
+    
     def get_conversation_history(self, user_id: int) -> List[Dict]:
         """Возвращает историю диалога пользователя"""
         return self._get_conversation_history(user_id)
     
+    def restore_conversation(self, user_id: int, history: List[Dict], agent_communication: Optional[Dict] = None):
+        """Восстанавливает историю диалога после перезапуска"""
+        # Копия списка: журнал сессий ведет свою историю и дописывает в нее сам
+        self.conversation_history[user_id] = list(history)
+        if agent_communication:
+            self.last_agent_communication[user_id] = agent_communication
+    
     def reset_conversation(self, user_id: int):
         """Сбрасывает историю диалога для пользователя"""
         if user_id in self.conversation_history:
-            del self.conversation_history[user_id] 
\ No newline at end of file
+            del self.conversation_history[user_id]
+        self.last_agent_communication.pop(user_id, None)
+        self.context_cache.forget(user_id)
+        self.finished_dialogs.pop(user_id, None)
+        self.budget.forget_dialog(user_id) 
\ No newline at end of file
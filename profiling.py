@@ -0,0 +1,175 @@
+import asyncio
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """Профилирование на N секунд: cProfile (pstats) и выборка стеков потока цикла (flamegraph)"""
+
+    def __init__(self, output_folder: str = "profiles", sample_interval: float = 0.005):
+        self.output_folder = output_folder
+        self.sample_interval = sample_interval
+        self.running = False
+
+    def _sample_stacks(self, thread_id: int, stop: threading.Event, samples: Counter) -> None:
+        """Периодически снимает стек потока цикла событий в свернутом формате"""
+        while not stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            samples[";".join(reversed(stack))] += 1
+
+    async def profile(self, seconds: float) -> Tuple[str, str]:
+        """Профилирует цикл событий заданное время и возвращает пути к .pstats и .folded"""
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+        if not os.path.exists(self.output_folder):
+            os.makedirs(self.output_folder)
+
+        self.running = True
+        samples = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample_stacks, args=(threading.get_ident(), stop, samples), daemon=True
+        )
+        # cProfile включается в потоке цикла: учитываются все обработчики и задачи за это время
+        profiler = cProfile.Profile()
+        try:
+            sampler.start()
+            profiler.enable()
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            stop.set()
+            sampler.join()
+            self.running = False
+
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        pstats_path = os.path.join(self.output_folder, f"profile_{timestamp}.pstats")
+        folded_path = os.path.join(self.output_folder, f"profile_{timestamp}.folded")
+        profiler.dump_stats(pstats_path)
+        # Формат flamegraph.pl / speedscope: "кадр;кадр;кадр количество"
+        with open(folded_path, 'w', encoding='utf-8') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return pstats_path, folded_path
+
+
+class LoopLagMonitor:
+    """Следит за задержкой цикла событий и логирует стек, который его блокирует"""
+
+    def __init__(self, threshold_ms: float = 200.0, interval: float = 0.1):
+        self.threshold_ms = threshold_ms
+        self.interval = interval
+        self.last_beat = time.monotonic()
+        self.max_lag_ms = 0.0
+        self.stalls = 0
+        self.lags = deque(maxlen=600)
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.monotonic() - expected) * 1000)
+            self.lags.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def _watch(self) -> None:
+        """Поток-наблюдатель: если цикл не отвечает дольше порога, снимает его стек"""
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self.last_beat
+            blocked_ms = (time.monotonic() - beat) * 1000 - self.interval * 1000
+            if blocked_ms < self.threshold_ms or beat == reported_beat:
+                continue
+            reported_beat = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "стек недоступен"
+            logger.warning(f"Цикл событий заблокирован более {blocked_ms:.0f} мс:\n{stack}")
+
+    def start(self) -> None:
+        """Запускает наблюдение (вызывается из работающего цикла событий)"""
+        if self._heartbeat is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        """Останавливает наблюдение"""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def get_stats(self) -> Dict:
+        ordered = sorted(self.lags)
+        p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] if ordered else None
+        return {
+            "threshold_ms": self.threshold_ms,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "p99_lag_ms": round(p99, 1) if p99 is not None else None,
+            "stalls": self.stalls,
+        }
+
+
+class HandlerTimings:
+    """Middleware aiogram: собирает время выполнения по каждому обработчику"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self.timings: Dict[str, deque] = {}
+        self.counts: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors[name] += 1
+            raise
+        finally:
+            self.counts[name] += 1
+            self.timings.setdefault(name, deque(maxlen=self.window)).append(time.perf_counter() - started)
+
+    def get_stats(self) -> List[Dict]:
+        """Агрегаты по обработчикам, от самых медленных по p95"""
+        stats = []
+        for name, timings in self.timings.items():
+            ordered = sorted(timings)
+            stats.append({
+                "handler": name,
+                "count": self.counts[name],
+                "errors": self.errors[name],
+                "avg_ms": sum(ordered) / len(ordered) * 1000,
+                "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000,
+                "max_ms": ordered[-1] * 1000,
+            })
+        return sorted(stats, key=lambda item: item["p95_ms"], reverse=True)
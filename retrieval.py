@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Синтетическое первое сообщение диалога - не пример ответа клиенту
+OPENER_MESSAGE = "начало диалога"
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """Локальные эмбеддинги без сети: хэширование слов и символьных n-грамм в вектор фиксированной длины"""
+
+    def __init__(self, dim: int = 512, ngram: int = 4):
+        self.dim = dim
+        self.ngram = ngram
+
+    def _features(self, text: str) -> List[str]:
+        """Слова и n-граммы внутри слов (устойчиво к падежным окончаниям)"""
+        features = []
+        for word in WORD_PATTERN.findall(text.lower()):
+            features.append(word)
+            padded = f"_{word}_"
+            for start in range(max(1, len(padded) - self.ngram + 1)):
+                features.append(padded[start:start + self.ngram])
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Матрица len(texts) x dim с единичными по норме строками"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode('utf-8'))
+                # Знак из старшего бита уменьшает искажения от коллизий
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        # Сублинейный вес частоты
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class DialogIndex:
+    """Индекс пар "клиент - ответ" из успешных диалогов: матрица на диске (memmap) и метаданные в JSONL"""
+
+    def __init__(self, index_folder: str = "dialogs_index", embedder=None, success_reasons=("success",)):
+        self.index_folder = index_folder
+        self.embedder = embedder or HashingEmbedder()
+        self.success_reasons = set(success_reasons)
+        self.vectors_path = os.path.join(index_folder, "vectors.f32")
+        self.meta_path = os.path.join(index_folder, "meta.jsonl")
+        self.manifest_path = os.path.join(index_folder, "index.json")
+        # Файлы архива, которые не попали в индекс (неуспешные диалоги): при синхронизации не перечитываются
+        self.skipped_path = os.path.join(index_folder, "skipped.jsonl")
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.memmap] = None
+        self.metadata: List[Dict] = []
+        self.sources = set()
+        self.skipped = set()
+        self.searches = 0
+        self._load()
+
+    def _load(self) -> None:
+        """Читает метаданные; при смене эмбеддера индекс начинается заново"""
+        if not os.path.exists(self.index_folder):
+            os.makedirs(self.index_folder)
+        manifest = {"dim": self.embedder.dim, "embedder": type(self.embedder).__name__}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                if json.load(f) != manifest:
+                    logger.info("Эмбеддер изменился, индекс диалогов будет перестроен")
+                    self._reset()
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.metadata = [json.loads(line) for line in f if line.strip()]
+        # Если запись прервалась между файлами, оставляем только согласованные строки
+        row_size = 4 * self.embedder.dim
+        rows = os.path.getsize(self.vectors_path) // row_size if os.path.exists(self.vectors_path) else 0
+        self.metadata = self.metadata[:rows]
+        if rows > len(self.metadata):
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(len(self.metadata) * row_size)
+        self.sources = {item["source"] for item in self.metadata}
+        if os.path.exists(self.skipped_path):
+            with open(self.skipped_path, 'r', encoding='utf-8') as f:
+                self.skipped = {json.loads(line) for line in f if line.strip()}
+
+    def _reset(self) -> None:
+        for path in (self.vectors_path, self.meta_path, self.skipped_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.metadata = []
+        self.sources = set()
+        self.skipped = set()
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    @property
+    def matrix(self) -> Optional[np.memmap]:
+        """Матрица эмбеддингов, отображенная в память (переоткрывается после добавления)"""
+        if self._matrix is None and self.metadata:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                     shape=(len(self.metadata), self.embedder.dim))
+        return self._matrix
+
+    @staticmethod
+    def extract_pairs(dialog_data: Dict) -> List[Dict]:
+        """Пары "сообщение клиента - ответ продажника" из диалога"""
+        pairs = []
+        for message in dialog_data.get("messages", []):
+            client = (message.get("client_message") or "").strip()
+            response = (message.get("neuro_salesman_response") or "").strip()
+            if not client or not response or client == OPENER_MESSAGE:
+                continue
+            pairs.append({"client": client, "response": response})
+        return pairs
+
+    def add_dialog(self, dialog_data: Dict, source: str) -> int:
+        """Дописывает в индекс завершенный диалог, если он успешный; возвращает число пар"""
+        if source in self.sources or source in self.skipped:
+            return 0
+        pairs = self.extract_pairs(dialog_data) if dialog_data.get("finish_reason") in self.success_reasons else []
+        if not pairs:
+            self._skip(source)
+            return 0
+        vectors = self.embedder.embed([pair["client"] for pair in pairs])
+        with self._lock:
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.astype(np.float32).tobytes())
+            with open(self.meta_path, 'a', encoding='utf-8') as f:
+                for pair in pairs:
+                    item = dict(pair, source=source)
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                    self.metadata.append(item)
+            self.sources.add(source)
+            self._matrix = None
+        return len(pairs)
+
+    def _skip(self, source: str) -> None:
+        """Запоминает файл, который не попадает в индекс"""
+        with self._lock:
+            with open(self.skipped_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(source, ensure_ascii=False) + "\n")
+            self.skipped.add(source)
+
+    def sync(self, dialogs_folder: str = "dialogs") -> int:
+        """Добавляет в индекс успешные диалоги из архива, которых в нем еще нет"""
+        added = 0
+        if not os.path.exists(dialogs_folder):
+            return added
+        for filename in sorted(os.listdir(dialogs_folder)):
+            filepath = os.path.join(dialogs_folder, filename)
+            if not filename.endswith('.json') or filepath in self.sources or filepath in self.skipped:
+                continue
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    added += self.add_dialog(json.load(f), filepath)
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось проиндексировать {filepath}: {e}")
+        return added
+
+    def search(self, query: str, k: int = 3, min_score: float = 0.2) -> List[Dict]:
+        """Косинусный top-k по сообщениям клиентов из успешных диалогов"""
+        with self._lock:
+            matrix = self.matrix
+            metadata = self.metadata[:len(matrix)] if matrix is not None else []
+        if not metadata or not query.strip():
+            return []
+        self.searches += 1
+        scores = matrix @ self.embedder.embed([query])[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        hits = []
+        for row in top[np.argsort(-scores[top])]:
+            if scores[row] < min_score:
+                break
+            hits.append(dict(metadata[row], score=float(scores[row])))
+        return hits
+
+    @staticmethod
+    def format_exemplars(hits: List[Dict], max_chars: int = 300) -> str:
+        """Компактный блок примеров для промта"""
+        lines = ["Примеры ответов из успешных диалогов на похожие сообщения "
+                 "(ориентир по смыслу и тону, не копируй дословно):"]
+        for index, hit in enumerate(hits, 1):
+            response = hit["response"]
+            if len(response) > max_chars:
+                response = response[:max_chars].rstrip() + "…"
+            lines.append(f"{index}. Клиент: {hit['client'][:max_chars]}\n   Ответ: {response}")
+        return "\n".join(lines)
+
+    def get_stats(self) -> Dict:
+        return {
+            "pairs": len(self.metadata),
+            "dialogs": len(self.sources),
+            "skipped": len(self.skipped),
+            "searches": self.searches,
+        }
@@ -0,0 +1,269 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньшее значение отправляется раньше
+LANE_LIVE = 0      # живые ответы в диалоге
+LANE_NOTICE = 1    # уведомления о таймауте и служебные сообщения
+LANE_BULK = 2      # DOCX файлы и массовые выгрузки
+
+LANE_NAMES = {LANE_LIVE: "live", LANE_NOTICE: "notice", LANE_BULK: "bulk"}
+
+
+class PipelineStoppedError(RuntimeError):
+    """Обработчик очереди не запущен или остановлен: запрос не будет отправлен"""
+
+
+class OutboundItem:
+    """Исходящий запрос к Telegram в очереди"""
+
+    def __init__(self, chat_id: int, method: str, lane: int, kwargs: Dict, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.method = method
+        self.lane = lane
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class LaneStats:
+    """Статистика задержки доставки по полосе"""
+
+    def __init__(self, window: int = 500):
+        self.sent = 0
+        self.failed = 0
+        self.retry_after = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        self.sent += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.latencies.append(latency)
+
+    def to_dict(self) -> Dict:
+        ordered = sorted(self.latencies)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else None
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retry_after": self.retry_after,
+            "avg_latency": self.total_latency / self.sent if self.sent else None,
+            "p95_latency": p95,
+            "max_latency": self.max_latency,
+        }
+
+
+class SendPipeline:
+    """Единая очередь исходящих сообщений с ограничением частоты и учетом RetryAfter"""
+
+    def __init__(self, bot, per_chat_interval: float = 0.5, global_rate: float = 25.0,
+                 max_concurrency: int = 8, max_retries: int = 3):
+        self.bot = bot
+        # Telegram: около 1 сообщения в секунду в чат (короткие всплески допустимы) и ~30 в секунду на бота
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1.0 / global_rate
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._ready = []     # (полоса, порядковый номер, элемент)
+        self._delayed = []   # (время готовности, порядковый номер, элемент)
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._chat_next_allowed: Dict[int, float] = {}
+        self._chat_in_flight = set()
+        self._next_global_slot = 0.0
+        # Пауза для фоновых полос после RetryAfter (живые ответы не тормозим)
+        self._background_pause_until = 0.0
+        self._worker: Optional[asyncio.Task] = None
+        # Запросы, которые сейчас выполняются: задача -> элемент очереди
+        self._deliveries: Dict[asyncio.Task, OutboundItem] = {}
+        self.stats = {lane: LaneStats() for lane in LANE_NAMES}
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self) -> None:
+        """Запускает обработчик очереди"""
+        if not self.running:
+            self._worker = asyncio.create_task(self._run())
+            self._worker.add_done_callback(self._on_worker_done)
+
+    async def drain(self, timeout: float) -> bool:
+        """Ждет, пока очередь опустеет (не дольше timeout); True - все отправлено"""
+        deadline = time.monotonic() + timeout
+        while self._ready or self._delayed or self._deliveries:
+            if not self.running or time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        """Досылает очередь (не дольше drain_timeout) и останавливает обработчик; неотправленное завершается ошибкой"""
+        if self.running and drain_timeout > 0 and not await self.drain(drain_timeout):
+            logger.warning(f"Очередь отправки остановлена, не отправлено: "
+                           f"{len(self._ready) + len(self._delayed) + len(self._deliveries)}")
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        deliveries = list(self._deliveries)
+        for task in deliveries:
+            task.cancel()
+        await asyncio.gather(*deliveries, return_exceptions=True)
+        self._fail_pending(PipelineStoppedError("Очередь отправки остановлена"))
+
+    def _on_worker_done(self, worker: asyncio.Task) -> None:
+        """Обработчик очереди завершился (остановка или ошибка): ожидающие не должны зависнуть"""
+        if not worker.cancelled() and worker.exception() is not None:
+            logger.error(f"Обработчик очереди отправки упал: {worker.exception()!r}")
+        self._fail_pending(PipelineStoppedError("Обработчик очереди отправки не работает"))
+
+    def _fail_pending(self, error: Exception) -> None:
+        """Завершает ошибкой все запросы, которые уже не будут отправлены"""
+        items = [item for _, _, item in self._ready] + [item for _, _, item in self._delayed]
+        items += list(self._deliveries.values())
+        self._ready = []
+        self._delayed = []
+        self._deliveries.clear()
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(error)
+
+    def enqueue(self, chat_id: int, method: str, lane: int = LANE_LIVE, **kwargs) -> asyncio.Future:
+        """Ставит запрос в очередь и возвращает future с результатом отправки"""
+        future = asyncio.get_running_loop().create_future()
+        item = OutboundItem(chat_id, method, lane, kwargs, future)
+        future.add_done_callback(self._log_failure)
+        if not self.running:
+            future.set_exception(PipelineStoppedError("Очередь отправки не запущена"))
+            return future
+        heapq.heappush(self._ready, (lane, next(self._counter), item))
+        self._wakeup.set()
+        return future
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        """Логирует ошибку доставки (в том числе для запросов, которые никто не ждет)"""
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Не удалось доставить сообщение: {future.exception()}")
+
+    async def send_message(self, chat_id: int, text: str, lane: int = LANE_LIVE, **kwargs):
+        """Отправляет сообщение через очередь и ждет доставки"""
+        return await self.enqueue(chat_id, "send_message", lane, text=text, **kwargs)
+
+    async def send_document(self, chat_id: int, document, lane: int = LANE_BULK, **kwargs):
+        """Отправляет документ через очередь и ждет доставки"""
+        return await self.enqueue(chat_id, "send_document", lane, document=document, **kwargs)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, lane: int = LANE_NOTICE, **kwargs):
+        """Редактирует отправленное сообщение через очередь (прогресс фоновых задач)"""
+        return await self.enqueue(chat_id, "edit_message_text", lane, message_id=message_id, text=text, **kwargs)
+
+    def _delay(self, item: OutboundItem, ready_at: float) -> None:
+        heapq.heappush(self._delayed, (ready_at, next(self._counter), item))
+
+    def _promote_delayed(self, now: float) -> None:
+        """Переносит элементы, время которых подошло, в очередь готовых"""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, item = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (item.lane, next(self._counter), item))
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._promote_delayed(now)
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, item = heapq.heappop(self._ready)
+
+            # Ограничение на чат и пауза фоновых полос после RetryAfter
+            not_before = self._chat_next_allowed.get(item.chat_id, 0.0)
+            if item.lane != LANE_LIVE:
+                not_before = max(not_before, self._background_pause_until)
+            if item.chat_id in self._chat_in_flight:
+                not_before = max(not_before, now + 0.05)
+            if not_before > now:
+                self._delay(item, not_before)
+                continue
+
+            # Глобальное ограничение частоты
+            if self._next_global_slot > now:
+                await asyncio.sleep(self._next_global_slot - now)
+            self._next_global_slot = max(now, self._next_global_slot) + self.global_interval
+
+            await self.semaphore.acquire()
+            self._chat_in_flight.add(item.chat_id)
+            self._chat_next_allowed[item.chat_id] = time.monotonic() + self.per_chat_interval
+            task = asyncio.create_task(self._deliver(item))
+            self._deliveries[task] = item
+            task.add_done_callback(self._delivery_done)
+
+    def _delivery_done(self, task: asyncio.Task) -> None:
+        self._deliveries.pop(task, None)
+        self.semaphore.release()
+
+    async def _deliver(self, item: OutboundItem) -> None:
+        """Выполняет запрос к Telegram и переносит его при RetryAfter или сетевой ошибке"""
+        from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+        
+        stats = self.stats[item.lane]
+        item.attempts += 1
+        try:
+            result = await getattr(self.bot, item.method)(chat_id=item.chat_id, **item.kwargs)
+        except TelegramRetryAfter as e:
+            stats.retry_after += 1
+            ready_at = time.monotonic() + e.retry_after
+            self._chat_next_allowed[item.chat_id] = ready_at
+            self._background_pause_until = max(self._background_pause_until, ready_at)
+            logger.warning(f"Flood control Telegram для чата {item.chat_id}: повтор через {e.retry_after}с")
+            self._reschedule(item, ready_at, e)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            backoff = random.uniform(0, min(30.0, 2 ** item.attempts))
+            self._reschedule(item, time.monotonic() + backoff, e)
+        except Exception as e:
+            stats.failed += 1
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            stats.record(time.monotonic() - item.enqueued_at)
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._chat_in_flight.discard(item.chat_id)
+            self._wakeup.set()
+
+    def _reschedule(self, item: OutboundItem, ready_at: float, error: Exception) -> None:
+        if item.attempts > self.max_retries:
+            self.stats[item.lane].failed += 1
+            if not item.future.done():
+                item.future.set_exception(error)
+            return
+        self._delay(item, ready_at)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Возвращает статистику доставки по полосам"""
+        stats = {LANE_NAMES[lane]: lane_stats.to_dict() for lane, lane_stats in self.stats.items()}
+        stats["queued"] = len(self._ready) + len(self._delayed)
+        return stats
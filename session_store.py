@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Живые диалоги на диске: компактный снимок всех сессий плюс журнал ходов после него"""
+
+    def __init__(self, folder: str = "dialogs", fsync: bool = False):
+        self.snapshot_path = os.path.join(folder, ".sessions.snapshot.json")
+        self.log_path = os.path.join(folder, ".sessions.log")
+        # Журнал, отложенный на время записи снимка (удаляется, когда снимок сохранен)
+        self.rotated_log_path = self.log_path + ".old"
+        self.fsync = fsync
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # Копия живых сессий: user_id -> {"dialog": {...}, "history": [...]} (ссылки на те же сообщения)
+        self.sessions: Dict[int, Dict] = {}
+        self.seq = 0
+        self.snapshot_seq = 0
+        self._history_lengths: Dict[int, int] = {}
+        self._log = None
+        self._lock = threading.Lock()
+        self.recovered = 0
+        self.replayed = 0
+        self.recovery_seconds: Optional[float] = None
+
+    @staticmethod
+    def _encode(data) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    def _append(self, entry: Dict) -> None:
+        """Дописывает запись в журнал; после сбоя процесса она уже в файле ОС"""
+        self.seq += 1
+        entry["seq"] = self.seq
+        if self._log is None:
+            self._log = open(self.log_path, "a", encoding="utf-8")
+        self._log.write(self._encode(entry) + "\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+
+    def record_turn(self, user_id: int, message_data: Dict, history: List[Dict]) -> None:
+        """Записывает ход: сообщение логгера и новые сообщения истории модели"""
+        entry = {"op": "turn", "user_id": user_id, "message": message_data}
+        known = self._history_lengths.get(user_id, 0)
+        if len(history) < known:
+            # История модели сброшена без записи reset, записываем ее заново
+            entry["history_reset"] = True
+            known = 0
+        entry["history"] = history[known:]
+        self._history_lengths[user_id] = len(history)
+        self._append(entry)
+        self._apply(entry)
+
+    def record_reset(self, user_id: int) -> None:
+        """История модели сброшена (/reset, /start): следующие ходы пишут ее с нуля"""
+        self._history_lengths[user_id] = 0
+        if user_id not in self.sessions:
+            return
+        entry = {"op": "reset", "user_id": user_id}
+        self._append(entry)
+        self._apply(entry)
+
+    def record_end(self, user_id: int) -> None:
+        """Диалог завершен и сохранен: сессия больше не восстанавливается"""
+        if user_id not in self.sessions:
+            return
+        entry = {"op": "end", "user_id": user_id}
+        self._append(entry)
+        self._apply(entry)
+
+    def _apply(self, entry: Dict) -> None:
+        """Применяет запись журнала к сессиям (при записи и при восстановлении)"""
+        user_id = entry["user_id"]
+        if entry["op"] == "end":
+            self.sessions.pop(user_id, None)
+            self._history_lengths.pop(user_id, None)
+            return
+        if entry["op"] == "reset":
+            if user_id in self.sessions:
+                self.sessions[user_id]["history"] = []
+            return
+
+        message = entry["message"]
+        session = self.sessions.get(user_id)
+        if session is None:
+            session = {
+                "dialog": {"user_id": user_id, "start_time": message.get("timestamp"), "messages": []},
+                "history": [],
+            }
+            self.sessions[user_id] = session
+        session["dialog"]["messages"].append(message)
+        session["dialog"]["last_activity"] = message.get("timestamp")
+        if entry.get("history_reset"):
+            session["history"] = []
+        session["history"].extend(entry["history"])
+
+    def begin_snapshot(self) -> Tuple[int, List[Dict]]:
+        """Фиксирует состояние для снимка (в цикле событий): откладывает журнал и копирует списки сессий"""
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            # Если прошлый снимок не записан, отложенный журнал остается и читается при восстановлении
+            if os.path.exists(self.log_path) and not os.path.exists(self.rotated_log_path):
+                os.replace(self.log_path, self.rotated_log_path)
+        sessions = [
+            {"dialog": dict(session["dialog"], messages=list(session["dialog"]["messages"])),
+             "history": list(session["history"])}
+            for session in self.sessions.values()
+        ]
+        return self.seq, sessions
+
+    def write_snapshot(self, seq: int, sessions: List[Dict]) -> None:
+        """Атомарно записывает снимок (можно в отдельном потоке) и удаляет покрытый им журнал"""
+        with self._lock:
+            if seq < self.snapshot_seq:
+                return
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self._encode({"seq": seq, "sessions": sessions}))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self.snapshot_seq = seq
+            if os.path.exists(self.rotated_log_path):
+                os.remove(self.rotated_log_path)
+
+    def snapshot(self) -> None:
+        """Снимок целиком в текущем потоке (при остановке бота)"""
+        self.write_snapshot(*self.begin_snapshot())
+
+    def recover(self) -> Dict[int, Dict]:
+        """Загружает снимок и воспроизводит журнал после него; возвращает живые сессии"""
+        started = time.perf_counter()
+        self.sessions = {}
+        self.snapshot_seq = 0
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.snapshot_seq = data["seq"]
+            for session in data["sessions"]:
+                self.sessions[session["dialog"]["user_id"]] = session
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Снимок сессий поврежден, восстанавливаем только по журналу: {e}")
+        self.seq = self.snapshot_seq
+
+        self.replayed = 0
+        for path in (self.rotated_log_path, self.log_path):
+            self._replay(path)
+        self._history_lengths = {user_id: len(session["history"]) for user_id, session in self.sessions.items()}
+        self.recovered = len(self.sessions)
+        self.recovery_seconds = time.perf_counter() - started
+
+        # Журнал сворачивается в новый снимок: новые записи не должны продолжать оборванную строку
+        if os.path.exists(self.log_path) or os.path.exists(self.rotated_log_path):
+            self.snapshot()
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+        return self.sessions
+
+    def _replay(self, path: str) -> None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Запись, оборванная сбоем процесса, - последняя в журнале
+                        logger.warning(f"Оборванная запись в журнале сессий {path}, воспроизведение остановлено")
+                        break
+                    if entry["seq"] <= self.seq:
+                        continue
+                    self._apply(entry)
+                    self.seq = entry["seq"]
+                    self.replayed += 1
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def get_stats(self) -> Dict:
+        return {
+            "sessions": len(self.sessions),
+            "log_records": self.seq - self.snapshot_seq,
+            "recovered": self.recovered,
+            "replayed": self.replayed,
+            "recovery_seconds": self.recovery_seconds,
+        }
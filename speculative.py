@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сообщение, с которого начинается каждый диалог после /start
+OPENER_MESSAGE = "начало диалога"
+
+
+class SpeculativeEngine:
+    """Готовит следующий ход заранее: контекст, прогрев кэша промта и заготовки приветствия"""
+
+    def __init__(self, neuro_salesman, enabled: bool = True, opener_pool_size: int = 1,
+                 prewarm: bool = False, prewarm_interval: float = 240.0):
+        self.neuro_salesman = neuro_salesman
+        self.enabled = enabled
+        self.opener_pool_size = opener_pool_size
+        # Прогрев кэша стоит денег (запрос с max_tokens=1), поэтому выключен по умолчанию
+        self.prewarm_enabled = prewarm
+        # Кэш префикса у OpenAI живет несколько минут - чаще прогревать нет смысла
+        self.prewarm_interval = prewarm_interval
+        self.openers: List[str] = []
+        self.last_prewarm: Dict[int, float] = {}
+        self.tasks = set()
+        self._refilling = False
+        self.opener_hits = 0
+        self.opener_misses = 0
+
+    def _spawn(self, coro) -> None:
+        """Запускает фоновую задачу и хранит ссылку на нее до завершения"""
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def stop(self) -> None:
+        """Отменяет прогрев и пополнение заготовок (при остановке бота)"""
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def schedule_next_turn(self, user_id: int) -> None:
+        """Вызывается после отправки ответа: пока пользователь печатает, готовим следующий ход"""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        # Сборка контекста выполняется, когда цикл событий освободится
+        loop.call_soon(self.neuro_salesman.prepare_next_turn, user_id)
+
+        if self.prewarm_enabled:
+            now = time.monotonic()
+            if now - self.last_prewarm.get(user_id, 0.0) >= self.prewarm_interval:
+                self.last_prewarm[user_id] = now
+                self._spawn(self._prewarm(user_id))
+
+    async def _prewarm(self, user_id: int) -> None:
+        try:
+            await self.neuro_salesman.prewarm(user_id)
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть кэш промта для пользователя {user_id}: {e}")
+
+    def forget(self, user_id: int) -> None:
+        """Удаляет подготовленные данные пользователя"""
+        self.last_prewarm.pop(user_id, None)
+        self.neuro_salesman.context_cache.forget(user_id)
+
+    async def refill_openers(self) -> None:
+        """Заполняет пул заранее сгенерированных приветствий"""
+        if not self.enabled or self._refilling or not self.neuro_salesman.client:
+            return
+        self._refilling = True
+        try:
+            while len(self.openers) < self.opener_pool_size:
+                self.openers.append(await self.neuro_salesman.generate_detached(OPENER_MESSAGE))
+        except Exception as e:
+            logger.warning(f"Не удалось сгенерировать приветствие заранее: {e}")
+        finally:
+            self._refilling = False
+
+    async def start_dialog(self, user_id: int) -> Tuple[str, Dict]:
+        """Отвечает на начало диалога заготовкой, если она есть, иначе обычным запросом"""
+        opener: Optional[str] = self.openers.pop(0) if self.openers else None
+        if self.enabled:
+            self._spawn(self.refill_openers())
+
+        if opener is not None:
+            self.opener_hits += 1
+            return self.neuro_salesman.apply_precomputed(user_id, OPENER_MESSAGE, opener)
+
+        self.opener_misses += 1
+        return await self.neuro_salesman.process_message(user_id, OPENER_MESSAGE)
+
+    def get_stats(self) -> Dict:
+        """Возвращает статистику попаданий заготовок"""
+        return {
+            "opener_hits": self.opener_hits,
+            "opener_misses": self.opener_misses,
+            "openers_ready": len(self.openers),
+            "context_hits": self.neuro_salesman.prepared_hits,
+            "context_misses": self.neuro_salesman.prepared_misses,
+        }
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки контроля нагрузки и деградации ответов
+"""
+
+import asyncio
+import time
+from admission_control import (AdmissionController, LEVEL_ACK_FIRST, LEVEL_CHEAP_MODEL,
+                               LEVEL_NORMAL, LEVEL_REJECT_NEW, LEVEL_SHORT_HISTORY)
+from model_router import ModelRouter
+
+
+def test_levels_by_queue_depth():
+    """Уровень растет с числом запросов в работе"""
+    controller = AdmissionController(depth_thresholds=[1, 2, 3, 4], cooldown=0)
+    assert controller.level == LEVEL_NORMAL
+    assert controller.history_window() is None
+    assert controller.admit_new_session()
+
+    controller.in_flight = 2
+    assert controller.level == LEVEL_CHEAP_MODEL
+    assert controller.history_window() == controller.short_history_messages
+    assert controller.use_cheap_model()
+    assert not controller.should_acknowledge()
+
+    controller.in_flight = 4
+    assert controller.level == LEVEL_REJECT_NEW
+    assert controller.should_acknowledge()
+    assert not controller.admit_new_session()
+    print(f"📊 {controller.get_stats()}")
+
+
+def test_protected_dialogs_not_degraded():
+    """Диалоги в середине продажи сохраняют полную историю и основную модель"""
+    controller = AdmissionController(depth_thresholds=[1, 2, 3, 4], cooldown=0)
+    controller.in_flight = 3
+    assert controller.level == LEVEL_ACK_FIRST
+    assert controller.history_window(protected=True) is None
+    assert not controller.use_cheap_model(protected=True)
+
+
+def test_hysteresis_and_latency():
+    """Уровень по p95 задержки понижается только после остывания"""
+    controller = AdmissionController(latency_thresholds=[0.01, 10, 20, 30], cooldown=60, sample_max_age=0.05)
+
+    async def scenario():
+        async with controller.track():
+            await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+    assert controller.in_flight == 0
+    assert controller.level == LEVEL_SHORT_HISTORY
+
+    time.sleep(0.06)  # замер устарел
+    assert controller.p95_latency() is None
+    assert controller.level == LEVEL_SHORT_HISTORY  # остывание еще не прошло
+    controller.cooldown = 0
+    assert controller.level == LEVEL_NORMAL
+
+
+def test_recovers_after_idle():
+    """После всплеска задержек и простоя бот снова принимает новые сессии"""
+    controller = AdmissionController(latency_thresholds=[0.01, 0.01, 0.01, 0.01], cooldown=0.05,
+                                     sample_max_age=0.05)
+
+    async def scenario():
+        await asyncio.gather(*(slow_request() for _ in range(3)))
+
+    async def slow_request():
+        async with controller.track():
+            await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+    assert not controller.admit_new_session()
+
+    time.sleep(0.12)  # ни одного запроса: замеры устарели, остывание прошло
+    assert controller.level == LEVEL_NORMAL
+    assert controller.admit_new_session()
+    print(f"📊 {controller.get_stats()}")
+
+
+def test_router_degrade():
+    """Дешевый маршрут подменяет выбранный"""
+    router = ModelRouter.default("primary", "fast", "fallback", 30)
+    route = router.select_route("", "Расскажите подробнее про тарифы")
+    degraded = router.degrade(route)
+    assert route.model == "primary"
+    assert degraded.name == "degraded"
+    assert degraded.model == "fast"
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование контроля нагрузки...")
+    test_levels_by_queue_depth()
+    test_protected_dialogs_not_degraded()
+    test_hysteresis_and_latency()
+    test_recovers_after_idle()
+    test_router_degrade()
+    print("✅ Тест завершен!")
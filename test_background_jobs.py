@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки фоновых задач и потоковой выгрузки диалогов
+"""
+
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import date
+
+from background_jobs import JOB_CANCELLED, JOB_DONE, JOB_FAILED, JobRunner
+from dialog_export import export_dialogs, parse_export_args
+
+
+def write_dialog(folder, docx_folder, user_id, stamp, reason, start_time):
+    with open(os.path.join(folder, f"{user_id}_{stamp}.json"), "w", encoding="utf-8") as f:
+        json.dump({"user_id": user_id, "start_time": start_time, "finish_reason": reason,
+                   "messages": [{"user_message": "Привет"}]}, f, ensure_ascii=False)
+    with open(os.path.join(docx_folder, f"dialog_{user_id}_{stamp}.docx"), "wb") as f:
+        f.write(b"docx " + stamp.encode())
+
+
+def test_job_progress_and_results():
+    """Задачи выполняются по очереди, прогресс отправляется обработчику отчетов"""
+    reports = []
+
+    async def reporter(job):
+        reports.append(job.describe())
+
+    async def work(job):
+        for step in range(3):
+            job.report(step + 1, 3, "шаг")
+            await asyncio.sleep(0.02)
+        return "готово"
+
+    async def broken(job):
+        raise RuntimeError("нет диска")
+
+    async def scenario():
+        runner = JobRunner(reporter=reporter, progress_interval=0.01)
+        await runner.start()
+        first = runner.submit("работа", work, chat_id=1)
+        second = runner.submit("сбой", broken, chat_id=1)
+        while not second.finished:
+            await asyncio.sleep(0.01)
+        await runner.stop()
+        return first, second, runner.get_stats()
+
+    first, second, stats = asyncio.run(scenario())
+    print(f"📨 Отчеты: {reports}")
+    assert first.status == JOB_DONE and first.result == "готово"
+    assert second.status == JOB_FAILED and "нет диска" in second.error
+    assert any("3/3" in text for text in reports)
+    assert stats["completed"] == 1 and stats["failed"] == 1
+
+
+def test_job_cancellation():
+    """Отмена останавливает выполняющуюся задачу и снимает задачу из очереди"""
+    async def endless(job):
+        while True:
+            job.check_cancelled()
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        runner = JobRunner()
+        await runner.start()
+        running = runner.submit("бесконечная", endless)
+        queued = runner.submit("в очереди", endless)
+        await asyncio.sleep(0.05)
+        assert runner.cancel(queued.job_id)
+        assert runner.cancel(running.job_id)
+        while not running.finished:
+            await asyncio.sleep(0.01)
+        assert not runner.cancel(running.job_id)
+        await runner.stop()
+        return running, queued, runner.get_stats()
+
+    running, queued, stats = asyncio.run(scenario())
+    assert running.status == JOB_CANCELLED and queued.status == JOB_CANCELLED
+    assert stats["cancelled"] == 2
+
+
+def test_parse_export_args():
+    assert parse_export_args([]) == (None, None, None)
+    assert parse_export_args(["2025-08-01", "2025-08-31", "timeout"]) == (date(2025, 8, 1), date(2025, 8, 31), "timeout")
+    assert parse_export_args(["2025-08-19"]) == (date(2025, 8, 19), date(2025, 8, 19), None)
+    for bad in (["2025-08-31", "2025-08-01"], ["timeout", "user_stop"]):
+        try:
+            parse_export_args(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"Ожидалась ошибка для {bad}")
+
+
+def test_export_archive():
+    """Архив содержит только подходящие диалоги, их DOCX и сводку CSV"""
+    with tempfile.TemporaryDirectory() as tmp:
+        folder, docx_folder = os.path.join(tmp, "dialogs"), os.path.join(tmp, "docx")
+        os.makedirs(folder)
+        os.makedirs(docx_folder)
+        write_dialog(folder, docx_folder, 1, "2025-08-08_02-26-31", "timeout", "2025-08-08T02:20:00")
+        write_dialog(folder, docx_folder, 2, "2025-08-19_14-44-54", "user_stop", "2025-08-19T14:42:53")
+        write_dialog(folder, docx_folder, 3, "2025-08-20_10-00-00", "timeout", "2025-08-20T09:50:00")
+
+        archive_path = os.path.join(tmp, "exports", "export.zip")
+        stats = export_dialogs(folder, docx_folder, archive_path, date(2025, 8, 10), date(2025, 8, 31))
+        print(f"📦 {stats}")
+        assert stats["dialogs"] == 2 and stats["docx"] == 2
+        with zipfile.ZipFile(archive_path) as archive:
+            names = set(archive.namelist())
+            summary = list(csv.reader(io.StringIO(archive.read("summary.csv").decode("utf-8-sig"))))
+        assert "json/2_2025-08-19_14-44-54.json" in names and "docx/dialog_3_2025-08-20_10-00-00.docx" in names
+        assert "json/1_2025-08-08_02-26-31.json" not in names
+        assert len(summary) == 3
+
+        stats = export_dialogs(folder, docx_folder, archive_path, finish_reason="timeout")
+        assert stats["by_reason"] == {"timeout": 2}
+        assert not os.path.exists(archive_path + ".part")
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование фоновых задач и выгрузки...")
+    test_job_progress_and_results()
+    test_job_cancellation()
+    test_parse_export_args()
+    test_export_archive()
+    print("✅ Тест завершен!")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки обработчиков бота: обновления проходят через диспетчер aiogram
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update, User
+
+from bot_gpt import create_app
+from send_pipeline import SendPipeline
+
+
+class FakeSession(BaseSession):
+    """HTTP сессия без сети: запоминает отправленные тексты"""
+
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.texts.append(method.text)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class FakeLLMClient:
+    """Клиент OpenAI: ответ модели выбирается по последнему сообщению клиента"""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.chat = SimpleNamespace(completions=self)
+
+    def with_options(self, **kwargs):
+        return self
+
+    def _reply(self, messages):
+        text = messages[-1]["content"]
+        data = self.replies.get(text, {"message": f"Ответ на: {text}", "agent_communication": {}})
+        content = json.dumps(data, ensure_ascii=False)
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    async def create(self, messages, **kwargs):
+        return self._reply(messages)
+
+    async def post(self, path, body, cast_to):
+        return self._reply(json.loads(body)["messages"])
+
+
+class BotHarness:
+    """Приложение бота с фиктивными Telegram и LLM во временных папках"""
+
+    def __init__(self, folder, replies=None):
+        self.folder = folder
+        self.app = create_app(token="123456:TEST", dialogs_folder=os.path.join(folder, "dialogs"),
+                              docx_folder=os.path.join(folder, "docx"),
+                              retrieval_index_folder=os.path.join(folder, "index"))
+        self.session = FakeSession()
+        self.app._bot = Bot(token="123456:TEST", session=self.session)
+        self.app._send_pipeline = SendPipeline(self.app.bot, per_chat_interval=0.0, global_rate=1000)
+        self.app.neuro_salesman.client = FakeLLMClient(replies or {})
+        self.update_id = 0
+
+    async def send(self, text, user_id=1):
+        """Прогоняет сообщение пользователя через диспетчер и ждет доставки ответов"""
+        self.update_id += 1
+        message = Message(message_id=self.update_id, date=datetime.now(), text=text,
+                          chat=Chat(id=user_id, type="private"),
+                          from_user=User(id=user_id, is_bot=False, first_name="Тест"))
+        sent_before = len(self.session.texts)
+        await self.app.dispatcher.feed_update(self.app.bot, Update(update_id=self.update_id, message=message))
+        await self.app.send_pipeline.drain(5.0)
+        return self.session.texts[sent_before:]
+
+    def archived(self):
+        """Сохраненные диалоги: имя файла -> JSON"""
+        folder = os.path.join(self.folder, "dialogs")
+        result = {}
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(".json") and not filename.startswith("."):
+                with open(os.path.join(folder, filename), encoding="utf-8") as f:
+                    result[filename] = json.load(f)
+        return result
+
+
+def run_with_harness(scenario, replies=None):
+    async def main(folder):
+        harness = BotHarness(folder, replies)
+        await harness.app.send_pipeline.start()
+        try:
+            return await scenario(harness)
+        finally:
+            await harness.app.send_pipeline.stop()
+
+    with tempfile.TemporaryDirectory() as folder:
+        return asyncio.run(main(folder))
+
+
+PROFILE_REPLIES = {
+    "У нас 50 сотрудников": {"message": "Сколько HR в компании?", "agent_communication": {
+        "agent-профайла": {"статус_профайла": {"Сколько сотрудников в компании": "50",
+                                               "Сколько HR в компании": "Нет информации"}}
+    }},
+}
+
+FINISH_REPLIES = {
+    "Нам это не нужно, всего доброго": {"message": "Понимаю, всего доброго!", "agent_communication": {},
+                                        "dialog_finished": True, "dialog_outcome": "refusal"},
+    "Оформляем тариф Бизнес": {"message": "Отлично, доступ оформлен!", "agent_communication": {},
+                               "dialog_finished": True, "dialog_outcome": "purchase"},
+}
+
+
+def test_profile_command():
+    """/profile показывает заполненные поля профайла из ответа модели"""
+    async def scenario(harness):
+        empty = await harness.send("/profile")
+        await harness.send("/start")
+        await harness.send("У нас 50 сотрудников")
+        return empty, await harness.send("/profile")
+
+    empty, filled = run_with_harness(scenario, PROFILE_REPLIES)
+    print(f"📊 {filled}")
+    assert empty == ["Профиль пока не заполнен"]
+    assert filled == ["📊 Ваш профиль:\n• Сколько сотрудников в компании: 50\n"]
+
+
+def test_timeout_finishes_reset_dialogs():
+    """/timeout сохраняет и убирает из памяти неактивные диалоги, даже если после них был /reset"""
+    async def scenario(harness):
+        await harness.send("/start", user_id=1)
+        await harness.send("/start", user_id=2)
+        await harness.send("/reset", user_id=2)
+        for dialog in harness.app.dialog_logger.current_dialogs.values():
+            dialog["last_activity"] = datetime.now() - timedelta(hours=1)
+        replies = await harness.send("/timeout", user_id=3)
+        return replies, harness.archived(), dict(harness.app.dialog_logger.current_dialogs)
+
+    replies, archived, current = run_with_harness(scenario)
+    print(f"⏰ {replies}")
+    assert current == {}
+    assert sorted(dialog["user_id"] for dialog in archived.values()) == [1, 2]
+    assert all(dialog["finish_reason"] == "timeout" for dialog in archived.values())
+    assert replies[0].startswith("⏰ Завершены неактивные диалоги:")
+
+
+def test_refusal_not_saved_as_success():
+    """Окончательный отказ сохраняется как refusal и не попадает в индекс примеров, покупка - как success"""
+    async def scenario(harness):
+        await harness.send("/start", user_id=1)
+        replies = await harness.send("Нам это не нужно, всего доброго", user_id=1)
+        assert "🎯 Диалог завершен! Пожалуйста, напишите ваш отзыв о работе бота:" in replies
+        assert len(harness.app.retrieval_index) == 0
+
+        await harness.send("/start", user_id=2)
+        await harness.send("Сколько стоит тариф?", user_id=2)
+        await harness.send("Оформляем тариф Бизнес", user_id=2)
+        return harness.archived(), len(harness.app.retrieval_index)
+
+    archived, indexed = run_with_harness(scenario, FINISH_REPLIES)
+    reasons = {dialog["user_id"]: dialog["finish_reason"] for dialog in archived.values()}
+    print(f"📁 Причины завершения: {reasons}, пар в индексе: {indexed}")
+    assert reasons == {1: "refusal", 2: "success"}
+    assert indexed == 2
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование обработчиков бота...")
+    test_profile_command()
+    test_timeout_finishes_reset_dialogs()
+    test_refusal_not_saved_as_success()
+    print("✅ Тест завершен!")
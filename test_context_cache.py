@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки инкрементально закодированного тела запроса
+"""
+
+import json
+
+from context_cache import COMPLETION_PARAMS, ContextCache
+
+
+def make_history(turns):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Вопрос «{i}»\n", "timestamp": "2025-08-19T14:42:53"})
+        history.append({"role": "assistant", "content": json.dumps({"message": f"Ответ {i}"}, ensure_ascii=False)})
+    return history
+
+
+def expected_payload(system_prompt, history, tail, model, max_tokens):
+    messages = [{"role": "system", "content": system_prompt}]
+    messages += [{"role": msg["role"], "content": msg["content"]} for msg in history]
+    return dict(COMPLETION_PARAMS, model=model, max_tokens=max_tokens, messages=messages + tail)
+
+
+def test_body_matches_payload():
+    """Готовое тело запроса совпадает с тем, что собрал бы SDK из списка messages"""
+    prompt = "Суперпромт \"с кавычками\""
+    cache = ContextCache(prompt)
+    history = make_history(3)
+    tail = [{"role": "system", "content": "примеры"}, {"role": "user", "content": "Сколько стоит?"}]
+    assert cache.update(1, history) == 6
+    body = cache.context(1, tail).body("gpt-4.1-mini", 900)
+    assert json.loads(body) == expected_payload(prompt, history, tail, "gpt-4.1-mini", 900)
+
+
+def test_incremental_update():
+    """На новом ходу кодируются только добавленные сообщения"""
+    cache = ContextCache("промт")
+    history = make_history(2)
+    assert cache.update(1, history) == 4
+    assert cache.update(1, history) == 0
+    history += make_history(1)
+    assert cache.update(1, history) == 2
+    assert cache.update(1, history, upto=len(history)) == 0
+    body = cache.context(1, [{"role": "user", "content": "ок"}]).body("m", 10)
+    assert len(json.loads(body)["messages"]) == 1 + 6 + 1
+    assert cache.get_stats()["rebuilds"] == 0
+
+
+def test_rebuild_on_reset():
+    """Сброс или подмена истории приводит к перекодированию сессии"""
+    cache = ContextCache("промт")
+    history = make_history(3)
+    cache.update(1, history)
+
+    # Новый диалог короче закодированного
+    fresh = make_history(1)
+    assert cache.update(1, fresh) == 2
+    # История той же длины, но с другими сообщениями
+    replaced = make_history(1)
+    assert cache.update(1, replaced) == 2
+    assert cache.get_stats()["rebuilds"] == 2
+
+    body = cache.context(1, []).body("m", 10)
+    assert json.loads(body)["messages"][1:] == [{"role": m["role"], "content": m["content"]} for m in replaced]
+    cache.forget(1)
+    assert cache.get_stats()["sessions"] == 0
+
+
+def test_context_snapshot_after_growth():
+    """Контекст хода не видит сообщения, дописанные параллельным ходом"""
+    cache = ContextCache("промт")
+    history = make_history(1)
+    cache.update(1, history)
+    context = cache.context(1, [{"role": "user", "content": "текущий"}])
+    history += make_history(1)
+    cache.update(1, history)
+    messages = json.loads(context.body("m", 10))["messages"]
+    print(f"📦 Сообщений в снимке: {len(messages)}")
+    assert len(messages) == 1 + 2 + 1
+    assert messages[-1]["content"] == "текущий"
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование кэша тела запроса...")
+    test_body_matches_payload()
+    test_incremental_update()
+    test_rebuild_on_reset()
+    test_context_snapshot_after_growth()
+    print("✅ Тест завершен!")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки машины состояний диалога
+"""
+
+import json
+import os
+import tempfile
+from dialog_fsm import (DialogStateMachine, EVENT_FEEDBACK, EVENT_FINISH, EVENT_FINISHED, EVENT_RESET,
+                        EVENT_START, STATE_ACTIVE, STATE_AWAITING_FEEDBACK, STATE_FINISHING, STATE_IDLE)
+from neuro_salesman_gpt import NeuroSalesmanGPT
+
+
+def test_lifecycle():
+    """idle -> active -> finishing -> awaiting_feedback -> closed"""
+    with tempfile.TemporaryDirectory() as folder:
+        fsm = DialogStateMachine(os.path.join(folder, "states.json"))
+        assert fsm.get_state(1) == STATE_IDLE
+        assert not fsm.transition(1, EVENT_FINISH)  # нечего завершать
+
+        assert fsm.transition(1, EVENT_START)
+        assert fsm.is_active(1)
+        assert fsm.transition(1, EVENT_FINISH)
+        assert not fsm.transition(1, EVENT_FINISH)  # повторное завершение отсекается
+        assert fsm.transition(1, EVENT_FINISHED)
+        assert fsm.is_awaiting_feedback(1)
+        assert fsm.transition(1, EVENT_FEEDBACK)
+        assert fsm.get_state(1) == STATE_IDLE  # закрытый диалог не хранится
+
+        fsm.transition(2, EVENT_START)
+        assert fsm.transition(2, EVENT_RESET)
+        assert fsm.get_state(2) == STATE_IDLE
+
+
+def test_persistence_and_restore():
+    """Состояния переживают перезапуск, прерванное завершение переходит к ожиданию отзыва"""
+    with tempfile.TemporaryDirectory() as folder:
+        state_path = os.path.join(folder, "states.json")
+        fsm = DialogStateMachine(state_path)
+        fsm.transition(1, EVENT_START)
+        fsm.transition(2, EVENT_START)
+        fsm.transition(2, EVENT_FINISH)
+
+        restarted = DialogStateMachine(state_path)
+        assert restarted.get_state(1) == STATE_ACTIVE
+        assert restarted.get_state(2) == STATE_FINISHING
+        assert restarted.restore_interrupted() == [2]
+        assert restarted.get_state(2) == STATE_AWAITING_FEEDBACK
+        print(f"📊 {restarted.get_stats()}")
+
+
+def test_finish_flag_from_model_json():
+    """Завершение определяется флагом dialog_finished, а не подстрокой "стоп" в ответе"""
+    salesman = NeuroSalesmanGPT(api_key="test-key")
+    text, _ = salesman._accept_response(1, json.dumps({
+        "agent_communication": {}, "message": "Тариф Про можно оплатить без стопроцентной предоплаты", "dialog_finished": False
+    }, ensure_ascii=False))
+    assert "стоп" in text.lower()
+    assert not salesman.take_dialog_finished(1)
+
+    salesman._accept_response(1, json.dumps({
+        "agent_communication": {}, "message": "Доступ оформлен, до связи!", "dialog_finished": True
+    }, ensure_ascii=False))
+    assert salesman.take_dialog_finished(1)
+    assert not salesman.take_dialog_finished(1)  # флаг сбрасывается после проверки
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование машины состояний диалога...")
+    test_lifecycle()
+    test_persistence_and_restore()
+    test_finish_flag_from_model_json()
+    print("✅ Тест завершен!")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки отправки DOCX с повторным использованием file_id
+"""
+
+import asyncio
+import os
+import tempfile
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+from docx_delivery import DocxDelivery
+
+
+class FakePipeline:
+    """Очередь отправки, которая выдает file_id на загрузку и отклоняет устаревшие file_id"""
+
+    def __init__(self):
+        self.sent = []
+        self.expired = set()
+
+    async def send_document(self, chat_id, document, lane=None, caption=None):
+        if isinstance(document, str):
+            self.sent.append(("file_id", document))
+            if document in self.expired:
+                raise TelegramBadRequest(method=None, message="Bad Request: wrong file identifier")
+            return SimpleNamespace(document=SimpleNamespace(file_id=document))
+        file_id = f"id{len(self.sent)}"
+        self.sent.append(("upload", file_id))
+        return SimpleNamespace(document=SimpleNamespace(file_id=file_id))
+
+
+def write_file(folder, name, text):
+    path = os.path.join(folder, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def test_file_id_reused_and_reuploaded():
+    """Повторная отправка идет по file_id, а отклоненный file_id заменяется новой загрузкой"""
+    async def scenario(folder):
+        pipeline = FakePipeline()
+        delivery = DocxDelivery(pipeline, os.path.join(folder, ".file_ids.json"))
+        path = write_file(folder, "dialog.docx", "диалог")
+
+        await delivery.send_file(1, path)
+        await delivery.send_file(2, path)
+        assert pipeline.sent == [("upload", "id0"), ("file_id", "id0")]
+
+        pipeline.expired.add("id0")
+        await delivery.send_file(3, path)
+        assert pipeline.sent[2:] == [("file_id", "id0"), ("upload", "id3")]
+
+        # Новый file_id сохранен на диске и используется после перезапуска
+        restarted = DocxDelivery(pipeline, os.path.join(folder, ".file_ids.json"))
+        await restarted.send_file(4, path)
+        assert pipeline.sent[-1] == ("file_id", "id3")
+        return delivery.get_stats()
+
+    with tempfile.TemporaryDirectory() as folder:
+        stats = asyncio.run(scenario(folder))
+    print(f"📊 {stats}")
+    assert stats == {"uploads": 2, "reused": 1, "cached": 1}
+
+
+def test_file_id_survives_rewrite_of_same_document():
+    """Документ с отзывом загружается заново, а его повторная отправка идет по file_id, даже если mtime изменился"""
+    async def scenario(folder):
+        pipeline = FakePipeline()
+        delivery = DocxDelivery(pipeline, os.path.join(folder, ".file_ids.json"))
+        path = write_file(folder, "dialog.docx", "диалог")
+        await delivery.send_file(1, path)
+
+        # Отзыв меняет документ: нужна новая загрузка
+        write_file(folder, "dialog.docx", "диалог\nОтзыв пользователя: отлично")
+        await delivery.send_file(1, path)
+        assert pipeline.sent == [("upload", "id0"), ("upload", "id1")]
+
+        # Тот же документ перезаписан без изменений (новый mtime) - повторная отправка без загрузки
+        os.utime(path, ns=(0, 0))
+        await delivery.send_file(2, path)
+        assert pipeline.sent[-1] == ("file_id", "id1")
+        return delivery.get_stats()
+
+    with tempfile.TemporaryDirectory() as folder:
+        stats = asyncio.run(scenario(folder))
+    print(f"📊 {stats}")
+    assert stats == {"uploads": 2, "reused": 1, "cached": 2}
+
+
+def test_cache_pruned():
+    """Кэш хранит не больше max_entries записей"""
+    async def scenario(folder):
+        delivery = DocxDelivery(FakePipeline(), os.path.join(folder, ".file_ids.json"), max_entries=3)
+        for index in range(5):
+            await delivery.send_file(1, write_file(folder, f"dialog_{index}.docx", f"диалог {index}"))
+        assert len(delivery.file_ids) == 3
+        assert len(DocxDelivery(FakePipeline(), os.path.join(folder, ".file_ids.json")).file_ids) == 3
+
+    with tempfile.TemporaryDirectory() as folder:
+        asyncio.run(scenario(folder))
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование отправки DOCX...")
+    test_file_id_reused_and_reuploaded()
+    test_file_id_survives_rewrite_of_same_document()
+    test_cache_pruned()
+    print("✅ Тест завершен!")
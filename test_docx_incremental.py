@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки инкрементального рендеринга DOCX
+"""
+
+import os
+import shutil
+import tempfile
+from docx import Document
+from dialog_logger import DialogLogger
+from docx_generator import DocxGenerator
+from docx_incremental import IncrementalDocxRenderer
+
+
+def _dialog():
+    messages = [
+        {
+            "timestamp": "2025-08-09T03:05:00",
+            "client_message": "начало диалога",
+            "neuro_salesman_response": "Здравствуйте!\nКак прошел пробный период? <тест> & \"кавычки\"",
+            "agent_communication": {"агент-блока": "Блок Квалификации"}
+        },
+        {
+            "timestamp": "2025-08-09T03:06:00",
+            "client_message": "У нас 50 сотрудников",
+            "neuro_salesman_response": "Отлично! Сколько HR в компании?",
+            "agent_communication": {}
+        },
+    ]
+    return {
+        "user_id": 42,
+        "start_time": "2025-08-09T03:05:00",
+        "end_time": "2025-08-09T03:10:00",
+        "finish_reason": "success",
+        "messages": messages
+    }
+
+
+def test_incremental_matches_full_render():
+    """Инкрементальный DOCX совпадает по тексту с полным рендерингом и принимает отзыв"""
+    folder = tempfile.mkdtemp()
+    try:
+        dialog = _dialog()
+        renderer = IncrementalDocxRenderer(os.path.join(folder, "incremental"))
+        os.makedirs(os.path.join(folder, "incremental"), exist_ok=True)
+        renderer.start(42)
+        for message in dialog["messages"]:
+            renderer.append_turn(42, message)
+        incremental_path = renderer.finish(42, dialog)
+        assert not renderer.has_session(42)
+
+        full_path = DocxGenerator(os.path.join(folder, "full")).create_dialog_docx(42, dialog)
+
+        incremental_text = [p.text for p in Document(incremental_path).paragraphs]
+        full_text = [p.text for p in Document(full_path).paragraphs]
+        print(f"📄 Абзацев: {len(incremental_text)}")
+        assert incremental_text == full_text
+
+        # Отзыв добавляется в инкрементальный DOCX так же, как в обычный
+        assert DocxGenerator(folder).add_feedback_to_docx(incremental_path, "Отличный бот")
+        assert Document(incremental_path).paragraphs[-2].text == "Отзыв пользователя: Отличный бот"
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_restored_dialog_without_spool():
+    """Диалог, восстановленный без файла сессии, попадает в DOCX целиком"""
+    folder = tempfile.mkdtemp()
+    try:
+        dialog = _dialog()
+        logger = DialogLogger(os.path.join(folder, "dialogs"), docx_folder=os.path.join(folder, "docx"))
+        restored = {"user_id": 42, "start_time": dialog["start_time"], "messages": dialog["messages"][:1],
+                    "last_activity": dialog["messages"][0]["timestamp"]}
+        assert not logger.docx_renderer.has_session(42)
+        logger.restore_dialog(42, restored)
+        message = dialog["messages"][1]
+        logger.add_message(42, message["client_message"], message["neuro_salesman_response"], {})
+        _, docx_path = logger.finish_dialog(42, "success")
+
+        text = [p.text for p in Document(docx_path).paragraphs]
+        assert any(line.startswith("Клиент: начало диалога") for line in text)
+        assert any(line.startswith("Клиент: У нас 50 сотрудников") for line in text)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование инкрементального рендеринга DOCX...")
+    test_incremental_matches_full_render()
+    test_restored_dialog_without_spool()
+    print("✅ Тест завершен!")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки защиты от повторной доставки обновлений Telegram
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from idempotency import UpdateDeduplicator
+
+
+def make_update(update_id: int, message_id: int, chat_id: int = 42):
+    message = SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=chat_id))
+    return SimpleNamespace(update_id=update_id, message=message)
+
+
+def test_duplicate_replays_cached_reply():
+    """Повторное сообщение не обрабатывается, а получает сохраненный ответ"""
+    async def scenario():
+        sent = []
+        calls = []
+
+        async def sender(chat_id, text, **kwargs):
+            sent.append((chat_id, text))
+
+        with tempfile.TemporaryDirectory() as folder:
+            dedup = UpdateDeduplicator(os.path.join(folder, "state.json"), sender=sender)
+
+            async def handler(event, data):
+                calls.append(event.update_id)
+                dedup.remember_reply(event.message.chat.id, event.message.message_id, "ответ")
+                return "ok"
+
+            assert await dedup(handler, make_update(10, 1), {}) == "ok"
+            # Та же доставка и то же сообщение под новым update_id
+            assert await dedup(handler, make_update(10, 1), {}) is None
+            assert await dedup(handler, make_update(11, 1), {}) is None
+        return calls, sent, dedup.get_stats()
+
+    calls, sent, stats = asyncio.run(scenario())
+    print(f"📊 {stats}")
+    assert calls == [10]
+    assert sent == [(42, "ответ"), (42, "ответ")]
+    assert stats["duplicates"] == 2
+
+
+def test_high_water_mark_survives_restart():
+    """После перезапуска обработанные обновления отсекаются по сохраненной отметке"""
+    async def handler(event, data):
+        return "ok"
+
+    with tempfile.TemporaryDirectory() as folder:
+        state_path = os.path.join(folder, "state.json")
+        dedup = UpdateDeduplicator(state_path, flush_interval=0)
+        asyncio.run(dedup(handler, make_update(5, 1), {}))
+        asyncio.run(dedup(handler, make_update(6, 2), {}))
+        assert dedup.high_water_mark == 6
+
+        restarted = UpdateDeduplicator(state_path)
+        assert restarted.high_water_mark == 6
+        assert asyncio.run(restarted(handler, make_update(6, 2), {})) is None
+        assert asyncio.run(restarted(handler, make_update(7, 3), {})) == "ok"
+
+
+def test_stale_mark_reset():
+    """Отметка, не обновлявшаяся дольше суток, не отсекает новые update_id после их сброса Telegram"""
+    async def handler(event, data):
+        return "ok"
+
+    with tempfile.TemporaryDirectory() as folder:
+        state_path = os.path.join(folder, "state.json")
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump({"high_water_mark": 900000, "updated_at": time.time() - 8 * 24 * 3600}, f)
+
+        dedup = UpdateDeduplicator(state_path, flush_interval=0)
+        assert asyncio.run(dedup(handler, make_update(1234, 1), {})) == "ok"
+        assert dedup.high_water_mark == 1234
+        assert asyncio.run(dedup(handler, make_update(1234, 1), {})) is None
+
+        # Свежая отметка после перезапуска по-прежнему отсекает повторы
+        restarted = UpdateDeduplicator(state_path)
+        assert asyncio.run(restarted(handler, make_update(1233, 5), {})) is None
+        assert restarted.high_water_mark == 1234
+
+
+def test_mark_waits_for_in_flight_updates():
+    """Отметка не обгоняет обновление, которое еще обрабатывается"""
+    async def scenario():
+        dedup = UpdateDeduplicator(os.path.join(tempfile.gettempdir(), "unused_state.json"),
+                                   flush_interval=3600)
+        release = asyncio.Event()
+
+        async def slow(event, data):
+            await release.wait()
+
+        async def fast(event, data):
+            return None
+
+        slow_task = asyncio.create_task(dedup(slow, make_update(20, 1), {}))
+        await asyncio.sleep(0)
+        await dedup(fast, make_update(21, 2), {})
+        mark_while_running = dedup.high_water_mark
+        release.set()
+        await slow_task
+        return mark_while_running, dedup.high_water_mark
+
+    mark_while_running, final_mark = asyncio.run(scenario())
+    assert mark_while_running < 20
+    assert final_mark == 21
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование защиты от повторной доставки...")
+    test_duplicate_replays_cached_reply()
+    test_high_water_mark_survives_restart()
+    test_stale_mark_reset()
+    test_mark_waits_for_in_flight_updates()
+    print("✅ Тест завершен!")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки быстрого импорта bot_gpt.py
+"""
+
+from importtime_report import build_report, format_report, measure_import, parse_importtime
+
+# Тяжелые зависимости, которые должны загружаться только по мере надобности
+HEAVY_MODULES = ["aiogram", "openai", "docx", "lxml", "httpx", "pydantic", "aiohttp"]
+
+
+def test_parse_importtime():
+    """Проверяет разбор вывода -X importtime"""
+    output = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     _io
+import time:       300 |        420 |   io
+import time:      1000 |       1420 | bot_gpt
+"""
+    entries = parse_importtime(output)
+    assert [entry["module"] for entry in entries] == ["_io", "io", "bot_gpt"]
+    assert [entry["depth"] for entry in entries] == [2, 1, 0]
+    report = build_report(entries)
+    assert report["total_ms"] == 1.42
+    assert report["heaviest"][0]["module"] == "bot_gpt"
+
+
+def test_bot_import_is_lazy():
+    """Импорт bot_gpt не загружает aiogram, openai и DOCX стек"""
+    report = build_report(measure_import("bot_gpt"))
+    print(format_report("bot_gpt", report))
+
+    loaded_heavy = sorted(
+        module for module in report["loaded"]
+        if module.split(".")[0] in HEAVY_MODULES
+    )
+    assert loaded_heavy == [], f"Тяжелые модули загружены при импорте: {loaded_heavy}"
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование времени импорта...")
+    test_parse_importtime()
+    test_bot_import_is_lazy()
+    print("✅ Тест завершен!")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки дедлайнов, дублирования и повторов LLM запросов
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from llm_hedging import HedgedRequester
+from model_router import RoutePolicy
+
+
+class TransientError(Exception):
+    pass
+
+
+def test_hedge_wins_and_loser_cancelled():
+    """Медленный основной запрос дублируется, проигравший отменяется"""
+    async def scenario():
+        requester = HedgedRequester(default_hedge_delay=0.05, max_hedge_ratio=1.0)
+        delays = [1.0, 0.01]
+        cancelled = []
+        abandoned = []
+
+        async def request():
+            delay = delays.pop(0)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(delay)
+                raise
+            return delay
+
+        result = await requester.run(request, key="test", deadline=2.0, on_abandoned=abandoned.append)
+        await asyncio.sleep(0)
+        return result, cancelled, abandoned, requester.get_stats()
+
+    result, cancelled, abandoned, stats = asyncio.run(scenario())
+    print(f"📊 {stats}")
+    assert result == 0.01
+    assert cancelled == [1.0]
+    # Проигравший запрос уже отправлен модели: его стоимость учитывается
+    assert abandoned == [1] and stats["abandoned"] == 1
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_same_batch_duplicate_not_abandoned():
+    """Дубликат, завершившийся вместе с победителем, не считается брошенным"""
+    async def scenario():
+        requester = HedgedRequester(default_hedge_delay=0.01, max_hedge_ratio=1.0)
+        both_sent = asyncio.Event()
+        started = []
+        abandoned = []
+
+        async def request():
+            started.append(len(started))
+            if len(started) == 2:
+                both_sent.set()
+            await both_sent.wait()
+            return started[-1]
+
+        await requester.run(request, key="test", deadline=2.0, on_abandoned=abandoned.append)
+        return abandoned, requester.get_stats()
+
+    abandoned, stats = asyncio.run(scenario())
+    print(f"📊 {stats}")
+    assert stats["hedges"] == 1
+    assert abandoned == [] and stats["abandoned"] == 0
+
+
+def test_deadline_and_retry():
+    """Временные ошибки повторяются в пределах дедлайна"""
+    async def scenario():
+        requester = HedgedRequester(default_hedge_delay=10.0, max_retries=2, base_backoff=0.001,
+                                    transient_exceptions=(TransientError,))
+        calls = []
+
+        async def request():
+            calls.append(len(calls))
+            if len(calls) < 3:
+                raise TransientError("503")
+            return "ok"
+
+        result = await requester.run(request, deadline=1.0)
+        return result, len(calls), requester.get_stats()
+
+    result, calls, stats = asyncio.run(scenario())
+    print(f"📊 {stats}")
+    assert result == "ok"
+    assert calls == 3
+    assert stats["retries"] == 2
+
+
+def test_deadline_covers_all_attempts():
+    """Дедлайн общий на попытки, дубликаты и повторы: запрос не длится дольше него"""
+    async def scenario():
+        requester = HedgedRequester(default_hedge_delay=0.02, max_hedge_ratio=1.0, max_retries=3,
+                                    base_backoff=0.001, transient_exceptions=(TransientError,))
+        calls = []
+
+        async def request():
+            calls.append(1)
+            await asyncio.sleep(1.0)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await requester.run(request, deadline=0.1)
+        except asyncio.TimeoutError:
+            return loop.time() - started, len(calls), requester.get_stats()
+        raise AssertionError("Ожидался таймаут")
+
+    elapsed, calls, stats = asyncio.run(scenario())
+    print(f"⏱ {elapsed:.3f}с, {stats}")
+    assert elapsed < 0.2
+    assert calls == 2  # основной запрос и один дубликат, повторы после дедлайна не запускаются
+    assert stats["timeouts"] == 1 and stats["retries"] == 0
+
+
+def test_fallback_within_turn_deadline():
+    """Запасная модель отвечает в пределах того же таймаута маршрута, что и основная"""
+    from neuro_salesman_gpt import NeuroSalesmanGPT
+
+    class FakeClient:
+        """Основная модель зависает, запасная отвечает сразу"""
+
+        def __init__(self):
+            self.chat = SimpleNamespace(completions=self)
+            self.models = []
+
+        def with_options(self, **kwargs):
+            return self
+
+        async def create(self, model, **kwargs):
+            self.models.append(model)
+            if model == "primary":
+                await asyncio.sleep(10)
+            return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+    async def scenario():
+        client = FakeClient()
+        hedger = HedgedRequester(default_hedge_delay=0.05, max_hedge_ratio=1.0, max_retries=2,
+                                 transient_exceptions=(TransientError,))
+        salesman = NeuroSalesmanGPT(api_key="test", client=client, hedger=hedger)
+        route = RoutePolicy("test", "primary", fallback_model="fallback", timeout=0.3)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        response = await salesman._create_completion(route, [{"role": "user", "content": "Привет"}])
+        return response, loop.time() - started, client.models
+
+    response, elapsed, models = asyncio.run(scenario())
+    print(f"⏱ {elapsed:.3f}с, запросы: {models}")
+    assert response.choices[0].message.content == "ok"
+    assert models == ["primary", "primary", "fallback"]
+    assert elapsed < 0.3
+
+
+def test_permanent_error_not_retried():
+    """Постоянные ошибки не повторяются"""
+    async def scenario():
+        requester = HedgedRequester(transient_exceptions=(TransientError,))
+        calls = []
+
+        async def request():
+            calls.append(1)
+            raise ValueError("bad request")
+
+        try:
+            await requester.run(request, deadline=1.0)
+        except ValueError:
+            return len(calls)
+
+    assert asyncio.run(scenario()) == 1
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование дублирования LLM запросов...")
+    test_hedge_wins_and_loser_cancelled()
+    test_same_batch_duplicate_not_abandoned()
+    test_deadline_and_retry()
+    test_deadline_covers_all_attempts()
+    test_fallback_within_turn_deadline()
+    test_permanent_error_not_retried()
+    print("✅ Тест завершен!")
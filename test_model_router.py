@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки маршрутизации моделей
+"""
+
+from model_router import ModelRouter, estimate_cost
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+def test_route_selection():
+    """Проверяет выбор маршрута по блоку, сообщению и профайлу"""
+    router = ModelRouter.default("gpt-4.1-mini", "gpt-4.1-nano", "gpt-4o-mini")
+
+    qualification = {
+        "агент-блока": "Блок Квалификации",
+        "агент-профайла": {"статус_профайла": {
+            "Сколько сотрудников в компании": "50",
+            "Кто он по должности": "Нет информации",
+            "Сколько HR в компании": "Нет информации",
+            "Кого в основном нанимают": "Нет информации"
+        }}
+    }
+    almost_full = {
+        "Агент-блока": "Блок Квалификации",
+        "Агент-профайла": {"статус_профайла": {"a": "1", "b": "2", "c": "3", "d": "4"}}
+    }
+    presentation = {"агент-блока": "Блок Презентации"}
+
+    cases = [
+        ({}, "начало диалога", "opener"),
+        (qualification, "У нас 50 сотрудников", "qualification_short"),
+        (qualification, "Очень длинное сообщение " * 10, "negotiation"),
+        (almost_full, "Да, все верно", "negotiation"),
+        (presentation, "Сколько стоит?", "negotiation"),
+    ]
+
+    for communication, message, expected in cases:
+        route = router.select_route(
+            ModelRouter.extract_block(communication),
+            message,
+            ModelRouter.profile_completeness(communication)
+        )
+        print(f"• {message[:30]!r} -> {route.name} ({route.model}, max_tokens={route.max_tokens})")
+        assert route.name == expected
+
+    assert ModelRouter.profile_completeness(qualification) == 0.25
+    assert ModelRouter.profile_completeness(almost_full) == 1.0
+
+
+def test_archived_keys_and_placeholders():
+    """Ключи agent-блока из архива читаются как агент-блока, заглушки считаются пустыми"""
+    from neuro_salesman_gpt import NeuroSalesmanGPT
+
+    archived = {
+        "agent-блока": "выбор блока Презентации",
+        "agent-профайла": {"статус_профайла": {"a": "1", "b": "Нет информации", "c": "", "d": None}},
+    }
+    assert ModelRouter.extract_block(archived) == "выбор блока презентации"
+    assert ModelRouter.profile_completeness(archived) == 0.25
+
+    unknown = {"agent-блока": "Нет информации"}
+    assert ModelRouter.extract_block(unknown) == ""
+
+    salesman = NeuroSalesmanGPT(api_key="test", client=object())
+    salesman.last_agent_communication[1] = unknown
+    salesman.last_agent_communication[2] = archived
+    assert not salesman.is_mid_sale(1)
+    assert salesman.is_mid_sale(2)
+
+
+def test_route_stats():
+    """Проверяет учет задержки, ошибок и стоимости по маршрутам"""
+    router = ModelRouter.default()
+    router.record("opener", "gpt-4.1-nano", 0.8, usage=FakeUsage(20000, 500))
+    router.record("opener", "gpt-4.1-nano", 5.0, error=True)
+    router.record("opener", "gpt-4.1-mini", 1.2, usage=FakeUsage(20000, 500), fallback=True)
+
+    stats = router.get_stats()["opener"]
+    print(f"📊 Статистика маршрута: {stats}")
+    assert stats["requests"] == 3
+    assert stats["errors"] == 1
+    assert stats["fallbacks"] == 1
+    assert abs(stats["avg_latency"] - 1.0) < 1e-9
+    expected_cost = estimate_cost("gpt-4.1-nano", 20000, 500) + estimate_cost("gpt-4.1-mini", 20000, 500)
+    assert abs(stats["cost_usd"] - round(expected_cost, 6)) < 1e-9
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование маршрутизации моделей...")
+    test_route_selection()
+    test_archived_keys_and_placeholders()
+    test_route_stats()
+    print("✅ Тест завершен!")
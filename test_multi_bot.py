@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки мультибот-режима: настройки ботов, общие ресурсы и изоляция
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+
+from multi_bot import MultiBotRuntime, SharedResources, load_tenants
+
+
+def write_config(tmp, tenants):
+    path = os.path.join(tmp, "tenants.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"base_folder": os.path.join(tmp, "tenants"), "tenants": tenants}, f, ensure_ascii=False)
+    return path
+
+
+def write_prompt(tmp, name, text):
+    path = os.path.join(tmp, f"{name}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def test_load_tenants():
+    """Токен из переменной окружения, папки по умолчанию и проверка повторов"""
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["TEST_COURIER_TOKEN"] = "111:courier"
+        path = write_config(tmp, [
+            {"name": "courier", "bot_token_env": "TEST_COURIER_TOKEN"},
+            {"name": "retail", "bot_token": "222:retail", "models": {"primary": "gpt-4.1", "timeout": 20}},
+        ])
+        courier, retail = load_tenants(path)
+        assert courier.token == "111:courier"
+        assert courier.dialogs_folder == os.path.join(tmp, "tenants", "courier", "dialogs")
+        assert retail.build_router().default_policy.model == "gpt-4.1"
+
+        duplicated = write_config(tmp, [{"name": "a", "bot_token": "1:x"}, {"name": "b", "bot_token": "1:x"}])
+        for bad_path in (duplicated, write_config(tmp, [{"name": "bad name", "bot_token": "1:x"}])):
+            try:
+                load_tenants(bad_path)
+            except ValueError as e:
+                print(f"⚠️ {e}")
+                continue
+            raise AssertionError("Ожидалась ошибка конфигурации")
+
+
+def test_shared_resources_and_isolation():
+    """Боты используют общий клиент LLM и лимитер, но свои промты, папки и метрики"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_config(tmp, [
+            {"name": "courier", "bot_token": "111:courier", "prompt_path": write_prompt(tmp, "courier", "Курьеры")},
+            {"name": "retail", "bot_token": "222:retail", "prompt_path": write_prompt(tmp, "retail", "Ритейл"),
+             "admin_ids": [42]},
+        ])
+        shared = SharedResources(openai_api_key="")
+        shared._llm_client = object()
+        runtime = MultiBotRuntime(load_tenants(path), shared)
+        courier, retail = runtime.apps["courier"], runtime.apps["retail"]
+
+        assert courier.neuro_salesman.system_prompt == "Курьеры"
+        assert retail.neuro_salesman.system_prompt == "Ритейл"
+        assert courier.neuro_salesman.client is retail.neuro_salesman.client is shared._llm_client
+        assert courier.admission is retail.admission is shared.admission
+        assert courier.token_budget is not retail.token_budget
+        assert courier.dialog_logger.dialogs_folder != retail.dialog_logger.dialogs_folder
+        assert retail.is_admin(42) and not courier.is_admin(42)
+
+        retail.token_budget.charge(1, "gpt-4.1-mini", 1000, 100)
+        stats = runtime.get_stats()
+        print(f"📊 {stats}")
+        assert stats["retail"]["tokens_today"] == 1100 and stats["courier"]["tokens_today"] == 0
+        shared.executor.shutdown()
+
+
+def test_shutdown_stops_background_work():
+    """После остановки бота не остается его фоновых задач и обработчика очереди отправки"""
+    async def scenario(path):
+        shared = SharedResources(openai_api_key="")
+        app = MultiBotRuntime(load_tenants(path), shared).apps["courier"]
+        await app.startup()
+        app.speculative._spawn(asyncio.sleep(3600))
+        tasks = list(app.background_tasks) + list(app.speculative.tasks)
+        await app.shutdown()
+        await shared.close()
+        await asyncio.sleep(0)  # монитор задержки общий: он только отменяется в close()
+        leftover = asyncio.all_tasks() - {asyncio.current_task()}
+        return tasks, leftover, app.send_pipeline._worker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_config(tmp, [{"name": "courier", "bot_token": "111:courier"}])
+        tasks, leftover, worker = asyncio.run(scenario(path))
+    print(f"🛑 Остановлено фоновых задач: {len(tasks)}")
+    assert tasks and all(task.done() for task in tasks)
+    assert not leftover
+    assert worker is None
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование мультибот-режима...")
+    test_load_tenants()
+    test_shared_resources_and_isolation()
+    test_shutdown_stops_background_work()
+    print("✅ Тест завершен!")
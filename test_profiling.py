@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки монитора задержки цикла событий и времени обработчиков
+"""
+
+import asyncio
+import logging
+import time
+from profiling import HandlerTimings, LoopLagMonitor
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+
+def test_loop_lag_monitor_reports_blocking_stack():
+    """Блокирующий вызов в цикле событий попадает в лог вместе со стеком"""
+    async def blocking_handler():
+        time.sleep(0.3)
+
+    async def scenario():
+        monitor = LoopLagMonitor(threshold_ms=100, interval=0.02)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        await blocking_handler()
+        await asyncio.sleep(0.1)
+        monitor.stop()
+        return monitor.get_stats()
+
+    log_handler = ListHandler()
+    logging.getLogger("profiling").addHandler(log_handler)
+    try:
+        stats = asyncio.run(scenario())
+    finally:
+        logging.getLogger("profiling").removeHandler(log_handler)
+    print(f"📊 {stats}")
+    assert stats["stalls"] >= 1
+    assert stats["max_lag_ms"] >= 200
+    assert any("blocking_handler" in record for record in log_handler.records)
+
+
+def test_handler_timings():
+    """Middleware учитывает вызовы и ошибки по имени обработчика"""
+    class Handler:
+        def __init__(self, callback):
+            self.callback = callback
+
+    async def cmd_start():
+        pass
+
+    async def call(event, data):
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def scenario():
+        timings = HandlerTimings()
+        data = {"handler": Handler(cmd_start)}
+        for _ in range(3):
+            assert await timings(call, None, data) == "ok"
+        return timings.get_stats()
+
+    stats = asyncio.run(scenario())
+    print(f"📊 {stats}")
+    assert stats[0]["handler"] == "cmd_start"
+    assert stats[0]["count"] == 3
+    assert stats[0]["avg_ms"] >= 10
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование профилирования...")
+    test_loop_lag_monitor_reports_blocking_stack()
+    test_handler_timings()
+    print("✅ Тест завершен!")
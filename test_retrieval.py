@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки индекса успешных диалогов
+"""
+
+import os
+import tempfile
+from retrieval import DialogIndex, HashingEmbedder
+
+
+def make_dialog(reason: str, pairs):
+    messages = [{"client_message": "начало диалога", "neuro_salesman_response": "Здравствуйте!"}]
+    for client, response in pairs:
+        messages.append({"client_message": client, "neuro_salesman_response": response})
+    return {"finish_reason": reason, "messages": messages}
+
+
+def test_embedder_similarity():
+    """Похожие сообщения ближе непохожих, векторы единичной длины"""
+    vectors = HashingEmbedder().embed([
+        "Сколько стоит тариф?",
+        "А сколько стоят тарифы",
+        "У нас нет вакансий в этом месяце",
+    ])
+    assert abs(float((vectors[0] ** 2).sum()) - 1.0) < 1e-5
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+def test_index_search_and_persistence():
+    """В индекс попадают только успешные диалоги, поиск переживает перезапуск"""
+    with tempfile.TemporaryDirectory() as folder:
+        index = DialogIndex(os.path.join(folder, "index"))
+        added = index.add_dialog(make_dialog("success", [
+            ("Сколько стоит тариф?", "Тариф Старт стоит 9900 ₽ в месяц"),
+            ("Нам нужно нанять 20 курьеров", "Для массового найма подойдет тариф Бизнес"),
+        ]), "dialog_1.json")
+        assert added == 2
+        assert index.add_dialog(make_dialog("timeout", [("Дорого", "Понимаю")]), "dialog_2.json") == 0
+        assert index.add_dialog(make_dialog("success", [("x", "y")]), "dialog_1.json") == 0
+
+        hits = index.search("сколько стоят ваши тарифы", k=1)
+        print(f"🔎 {hits}")
+        assert hits[0]["response"] == "Тариф Старт стоит 9900 ₽ в месяц"
+
+        # Дописывание после поиска переоткрывает матрицу
+        index.add_dialog(make_dialog("success", [("Есть ли интеграция с hh.ru?", "Да, интеграция с hh.ru есть")]),
+                         "dialog_3.json")
+        assert index.search("интеграция с hh", k=1)[0]["source"] == "dialog_3.json"
+
+        reopened = DialogIndex(os.path.join(folder, "index"))
+        assert len(reopened) == 3
+        assert reopened.search("нанять курьеров", k=1)[0]["source"] == "dialog_1.json"
+        assert "Клиент:" in DialogIndex.format_exemplars(hits)
+
+
+def test_index_sync_archive():
+    """Синхронизация с папкой диалогов добавляет только новые успешные файлы и запоминает пропущенные"""
+    with tempfile.TemporaryDirectory() as folder:
+        index = DialogIndex(folder)
+        first = index.sync("dialogs")
+        second = index.sync("dialogs")
+        print(f"📊 Проиндексировано пар: {first}, {index.get_stats()}")
+        # В архиве два успешных диалога (12 и 11 пар) и два остановленных пользователем
+        assert first == 23
+        assert second == 0
+        assert len(index.sources) == 2 and len(index.skipped) == 2
+
+        # После перезапуска пропущенные файлы не перечитываются
+        reopened = DialogIndex(folder)
+        assert reopened.skipped == index.skipped
+        assert reopened.sync("dialogs") == 0
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование индекса успешных диалогов...")
+    test_embedder_similarity()
+    test_index_search_and_persistence()
+    test_index_sync_archive()
+    print("✅ Тест завершен!")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки очереди исходящих сообщений
+"""
+
+import asyncio
+from aiogram.exceptions import TelegramRetryAfter
+from send_pipeline import PipelineStoppedError, SendPipeline, LANE_LIVE, LANE_NOTICE, LANE_BULK
+
+
+class FakeBot:
+    """Бот, который запоминает порядок отправки и один раз отвечает RetryAfter"""
+
+    def __init__(self, flood_chat=None):
+        self.sent = []
+        self.flood_chat = flood_chat
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == self.flood_chat:
+            self.flood_chat = None
+            raise TelegramRetryAfter(method=None, message="Too Many Requests", retry_after=0.1)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def test_priority_lanes():
+    """Живые ответы уходят раньше уведомлений и файлов"""
+    async def scenario():
+        bot = FakeBot()
+        pipeline = SendPipeline(bot, per_chat_interval=0.0, global_rate=1000)
+        await pipeline.start()
+        # Обработчик еще не получил управление: все три запроса уже в очереди
+        futures = [
+            pipeline.enqueue(1, "send_message", LANE_BULK, text="bulk"),
+            pipeline.enqueue(2, "send_message", LANE_NOTICE, text="notice"),
+            pipeline.enqueue(3, "send_message", LANE_LIVE, text="live"),
+        ]
+        await asyncio.gather(*futures)
+        await pipeline.stop()
+        return bot.sent, pipeline.get_stats()
+
+    sent, stats = asyncio.run(scenario())
+    print(f"📨 Порядок отправки: {sent}")
+    assert [text for _, text in sent] == ["live", "notice", "bulk"]
+    assert stats["live"]["sent"] == 1 and stats["bulk"]["sent"] == 1
+
+
+def test_retry_after_rescheduling():
+    """RetryAfter откладывает сообщение, а не теряет его"""
+    async def scenario():
+        bot = FakeBot(flood_chat=7)
+        pipeline = SendPipeline(bot, per_chat_interval=0.0, global_rate=1000)
+        await pipeline.start()
+        result = await pipeline.send_message(7, "после паузы", lane=LANE_NOTICE)
+        await pipeline.stop()
+        return result, pipeline.get_stats()
+
+    result, stats = asyncio.run(scenario())
+    print(f"📊 {stats['notice']}")
+    assert result == "после паузы"
+    assert stats["notice"]["retry_after"] == 1
+    assert stats["notice"]["avg_latency"] >= 0.1
+
+
+def test_futures_fail_when_worker_not_running():
+    """Без работающего обработчика запросы завершаются ошибкой, а не ждут вечно"""
+    async def scenario():
+        bot = FakeBot()
+        pipeline = SendPipeline(bot, per_chat_interval=0.0, global_rate=1000)
+        not_started = pipeline.enqueue(1, "send_message", text="до запуска")
+
+        await pipeline.start()
+        delivered = pipeline.enqueue(1, "send_message", text="досылается при остановке")
+        await pipeline.stop()
+        after_stop = pipeline.enqueue(1, "send_message", text="после остановки")
+
+        # Упавший обработчик завершает ошибкой запросы, оставшиеся в очереди
+        await pipeline.start()
+        pipeline._promote_delayed = None  # ломаем обработчик
+        stranded = pipeline.enqueue(2, "send_message", text="обработчик упал")
+        results = await asyncio.gather(not_started, delivered, after_stop, stranded, return_exceptions=True)
+        return results, bot.sent
+
+    (not_started, delivered, after_stop, stranded), sent = asyncio.run(scenario())
+    assert isinstance(not_started, PipelineStoppedError)
+    assert delivered == "досылается при остановке"
+    assert isinstance(after_stop, PipelineStoppedError)
+    assert isinstance(stranded, PipelineStoppedError)
+    assert sent == [(1, "досылается при остановке")]
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование очереди исходящих сообщений...")
+    test_priority_lanes()
+    test_retry_after_rescheduling()
+    test_futures_fail_when_worker_not_running()
+    print("✅ Тест завершен!")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки снимков и журнала живых диалогов и восстановления после сбоя
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from session_store import SessionStore
+
+
+def make_turn(user_id, index, timestamp=None):
+    """Ход в формате DialogLogger и два сообщения истории модели"""
+    timestamp = timestamp or datetime.now().isoformat()
+    reply = json.dumps({"agent_communication": {"агент-блока": "Квалификация"},
+                        "message": f"Ответ {index} нейропродажника про тарифы и найм курьеров"}, ensure_ascii=False)
+    message = {
+        "timestamp": timestamp,
+        "client_message": f"Сообщение {index} клиента {user_id}: у нас 40 вакансий",
+        "neuro_salesman_response": f"Ответ {index} нейропродажника про тарифы и найм курьеров",
+        "agent_communication": {"агент-блока": "Квалификация"},
+        "full_response": f"Ответ {index} нейропродажника про тарифы и найм курьеров",
+    }
+    history = [{"role": "user", "content": message["client_message"], "timestamp": timestamp},
+               {"role": "assistant", "content": reply, "timestamp": timestamp}]
+    return message, history
+
+
+def test_snapshot_and_replay():
+    """Снимок плюс журнал восстанавливают ходы, сбросы истории и завершения"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(tmp)
+        histories = {1: [], 2: []}
+        for index in range(3):
+            for user_id in (1, 2):
+                message, new_history = make_turn(user_id, index)
+                histories[user_id].extend(new_history)
+                store.record_turn(user_id, message, histories[user_id])
+        store.snapshot()
+
+        # После снимка: сброс истории у первого, завершение второго, новый третий
+        histories[1] = []
+        message, new_history = make_turn(1, 3)
+        histories[1].extend(new_history)
+        store.record_turn(1, message, histories[1])
+        store.record_end(2)
+        message, new_history = make_turn(3, 0)
+        store.record_turn(3, message, new_history)
+        store.close()
+
+        recovered = SessionStore(tmp).recover()
+        assert set(recovered) == {1, 3}
+        assert len(recovered[1]["dialog"]["messages"]) == 4
+        assert recovered[1]["history"] == histories[1]
+        assert not os.path.exists(os.path.join(tmp, ".sessions.log"))
+
+
+def test_crash_consistency():
+    """Оборванная запись журнала и сбой во время снимка не теряют записанные ходы"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(tmp)
+        history = []
+        for index in range(2):
+            message, new_history = make_turn(1, index)
+            history.extend(new_history)
+            store.record_turn(1, message, history)
+        # Сбой между откладыванием журнала и записью снимка
+        store.begin_snapshot()
+        message, new_history = make_turn(1, 2)
+        history.extend(new_history)
+        store.record_turn(1, message, history)
+        store.close()
+        with open(os.path.join(tmp, ".sessions.log"), "a", encoding="utf-8") as f:
+            f.write('{"op":"turn","user_id":1,"mess')
+
+        restarted = SessionStore(tmp)
+        recovered = restarted.recover()
+        print(f"♻️ {restarted.get_stats()}")
+        assert len(recovered[1]["dialog"]["messages"]) == 3
+        assert recovered[1]["history"] == history
+
+        # Новые записи после восстановления не продолжают оборванную строку
+        message, new_history = make_turn(1, 3)
+        history.extend(new_history)
+        restarted.record_turn(1, message, history)
+        restarted.close()
+        assert len(SessionStore(tmp).recover()[1]["dialog"]["messages"]) == 4
+
+
+def test_recovery_time_10k_sessions():
+    """Восстановление 10 000 сессий (снимок плюс журнал) укладывается в секунду"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(tmp)
+        for user_id in range(10000):
+            history = []
+            for index in range(2):
+                message, new_history = make_turn(user_id, index)
+                history.extend(new_history)
+                store.record_turn(user_id, message, history)
+        store.snapshot()
+        for user_id in range(1000):
+            message, new_history = make_turn(user_id, 2)
+            store.record_turn(user_id, message, store.sessions[user_id]["history"] + new_history)
+        store.close()
+
+        restarted = SessionStore(tmp)
+        started = time.perf_counter()
+        recovered = restarted.recover()
+        elapsed = time.perf_counter() - started
+        print(f"⏱ Восстановлено {len(recovered)} сессий за {restarted.recovery_seconds:.3f}с "
+              f"(со сворачиванием журнала {elapsed:.3f}с)")
+        assert len(recovered) == 10000 and restarted.replayed == 1000
+        assert restarted.recovery_seconds < 1.0
+
+
+def test_expired_dialogs_finalized_on_startup():
+    """После перезапуска диалоги восстанавливаются, а истекшие за простой завершаются пакетом"""
+    from bot_gpt import create_app, recover_sessions
+    from dialog_fsm import EVENT_START
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def make_app():
+            return create_app(token="123456:TEST", dialogs_folder=os.path.join(tmp, "dialogs"),
+                              docx_folder=os.path.join(tmp, "docx"),
+                              retrieval_index_folder=os.path.join(tmp, "index"))
+
+        app = make_app()
+        old = (datetime.now() - timedelta(hours=1)).isoformat()
+        for user_id, timestamp in ((1, old), (2, None)):
+            app.dialog_fsm.transition(user_id, EVENT_START)
+            message, history = make_turn(user_id, 0, timestamp)
+            app.session_store.record_turn(user_id, message, history)
+        app.session_store.close()
+
+        async def restart():
+            restarted = make_app()
+            recover_sessions(restarted)
+            return restarted
+
+        restarted = asyncio.run(restart())
+        assert restarted.dialog_fsm.is_awaiting_feedback(1)
+        assert restarted.dialog_fsm.is_active(2)
+        assert restarted.neuro_salesman.get_conversation_history(2)[0]["role"] == "user"
+        assert restarted.dialog_logger.get_dialog_summary(2)["message_count"] == 1
+        assert set(restarted.session_store.sessions) == {2}
+        saved = [name for name in os.listdir(os.path.join(tmp, "dialogs")) if name.startswith("1_")]
+        with open(os.path.join(tmp, "dialogs", saved[0]), encoding="utf-8") as f:
+            assert json.load(f)["finish_reason"] == "timeout"
+
+
+def test_turns_after_recovery_not_duplicated():
+    """Ход после восстановления попадает в логгер, историю модели и журнал ровно один раз"""
+    from bot_gpt import create_app, log_turn, recover_sessions
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def make_app():
+            return create_app(token="123456:TEST", dialogs_folder=os.path.join(tmp, "dialogs"),
+                              docx_folder=os.path.join(tmp, "docx"),
+                              retrieval_index_folder=os.path.join(tmp, "index"))
+
+        def turn(app, text):
+            history = app.neuro_salesman.get_conversation_history(1)
+            history.append({"role": "user", "content": text})
+            history.append({"role": "assistant", "content": f"ответ {text}"})
+            log_turn(app, 1, text, f"ответ {text}", {})
+
+        app = make_app()
+        turn(app, "a")
+        app.session_store.close()
+
+        restarted = make_app()
+        recover_sessions(restarted)
+        turn(restarted, "c")
+        messages = [m["client_message"] for m in restarted.dialog_logger.current_dialogs[1]["messages"]]
+        history = [m["content"] for m in restarted.neuro_salesman.get_conversation_history(1)]
+        assert messages == ["a", "c"]
+        assert history == ["a", "ответ a", "c", "ответ c"]
+        restarted.session_store.close()
+
+        recovered = SessionStore(os.path.join(tmp, "dialogs")).recover()
+        assert [m["content"] for m in recovered[1]["history"]] == history
+        assert len(recovered[1]["dialog"]["messages"]) == 2
+
+
+def test_short_history_reset_recovered():
+    """/reset и /start с короткой историей не восстанавливают старое начало диалога"""
+    from bot_gpt import create_app, log_turn, reset_user_conversation
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(token="123456:TEST", dialogs_folder=os.path.join(tmp, "dialogs"),
+                         docx_folder=os.path.join(tmp, "docx"),
+                         retrieval_index_folder=os.path.join(tmp, "index"))
+        for opener in ("старое начало", "новое начало"):
+            reset_user_conversation(app, 1)
+            history = app.neuro_salesman.get_conversation_history(1)
+            history.append({"role": "user", "content": "начало диалога"})
+            history.append({"role": "assistant", "content": opener})
+            log_turn(app, 1, "начало диалога", opener, {})
+        app.session_store.close()
+
+        recovered = SessionStore(os.path.join(tmp, "dialogs")).recover()
+        assert [m["content"] for m in recovered[1]["history"]] == ["начало диалога", "новое начало"]
+        assert len(recovered[1]["dialog"]["messages"]) == 2
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование восстановления диалогов...")
+    test_snapshot_and_replay()
+    test_crash_consistency()
+    test_recovery_time_10k_sessions()
+    test_expired_dialogs_finalized_on_startup()
+    test_turns_after_recovery_not_duplicated()
+    test_short_history_reset_recovered()
+    print("✅ Тест завершен!")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Тестовый скрипт для проверки подсчета токенов, прогноза задержки и бюджетов
+"""
+
+import os
+import tempfile
+
+from token_budget import (ACTION_BLOCK, ACTION_TRUNCATE, ACTION_WARN, LatencyModel, TokenBudget,
+                          TokenCounter, truncate_messages)
+
+
+def test_heuristic_count():
+    """Эвристика дает правдоподобную оценку для русского и английского текста"""
+    assert TokenCounter.heuristic_count("") == 0
+    assert TokenCounter.heuristic_count("hello world") == 4
+    russian = TokenCounter.heuristic_count("Сколько стоит тариф для найма курьеров?")
+    print(f"🔢 Оценка токенов: {russian}")
+    assert 8 <= russian <= 20
+
+    counter = TokenCounter()
+    messages = [{"role": "system", "content": "Промт"}, {"role": "user", "content": "Привет"}]
+    assert counter.count_messages(messages) > counter.count_text("Промт") + counter.count_text("Привет")
+
+
+def test_encoding_only_from_local_cache():
+    """Без словаря в локальном кэше tiktoken не скачивает его, а подсчет идет эвристикой"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        previous = os.environ.get("TIKTOKEN_CACHE_DIR")
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+        try:
+            counter = TokenCounter()
+            assert counter.backend == "heuristic"
+            assert counter.count_text("hello world") == 4
+        finally:
+            if previous is None:
+                del os.environ["TIKTOKEN_CACHE_DIR"]
+            else:
+                os.environ["TIKTOKEN_CACHE_DIR"] = previous
+
+
+def test_latency_regression():
+    """Онлайн-регрессия восстанавливает линейную зависимость задержки от токенов"""
+    model = LatencyModel(forgetting=1.0, ridge=1e-6)
+    assert model.predict("m", 1000, 100) is None
+    for prompt, completion in [(1000, 100), (5000, 200), (2000, 800), (8000, 50), (3000, 400), (6000, 600)]:
+        latency = 0.5 + 0.1 * prompt / 1000 + 4.0 * completion / 1000
+        model.observe("m", prompt, completion, latency)
+    predicted = model.predict("m", 4000, 300)
+    print(f"⏱ Прогноз: {predicted:.3f}с, {model.get_stats()}")
+    assert abs(predicted - (0.5 + 0.4 + 1.2)) < 0.01
+
+
+def test_budget_actions():
+    """warn пропускает, truncate урезает, block отказывает"""
+    warn = TokenBudget(user_daily_tokens=1000, action=ACTION_WARN)
+    assert warn.check(1, 900, 500).action == ACTION_WARN
+
+    truncate = TokenBudget(user_daily_tokens=3000, action=ACTION_TRUNCATE)
+    decision = truncate.check(1, 4000, 1000)
+    assert decision.action == ACTION_TRUNCATE
+    assert decision.max_prompt_tokens + decision.max_completion_tokens <= 3000
+
+    block = TokenBudget(daily_tokens=1000, action=ACTION_BLOCK)
+    assert block.check(1, 100, 500).action == "allow"
+    block.charge(1, "gpt-4.1-mini", 400, 200)
+    assert block.check(2, 100, 500).blocked  # общий дневной бюджет исчерпан
+
+
+def test_truncate_messages():
+    """Урезание убирает старые сообщения, оставляя суперпромт и последнее сообщение"""
+    counter = TokenCounter()
+    messages = [{"role": "system", "content": "системный промт"}]
+    messages += [{"role": "user", "content": f"сообщение номер {i} " * 10} for i in range(10)]
+    messages.append({"role": "user", "content": "последнее"})
+    limit = counter.count_messages([messages[0], messages[-1]]) + 50
+    truncated, total = truncate_messages(messages, counter, limit)
+    assert truncated[0] == messages[0] and truncated[-1] == messages[-1]
+    assert total <= limit
+    assert total == counter.count_messages(truncated)
+
+
+def test_dialog_cost_report():
+    """Ожидаемая стоимость завершенного диалога"""
+    budget = TokenBudget()
+    budget.charge(1, "gpt-4.1-mini", 10000, 500)
+    budget.charge(1, "gpt-4.1-mini", 12000, 500)
+    budget.charge(2, "gpt-4.1-nano", 10000, 500)
+    first = budget.finish_dialog(1, "success")
+    budget.finish_dialog(2, "timeout")
+    stats = budget.get_stats()
+    print(f"📊 {stats}")
+    assert first["requests"] == 2
+    assert stats["finished_dialogs"] == 2
+    assert stats["dialog_cost_by_reason"]["success"] > stats["dialog_cost_by_reason"]["timeout"]
+    assert budget.finish_dialog(1, "success") is None
+
+
+def test_usage_survives_restart():
+    """Дневной расход сохраняется на диск: перезапуск не обнуляет лимиты"""
+    with tempfile.TemporaryDirectory() as folder:
+        state_path = os.path.join(folder, ".token_usage.json")
+        budget = TokenBudget(user_daily_tokens=1000, action=ACTION_BLOCK, state_path=state_path, flush_interval=0)
+        budget.charge(1, "gpt-4.1-mini", 700, 200)
+        budget.charge(None, "gpt-4.1-nano", 300, 100)
+
+        restarted = TokenBudget(user_daily_tokens=1000, action=ACTION_BLOCK, state_path=state_path)
+        assert restarted.user_usage == {1: 900}
+        assert restarted.total_usage == 1300
+        assert restarted.check(1, 100, 500).blocked
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование бюджетов токенов...")
+    test_heuristic_count()
+    test_encoding_only_from_local_cache()
+    test_latency_regression()
+    test_budget_actions()
+    test_truncate_messages()
+    test_dialog_cost_report()
+    test_usage_survives_restart()
+    print("✅ Тест завершен!")
@@ -0,0 +1,357 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict, deque
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from model_router import estimate_cost
+
+logger = logging.getLogger(__name__)
+
+# Действия при превышении бюджета
+ACTION_WARN = "warn"          # только предупреждение в логе
+ACTION_TRUNCATE = "truncate"  # укоротить историю и max_tokens до остатка бюджета
+ACTION_BLOCK = "block"        # не вызывать модель
+
+# Служебные токены формата чата (как в примерах OpenAI для подсчета токенов)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Эвристика без токенизатора: слова и знаки, кириллица дробится на токены мельче латиницы
+HEURISTIC_PIECE = re.compile(r"[А-Яа-яЁё]+|[A-Za-z]+|\d+|[^\sA-Za-zА-Яа-яЁё\d]")
+CYRILLIC_CHARS_PER_TOKEN = 3.0
+LATIN_CHARS_PER_TOKEN = 4.0
+DIGITS_PER_TOKEN = 3.0
+
+# Словари кодировок tiktoken (файл в кэше называется sha1 от адреса)
+TIKTOKEN_BLOB_URL = "https://openaipublic.blob.core.windows.net/encodings/{}.tiktoken"
+
+
+def tiktoken_cache_path(encoding_name: str) -> Optional[str]:
+    """Путь к словарю кодировки в кэше tiktoken (как в tiktoken.load), None - если кэш отключен"""
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["TIKTOKEN_CACHE_DIR"]
+    elif "DATA_GYM_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["DATA_GYM_CACHE_DIR"]
+    else:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return None
+    cache_key = hashlib.sha1(TIKTOKEN_BLOB_URL.format(encoding_name).encode()).hexdigest()
+    return os.path.join(cache_dir, cache_key)
+
+
+class TokenCounter:
+    """Подсчет токенов до запроса: tiktoken (если установлен и словарь доступен) или офлайн-эвристика"""
+
+    def __init__(self, encoding_name: str = "o200k_base", cache_size: int = 4096):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._encoding_loaded = False
+        # Сообщения истории не меняются: их длина считается один раз
+        self._cache: OrderedDict = OrderedDict()
+        self.cache_size = cache_size
+
+    @property
+    def encoding(self):
+        """Кодировка tiktoken (None, если пакет или файл словаря недоступен)"""
+        if not self._encoding_loaded:
+            self._encoding_loaded = True
+            # Словарь берется только из локального кэша: скачивание заблокировало бы цикл событий
+            cache_path = tiktoken_cache_path(self.encoding_name)
+            if cache_path is None or not os.path.exists(cache_path):
+                logger.info(f"Словаря {self.encoding_name} нет в кэше tiktoken, используется эвристический подсчет токенов")
+                return None
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                logger.info(f"tiktoken недоступен ({e}), используется эвристический подсчет токенов")
+        return self._encoding
+
+    @property
+    def backend(self) -> str:
+        return "tiktoken" if self.encoding is not None else "heuristic"
+
+    @staticmethod
+    def heuristic_count(text: str) -> int:
+        """Оценка числа токенов без словаря"""
+        tokens = 0
+        for piece in HEURISTIC_PIECE.findall(text):
+            first = piece[0]
+            if first.isdigit():
+                tokens += math.ceil(len(piece) / DIGITS_PER_TOKEN)
+            elif first.isalpha():
+                per_token = LATIN_CHARS_PER_TOKEN if first.isascii() else CYRILLIC_CHARS_PER_TOKEN
+                tokens += math.ceil(len(piece) / per_token)
+            else:
+                tokens += 1
+        return tokens
+
+    def count_text(self, text: str) -> int:
+        cached = self._cache.get(text)
+        if cached is not None:
+            self._cache.move_to_end(text)
+            return cached
+        encoding = self.encoding
+        count = len(encoding.encode(text)) if encoding is not None else self.heuristic_count(text)
+        self._cache[text] = count
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return count
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        """Токены запроса chat.completions вместе со служебными"""
+        return sum(TOKENS_PER_MESSAGE + self.count_text(message["content"]) for message in messages) + TOKENS_PER_REPLY
+
+
+class LatencyModel:
+    """Онлайн-регрессия задержки: latency = a + b * prompt_tokens + c * completion_tokens (по модели)"""
+
+    def __init__(self, forgetting: float = 0.98, ridge: float = 1e-3, min_samples: int = 5):
+        # Экспоненциальное забывание: свежие замеры важнее старых
+        self.forgetting = forgetting
+        self.ridge = ridge
+        self.min_samples = min_samples
+        # Нормальные уравнения X^T X и X^T y по каждой модели (признаки в тысячах токенов)
+        self._xtx: Dict[str, List[List[float]]] = {}
+        self._xty: Dict[str, List[float]] = {}
+        self._samples: Dict[str, int] = {}
+        self._coefficients: Dict[str, Optional[List[float]]] = {}
+        # Ошибка прогноза на новых замерах (до обновления модели)
+        self.errors: Dict[str, deque] = {}
+
+    def observe(self, model: str, prompt_tokens: int, completion_tokens: int, latency: float) -> None:
+        predicted = self.predict(model, prompt_tokens, completion_tokens)
+        if predicted is not None:
+            self.errors.setdefault(model, deque(maxlen=200)).append(abs(predicted - latency))
+        x = [1.0, prompt_tokens / 1000, completion_tokens / 1000]
+        xtx = self._xtx.setdefault(model, [[0.0] * 3 for _ in range(3)])
+        xty = self._xty.setdefault(model, [0.0] * 3)
+        for i in range(3):
+            xty[i] = self.forgetting * xty[i] + x[i] * latency
+            for j in range(3):
+                xtx[i][j] = self.forgetting * xtx[i][j] + x[i] * x[j]
+        self._samples[model] = self._samples.get(model, 0) + 1
+        self._coefficients[model] = None
+
+    def _solve(self, model: str) -> Optional[List[float]]:
+        """Решает систему 3x3 методом Гаусса (с небольшой регуляризацией)"""
+        matrix = [row[:] + [value] for row, value in zip(self._xtx[model], self._xty[model])]
+        for i in range(3):
+            matrix[i][i] += self.ridge
+        for column in range(3):
+            pivot = max(range(column, 3), key=lambda row: abs(matrix[row][column]))
+            if abs(matrix[pivot][column]) < 1e-12:
+                return None
+            matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+            for row in range(3):
+                if row != column:
+                    factor = matrix[row][column] / matrix[column][column]
+                    for k in range(column, 4):
+                        matrix[row][k] -= factor * matrix[column][k]
+        return [matrix[i][3] / matrix[i][i] for i in range(3)]
+
+    def coefficients(self, model: str) -> Optional[List[float]]:
+        """(секунды, секунды на 1000 токенов запроса, секунды на 1000 токенов ответа)"""
+        if self._samples.get(model, 0) < self.min_samples:
+            return None
+        if self._coefficients.get(model) is None:
+            self._coefficients[model] = self._solve(model)
+        return self._coefficients[model]
+
+    def predict(self, model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+        """Ожидаемая задержка в секундах (None, пока замеров мало)"""
+        coefficients = self.coefficients(model)
+        if coefficients is None:
+            return None
+        intercept, per_prompt, per_completion = coefficients
+        return max(0.0, intercept + per_prompt * prompt_tokens / 1000 + per_completion * completion_tokens / 1000)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        stats = {}
+        for model, samples in self._samples.items():
+            coefficients = self.coefficients(model)
+            errors = self.errors.get(model)
+            stats[model] = {
+                "samples": samples,
+                "coefficients": [round(value, 4) for value in coefficients] if coefficients else None,
+                "mean_abs_error": sum(errors) / len(errors) if errors else None,
+            }
+        return stats
+
+
+class BudgetDecision:
+    """Результат проверки бюджета перед запросом"""
+
+    def __init__(self, action: str, max_completion_tokens: int, max_prompt_tokens: Optional[int] = None,
+                 reason: str = ""):
+        self.action = action
+        self.max_completion_tokens = max_completion_tokens
+        # Для truncate: сколько токенов может занять запрос
+        self.max_prompt_tokens = max_prompt_tokens
+        self.reason = reason
+
+    @property
+    def blocked(self) -> bool:
+        return self.action == ACTION_BLOCK
+
+
+class TokenBudget:
+    """Дневные бюджеты токенов (на пользователя и на весь бот) и стоимость завершенных диалогов"""
+
+    def __init__(self, user_daily_tokens: int = 0, daily_tokens: int = 0, action: str = ACTION_WARN,
+                 min_completion_tokens: int = 200, window: int = 500, state_path: Optional[str] = None,
+                 flush_interval: float = 5.0):
+        # 0 - без ограничения
+        self.user_daily_tokens = user_daily_tokens
+        self.daily_tokens = daily_tokens
+        self.action = action
+        # Меньше этого ответ модели бессмыслен: при truncate лучше заблокировать
+        self.min_completion_tokens = min_completion_tokens
+        self.day = date.today()
+        self.user_usage: Dict[int, int] = {}
+        self.total_usage = 0
+        # Расход за день сохраняется на диск, чтобы перезапуск не обнулял дневные лимиты
+        self.state_path = state_path
+        self.flush_interval = flush_interval
+        self._dirty = False
+        self._saved_at = 0.0
+        if state_path:
+            self._load()
+        # Токены и стоимость текущего диалога пользователя
+        self.dialog_usage: Dict[int, Dict] = {}
+        self.window = window
+        self.finished_costs = deque(maxlen=window)
+        self.finished_by_reason: Dict[str, deque] = {}
+        self.warnings = 0
+        self.truncated = 0
+        self.blocked = 0
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("day") == self.day.isoformat():
+                self.user_usage = {int(user_id): tokens for user_id, tokens in data.get("user_usage", {}).items()}
+                self.total_usage = int(data.get("total_usage", 0))
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            logger.error(f"Не удалось прочитать расход токенов {self.state_path}: {e}")
+
+    def save(self) -> None:
+        """Атомарно сохраняет расход за день"""
+        if not self.state_path or not self._dirty:
+            return
+        folder = os.path.dirname(self.state_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"day": self.day.isoformat(), "user_usage": self.user_usage,
+                       "total_usage": self.total_usage}, f)
+        os.replace(tmp_path, self.state_path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def _roll_day(self) -> None:
+        today = date.today()
+        if today != self.day:
+            self.day = today
+            self.user_usage = {}
+            self.total_usage = 0
+            self._dirty = True
+
+    def remaining(self, user_id: int) -> Optional[int]:
+        """Остаток бюджета на сегодня (None - без ограничения)"""
+        self._roll_day()
+        limits = []
+        if self.user_daily_tokens:
+            limits.append(self.user_daily_tokens - self.user_usage.get(user_id, 0))
+        if self.daily_tokens:
+            limits.append(self.daily_tokens - self.total_usage)
+        return min(limits) if limits else None
+
+    def check(self, user_id: int, prompt_tokens: int, max_tokens: int) -> BudgetDecision:
+        """Проверяет, укладывается ли запрос (запрос плюс максимум ответа) в бюджет"""
+        remaining = self.remaining(user_id)
+        if remaining is None or prompt_tokens + max_tokens <= remaining:
+            return BudgetDecision("allow", max_tokens)
+
+        reason = f"запрос {prompt_tokens}+{max_tokens} токенов, остаток бюджета {max(remaining, 0)}"
+        if self.action == ACTION_WARN:
+            self.warnings += 1
+            logger.warning(f"Бюджет токенов пользователя {user_id} превышен: {reason}")
+            return BudgetDecision(ACTION_WARN, max_tokens, reason=reason)
+        if self.action == ACTION_TRUNCATE and remaining >= self.min_completion_tokens * 2:
+            self.truncated += 1
+            completion = max(self.min_completion_tokens, min(max_tokens, remaining // 4))
+            return BudgetDecision(ACTION_TRUNCATE, completion, remaining - completion, reason)
+        self.blocked += 1
+        logger.warning(f"Запрос пользователя {user_id} заблокирован бюджетом: {reason}")
+        return BudgetDecision(ACTION_BLOCK, 0, reason=reason)
+
+    def charge(self, user_id: Optional[int], model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """Учитывает фактический расход запроса (user_id None - запросы без пользователя, например заготовки)"""
+        self._roll_day()
+        tokens = prompt_tokens + completion_tokens
+        self.total_usage += tokens
+        if user_id is not None:
+            self.user_usage[user_id] = self.user_usage.get(user_id, 0) + tokens
+        self._dirty = True
+        if self.state_path and time.monotonic() - self._saved_at >= self.flush_interval:
+            try:
+                self.save()
+            except OSError as e:
+                logger.error(f"Не удалось сохранить расход токенов: {e}")
+        if user_id is None:
+            return
+        usage = self.dialog_usage.setdefault(user_id, {"requests": 0, "tokens": 0, "cost": 0.0})
+        usage["requests"] += 1
+        usage["tokens"] += tokens
+        usage["cost"] += estimate_cost(model, prompt_tokens, completion_tokens)
+
+    def finish_dialog(self, user_id: int, reason: str) -> Optional[Dict]:
+        """Закрывает учет диалога и возвращает его расход"""
+        usage = self.dialog_usage.pop(user_id, None)
+        if usage is None:
+            return None
+        self.finished_costs.append(usage["cost"])
+        self.finished_by_reason.setdefault(reason, deque(maxlen=self.window)).append(usage["cost"])
+        return usage
+
+    def forget_dialog(self, user_id: int) -> None:
+        """Сброс диалога без завершения"""
+        self.dialog_usage.pop(user_id, None)
+
+    def get_stats(self) -> Dict:
+        finished = list(self.finished_costs)
+        return {
+            "action": self.action,
+            "total_tokens_today": self.total_usage,
+            "warnings": self.warnings,
+            "truncated": self.truncated,
+            "blocked": self.blocked,
+            "finished_dialogs": len(finished),
+            "expected_dialog_cost": sum(finished) / len(finished) if finished else None,
+            "dialog_cost_by_reason": {
+                reason: sum(costs) / len(costs) for reason, costs in self.finished_by_reason.items() if costs
+            },
+        }
+
+
+def truncate_messages(messages: List[Dict], counter: TokenCounter, max_prompt_tokens: int) -> Tuple[List[Dict], int]:
+    """Убирает самые старые сообщения истории (суперпромт и последнее сообщение остаются), пока запрос не влезет"""
+    head, history, tail = messages[:1], messages[1:-1], messages[-1:]
+    total = counter.count_messages(messages)
+    while history and total > max_prompt_tokens:
+        removed = history.pop(0)
+        total -= TOKENS_PER_MESSAGE + counter.count_text(removed["content"])
+    return head + history + tail, total